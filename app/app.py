@@ -2,12 +2,16 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from datetime import datetime, timedelta, timezone
 
-from routers import user_route, leagues_route, matches_route, url_submission_route, file_upload_route
+import common
+from config import REQUEST_DEADLINE_SECONDS
+from core.deadline import DeadlineMiddleware
+from routers import user_route, leagues_route, matches_route, url_submission_route, file_upload_route, metrics_route, batch_route
 
 app = FastAPI(title="User Login API", version="1.0.0")
 
@@ -20,21 +24,38 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+# Per-request deadline, cancels BigQuery jobs of requests that time out or disconnect
+app.add_middleware(DeadlineMiddleware, timeout=REQUEST_DEADLINE_SECONDS, exempt_paths=["/url_submission/events"])
 
 services_initialized = True
 #import route
-for r in user_route, leagues_route, matches_route, url_submission_route, file_upload_route:
-    if r.is_ready:
+for r in user_route, leagues_route, matches_route, url_submission_route, file_upload_route, metrics_route, batch_route:
+    if r.is_ready():
         app.include_router(r.router)
         print("Add router: ", str(r.router.tags))
     else:
         services_initialized = False
 
+@app.on_event("shutdown")
+def save_cache_snapshot():
+    """Persist warm caches so the next cold start begins warm"""
+    if common.cache_snapshotter:
+        common.cache_snapshotter.save()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc)}
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 503 until every dependency initialized and every router is mounted"""
+    report = common.startup.report()
+    report["ready"] = report["ready"] and services_initialized
+    if not report["ready"]:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=report)
+    return report
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8080) 
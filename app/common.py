@@ -1,70 +1,212 @@
-from config import SERVICE_ACCOUNT_PATH, PROJECT_ID, DATASET_NAME, TABLE_NAME
-from core.bigquery import BigQueryClient
+from config import SERVICE_ACCOUNT_PATH, PROJECT_ID, DATASET_NAME, TABLE_NAME, SSE_CLIENT_BUFFER_SIZE, SSE_HISTORY_SIZE
+from config import STARTUP_TIMEOUT_SECONDS, READINESS_CHECK_INTERVAL_SECONDS, CACHE_SNAPSHOT_URI, CACHE_SNAPSHOT_INTERVAL_SECONDS, CACHE_SNAPSHOT_WARM_TTL_SECONDS
+from config import COMPACTION_ENABLED, COMPACTION_OFF_PEAK_HOURS, COMPACTION_INTERVAL_SECONDS, COMPACTION_RETENTION_HOURS, COMPACTION_BATCH_SIZE
+from config import REPOSITORY_BACKEND, SQL_DATABASE_URL, SQL_POOL_SIZE, SQL_MAX_OVERFLOW, SQL_POOL_TIMEOUT_SECONDS
+from config import SQL_BOOTSTRAP_FROM_BIGQUERY, SQL_EXPORT_ENABLED, SQL_EXPORT_INTERVAL_SECONDS, SQL_EXPORT_SINGLE_INSTANCE
+from config import REPLICA_ENABLED, REPLICA_SYNC_INTERVAL_SECONDS, REPLICA_MAX_STALENESS_SECONDS, REPLICA_FULL_SYNC_INTERVAL_SECONDS
+from config import REPLICA_WATERMARK_OVERLAP_SECONDS, SEARCH_INDEX_ENABLED, SEARCH_INDEX_REBUILD_INTERVAL_SECONDS
+from config import IMAGE_HASH_INDEX_ENABLED, IMAGE_HASH_INDEX_REBUILD_INTERVAL_SECONDS
+from config import LIVENESS_ENABLED, LIVENESS_INTERVAL_SECONDS, LIVENESS_FINAL_STATUSES, LIVENESS_LIVE_STATUS, LIVENESS_DEAD_STATUS
+from config import LIVENESS_CONCURRENCY, LIVENESS_PER_HOST, LIVENESS_HOST_DELAY_SECONDS, LIVENESS_TIMEOUT_SECONDS
+from config import LIVENESS_BATCH_SIZE, LIVENESS_USER_AGENT, LIVENESS_MAX_REDIRECTS, LIVENESS_ALLOW_PRIVATE_ADDRESSES
+from core.bigquery import BigQueryClient, query_cache
+from core.cache_backend import create_cache_backend
+from core.compactor import PurgeCompactor
+from core import metrics
+from core.events import EventBroker
+from core.snapshot import CacheSnapshotter
+from core.startup import Startup
+from core.versioning import write_generations
 from repository.bigquery_league_repo import LeagueRepository
 from repository.bigquery_match_repo import MatchRepository
 from repository.bigquery_user_repo import UserRepository
 from repository.bigquery_url_submission_repo import UrlSubmissionRepository
 from repository.gcs_file_repo import GCSFileRepository
 from repository.bigquery_fileinfo_repo import DbFileInfoRepository
+from repository.url_submission_replica import UrlSubmissionReplica
+from repository.url_search_index import UrlSearchIndex
 from service.league_svc import LeagueSvc
 from service.match_svc import MatchSvc
 from service.login_svc import LoginSvc
 from service.user_svc import UserSvc
 from service.url_submission_svc import UrlSubmissionSvc
-from service.file_upload_svc import FileUploadSvc
-
-## bigquery client init
-get_bigquery_client=None
-try:
-    # Init bigquery client
-    bqclient = BigQueryClient(SERVICE_ACCOUNT_PATH, PROJECT_ID)
-    get_bigquery_client = bqclient.get_bigquery_client
-    bqClient_init = True
-except:
-    bqClient_init = False
-
-if get_bigquery_client:
-    try:
-        # Init user repo
-        user_repo = UserRepository(get_bigquery_client(), PROJECT_ID, DATASET_NAME, TABLE_NAME)
-        # Init login service
-        login_svc = LoginSvc(user_repo)
-        # Init user service
-        user_svc = UserSvc(user_repo)
-    except:
-        user_svc = None
-        login_svc = None
-
-    try:
-        # Init league repo
-        league_repo = LeagueRepository(get_bigquery_client(), PROJECT_ID, DATASET_NAME, "leagues")
-        # Init league service
-        league_svc = LeagueSvc(league_repo)
-    except:
-        league_svc = None
-    
-    try:
-        # Init match repo
-        match_repo = MatchRepository(get_bigquery_client(), PROJECT_ID, DATASET_NAME, table_name="matches", league_table_name="leagues")
-        # Init match service
-        match_svc = MatchSvc(match_repo)
-    except:
-        match_svc = None
-
-    try:
-        # Init url submission repo
-        url_submission_repo = UrlSubmissionRepository(get_bigquery_client(), PROJECT_ID, DATASET_NAME, "url_submission")
-        # Init url submission service
-        url_submission_svc = UrlSubmissionSvc(url_submission_repo)
-    except:
-        url_submission_svc = None
-
-    try:
-        # Init GCS file repo
-        gcs_file_repo = GCSFileRepository(bucket_name="web_anti", project_id=PROJECT_ID)
-        # Init fileinfo db
-        db_fileinfo_repo = DbFileInfoRepository(get_bigquery_client(), PROJECT_ID, DATASET_NAME, "uploadfile")
-        # Init file upload service
-        file_upload_svc = FileUploadSvc(gcs_file_repo, db_fileinfo_repo)
-    except:
-        file_upload_svc = None
\ No newline at end of file
+
+## cache backend init, shared across instances when CACHE_BACKEND=redis
+cache_backend = create_cache_backend()
+query_cache.use_backend(cache_backend)
+write_generations.attach(cache_backend)
+
+## clients and services init, in parallel; a failed or slow dependency only
+## takes down the services built on it and shows up on /ready. Optional heavy
+## modules (sqlalchemy, numpy/Pillow, aiohttp) are imported by the factories
+## that need them, so they load in parallel and only when enabled
+startup = Startup()
+
+def init_bigquery():
+    client = BigQueryClient(SERVICE_ACCOUNT_PATH, PROJECT_ID).get_bigquery_client()
+    # one metadata call, so readiness means the credentials actually work
+    client.get_dataset(f"{PROJECT_ID}.{DATASET_NAME}")
+    return client
+
+def check_bigquery(client):
+    client.get_dataset(f"{PROJECT_ID}.{DATASET_NAME}", timeout=STARTUP_TIMEOUT_SECONDS)
+
+def init_sql():
+    from core.sql import create_sql_engine, init_schema
+    engine = create_sql_engine(SQL_DATABASE_URL, SQL_POOL_SIZE, SQL_MAX_OVERFLOW, SQL_POOL_TIMEOUT_SECONDS)
+    init_schema(engine)
+    return engine
+
+def check_sql(engine):
+    from core.sql import ping
+    ping(engine)
+
+def url_submission_service(url_submission_repo):
+    """URL submission service, with its local replica and search index (kept in the background) when enabled"""
+    replica = None
+    if REPLICA_ENABLED:
+        replica = UrlSubmissionReplica(url_submission_repo, REPLICA_SYNC_INTERVAL_SECONDS, REPLICA_MAX_STALENESS_SECONDS,
+                                       REPLICA_FULL_SYNC_INTERVAL_SECONDS, REPLICA_WATERMARK_OVERLAP_SECONDS)
+        replica.start()
+        metrics.register("url_submission_replica", replica.stats)
+    search_index = None
+    if SEARCH_INDEX_ENABLED:
+        search_index = UrlSearchIndex(url_submission_repo, SEARCH_INDEX_REBUILD_INTERVAL_SECONDS)
+        search_index.start()
+        metrics.register("url_search_index", search_index.stats)
+    events = EventBroker(history_size=SSE_HISTORY_SIZE, buffer_size=SSE_CLIENT_BUFFER_SIZE)
+    # with Redis, clients of every instance see every instance's writes
+    events.attach(cache_backend)
+    return UrlSubmissionSvc(url_submission_repo, events, replica, search_index)
+
+def file_upload_service(db_fileinfo_repo):
+    """File upload service, with the image hash index (built in the background) when enabled"""
+    from repository.image_hash_index import ImageHashIndex
+    from service.file_upload_svc import FileUploadSvc
+    # the storage client itself is created on the first upload
+    gcs_file_repo = GCSFileRepository(bucket_name="web_anti", project_id=PROJECT_ID)
+    image_hash_index = None
+    if IMAGE_HASH_INDEX_ENABLED:
+        image_hash_index = ImageHashIndex(db_fileinfo_repo, IMAGE_HASH_INDEX_REBUILD_INTERVAL_SECONDS)
+        image_hash_index.start()
+        metrics.register("image_hash_index", image_hash_index.stats)
+    return FileUploadSvc(gcs_file_repo, db_fileinfo_repo, image_hash_index)
+
+def init_sql_bootstrap(engine, client):
+    from core.sql_export import bootstrap_from_bigquery
+    return bootstrap_from_bigquery(engine, client, PROJECT_ID, DATASET_NAME)
+
+if REPOSITORY_BACKEND == "sql":
+    # repositories on the SQL database; BigQuery only feeds the bootstrap and receives the export
+    def init_user(engine):
+        from repository.sql_user_repo import SqlUserRepository
+        user_repo = SqlUserRepository(engine)
+        return LoginSvc(user_repo), UserSvc(user_repo)
+
+    def init_league(engine):
+        from repository.sql_league_repo import SqlLeagueRepository
+        return LeagueSvc(SqlLeagueRepository(engine))
+
+    def init_match(engine):
+        from repository.sql_match_repo import SqlMatchRepository
+        return MatchSvc(SqlMatchRepository(engine))
+
+    def init_url_submission(engine):
+        from repository.sql_url_submission_repo import SqlUrlSubmissionRepository
+        return url_submission_service(SqlUrlSubmissionRepository(engine))
+
+    def init_file_upload(engine):
+        from repository.sql_fileinfo_repo import SqlDbFileInfoRepository
+        return file_upload_service(SqlDbFileInfoRepository(engine))
+
+    startup.add("bigquery", init_bigquery, timeout=STARTUP_TIMEOUT_SECONDS, required=False, check=check_bigquery)
+    startup.add("sql", init_sql, timeout=STARTUP_TIMEOUT_SECONDS, check=check_sql)
+    if SQL_BOOTSTRAP_FROM_BIGQUERY:
+        startup.add("sql_bootstrap", init_sql_bootstrap, depends_on=["sql", "bigquery"], timeout=STARTUP_TIMEOUT_SECONDS, required=False)
+    startup.add("user", init_user, depends_on=["sql"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("league", init_league, depends_on=["sql"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("match", init_match, depends_on=["sql"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("url_submission", init_url_submission, depends_on=["sql"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("file_upload", init_file_upload, depends_on=["sql"], timeout=STARTUP_TIMEOUT_SECONDS)
+else:
+    def init_user(client):
+        user_repo = UserRepository(client, PROJECT_ID, DATASET_NAME, TABLE_NAME)
+        return LoginSvc(user_repo), UserSvc(user_repo)
+
+    def init_url_submission(client):
+        return url_submission_service(UrlSubmissionRepository(client, PROJECT_ID, DATASET_NAME, "url_submission"))
+
+    def init_file_upload(client):
+        return file_upload_service(DbFileInfoRepository(client, PROJECT_ID, DATASET_NAME, "uploadfile"))
+
+    startup.add("bigquery", init_bigquery, timeout=STARTUP_TIMEOUT_SECONDS, check=check_bigquery)
+    startup.add("user", init_user, depends_on=["bigquery"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("league", lambda client: LeagueSvc(LeagueRepository(client, PROJECT_ID, DATASET_NAME, "leagues")),
+                depends_on=["bigquery"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("match", lambda client: MatchSvc(MatchRepository(client, PROJECT_ID, DATASET_NAME, table_name="matches", league_table_name="leagues")),
+                depends_on=["bigquery"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("url_submission", init_url_submission, depends_on=["bigquery"], timeout=STARTUP_TIMEOUT_SECONDS)
+    startup.add("file_upload", init_file_upload, depends_on=["bigquery"], timeout=STARTUP_TIMEOUT_SECONDS)
+
+def init_url_liveness(url_submission_svc):
+    """Liveness checks of submitted URLs, written back as their status"""
+    from service.url_liveness_svc import UrlLivenessSvc
+    url_liveness_svc = UrlLivenessSvc(url_submission_svc, LIVENESS_FINAL_STATUSES, LIVENESS_LIVE_STATUS, LIVENESS_DEAD_STATUS,
+                                      LIVENESS_INTERVAL_SECONDS, LIVENESS_CONCURRENCY, LIVENESS_PER_HOST,
+                                      LIVENESS_HOST_DELAY_SECONDS, LIVENESS_TIMEOUT_SECONDS, LIVENESS_BATCH_SIZE, LIVENESS_USER_AGENT,
+                                      LIVENESS_MAX_REDIRECTS, lease_backend=cache_backend if cache_backend.shared else None,
+                                      allow_private=LIVENESS_ALLOW_PRIVATE_ADDRESSES)
+    url_liveness_svc.start()
+    metrics.register("url_liveness", url_liveness_svc.stats)
+    return url_liveness_svc
+
+if LIVENESS_ENABLED:
+    # background only, requests don't wait on it
+    startup.add("url_liveness", init_url_liveness, depends_on=["url_submission"], timeout=STARTUP_TIMEOUT_SECONDS, required=False)
+startup.run()
+startup.start(READINESS_CHECK_INTERVAL_SECONDS)
+metrics.register("startup", startup.report)
+
+bigquery_client = startup.get("bigquery")
+sql_engine = startup.get("sql")
+login_svc, user_svc = startup.get("user") or (None, None)
+league_svc = startup.get("league")
+match_svc = startup.get("match")
+url_submission_svc = startup.get("url_submission")
+file_upload_svc = startup.get("file_upload")
+url_liveness_svc = startup.get("url_liveness")
+
+## warm cache snapshot, loaded before the routers start serving
+cache_snapshotter = None
+if bigquery_client and CACHE_SNAPSHOT_URI and REPOSITORY_BACKEND != "sql":
+    cache_snapshotter = CacheSnapshotter(query_cache, CACHE_SNAPSHOT_URI, CACHE_SNAPSHOT_INTERVAL_SECONDS, CACHE_SNAPSHOT_WARM_TTL_SECONDS)
+    cache_snapshotter.start(bigquery_client)
+    metrics.register("cache_snapshot", cache_snapshotter.stats)
+
+## purge of soft-deleted rows, off-peak
+purge_compactor = None
+if bigquery_client and COMPACTION_ENABLED and REPOSITORY_BACKEND != "sql":
+    purge_compactor = PurgeCompactor(bigquery_client, COMPACTION_OFF_PEAK_HOURS, COMPACTION_INTERVAL_SECONDS,
+                                     COMPACTION_RETENTION_HOURS, COMPACTION_BATCH_SIZE,
+                                     lease_backend=cache_backend if cache_backend.shared else None)
+    purge_compactor.add(f"{PROJECT_ID}.{DATASET_NAME}.leagues", "league_id")
+    purge_compactor.add(f"{PROJECT_ID}.{DATASET_NAME}.matches", "match_id")
+    purge_compactor.add(f"{PROJECT_ID}.{DATASET_NAME}.url_submission", "submission_id")
+    purge_compactor.add(f"{PROJECT_ID}.{DATASET_NAME}.uploadfile", "file_name")
+    purge_compactor.start()
+    metrics.register("purge_compactor", purge_compactor.stats)
+
+## SQL backend: pool metrics, and replication of changed tables to BigQuery
+sql_exporter = None
+if sql_engine:
+    from core.sql import pool_stats
+    from core.sql_export import BigQueryExporter
+    metrics.register("sql_pool", pool_stats(sql_engine))
+    if bigquery_client and SQL_EXPORT_ENABLED and sql_engine.dialect.name == "sqlite" and not SQL_EXPORT_SINGLE_INSTANCE:
+        # every instance has its own database, their exports would overwrite each other
+        print("Not starting the BigQuery export: the SQLite database is not shared, set SQL_EXPORT_SINGLE_INSTANCE=true "
+              "on the only instance that exports")
+    elif bigquery_client and SQL_EXPORT_ENABLED:
+        sql_exporter = BigQueryExporter(sql_engine, bigquery_client, PROJECT_ID, DATASET_NAME, SQL_EXPORT_INTERVAL_SECONDS)
+        sql_exporter.start()
+        metrics.register("sql_export", sql_exporter.stats)
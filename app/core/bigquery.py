@@ -1,8 +1,80 @@
-from os import getenv as os_getenv, path as os_path
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from io import BytesIO
+from json import dumps as json_dumps
+from os import getenv as os_getenv
+from typing import Callable, List, Optional
+from uuid import uuid4
 
 from fastapi import HTTPException, status
 from google.cloud import bigquery
-from google.oauth2 import service_account
+from google.cloud.bigquery._helpers import _rows_from_json
+from google.cloud.bigquery.retry import DEFAULT_RETRY
+from config import QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL_SECONDS
+from config import SHORT_QUERY_ENABLED, SHORT_QUERY_JOBLESS, SHORT_QUERY_TIMEOUT_SECONDS, SHORT_QUERY_MAX_RESULTS
+from core import metrics
+from core.cache import QueryCache
+from core.cache_backend import InProcessCacheBackend
+from core.deadline import DeadlineExceeded, RequestDeadline, current_deadline
+from core.hedge import HedgePolicy
+from core.limiter import bq_dml_limiter, bq_read_limiter
+from core.singleflight import SingleFlight
+from core.snapshot import warm_queries
+from core.transport import transport
+from core.versioning import write_generations
+
+# Concurrent identical reads share one query job
+read_flight = SingleFlight()
+metrics.register("bigquery_read_coalescing", read_flight.stats)
+# Short-lived results of repository reads that opted in
+# (in-process until common.py plugs in the configured backend)
+query_cache = QueryCache(InProcessCacheBackend(QUERY_CACHE_MAX_BYTES), default_ttl=QUERY_CACHE_TTL_SECONDS)
+metrics.register("query_cache", query_cache.stats)
+
+class RoundTripStats:
+    """BigQuery API requests made per read, by execution path"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # path -> [calls, round trips, max round trips]
+        self._paths = {}
+
+    def instrument(self, client: bigquery.Client):
+        """Count every API request the client's connection makes on the calling thread"""
+        connection = getattr(client, "_connection", None)
+        if connection is None or getattr(connection, "_round_trips_counted", False):
+            return
+        api_request = connection.api_request
+
+        def counted(*args, **kwargs):
+            self._local.count = getattr(self._local, "count", 0) + 1
+            return api_request(*args, **kwargs)
+
+        connection.api_request = counted
+        connection._round_trips_counted = True
+
+    def measure(self, path: Callable[[], tuple]) -> list:
+        """Run path() -> (path name, rows) and record the requests it made"""
+        self._local.count = 0
+        name, rows = path()
+        count = self._local.count
+        with self._lock:
+            stats = self._paths.setdefault(name, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += count
+            stats[2] = max(stats[2], count)
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {"calls": calls, "round_trips": total, "mean": round(total / calls, 2), "max": most}
+                for name, (calls, total, most) in self._paths.items()
+            }
+
+round_trips = RoundTripStats()
+metrics.register("bigquery_round_trips", round_trips.stats)
+metrics.register("http_transport", transport.stats)
 
 class BigQueryClient:
     def __init__(self, service_account_file, project_id) -> None:
@@ -15,20 +87,205 @@ class BigQueryClient:
 
     # BigQuery client initialization
     def create_bigquery_client(self):
-        """Initialize BigQuery client with service account credentials"""
+        """Initialize BigQuery client on the shared pooled transport"""
         try:
-            # Try to use service account file if available
-            if os_path.exists(self.SERVICE_ACCOUNT_PATH):
-                credentials = service_account.Credentials.from_service_account_file(
-                    self.SERVICE_ACCOUNT_PATH,
-                    scopes=["https://www.googleapis.com/auth/cloud-platform"]
-                )
-                return bigquery.Client(credentials=credentials, project=self.PROJECT_ID)
-            else:
-                # Use default credentials (for Cloud Run)
-                return bigquery.Client(project=self.PROJECT_ID)
+            # Service account file if available, else default credentials (for Cloud Run)
+            session = transport.configure(self.SERVICE_ACCOUNT_PATH, self.PROJECT_ID)
+            return bigquery.Client(credentials=transport.credentials, project=self.PROJECT_ID, _http=session)
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to initialize BigQuery client: {str(e)}"
             )
+
+def query_key(query: str, job_config: Optional[bigquery.QueryJobConfig] = None) -> tuple:
+    """Identity of a query: its text plus bound parameter values"""
+    params = ()
+    if job_config is not None and job_config.query_parameters:
+        params = tuple(json_dumps(p.to_api_repr(), sort_keys=True, default=str) for p in job_config.query_parameters)
+    return (query, params)
+
+def _with_deadline(job_config: Optional[bigquery.QueryJobConfig], deadline: Optional[RequestDeadline]) -> Optional[bigquery.QueryJobConfig]:
+    """Copy of job_config whose job times out with the request"""
+    if deadline is None:
+        return job_config
+    deadline.check()
+    config = bigquery.QueryJobConfig.from_api_repr(job_config.to_api_repr()) if job_config is not None else bigquery.QueryJobConfig()
+    # configuration.jobTimeoutMs, the installed client library has no property for it
+    config._properties["jobTimeoutMs"] = str(max(1, int(deadline.remaining() * 1000)))
+    return config
+
+def _wait(client: bigquery.Client, job, deadline: Optional[RequestDeadline]) -> list:
+    """Rows of a started query job, cancelled if the request runs out of time or goes away"""
+    if deadline is None:
+        return list(job.result())
+    deadline.track(client, job)
+    try:
+        return list(job.result(timeout=max(0.001, deadline.remaining())))
+    except FutureTimeoutError:
+        # result() gave up at the deadline, possibly before the middleware's timer fired
+        deadline.cancel("deadline exceeded")
+        raise DeadlineExceeded(deadline)
+    except Exception:
+        # a job cancelled because the request went away fails with an API error
+        if deadline.reason is None:
+            raise
+        raise DeadlineExceeded(deadline)
+    finally:
+        deadline.untrack(job)
+
+def _short_query(client: bigquery.Client, query: str, job_config: Optional[bigquery.QueryJobConfig],
+                 deadline: Optional[RequestDeadline] = None) -> tuple:
+    """One jobs.query request that returns the rows inline when the query finishes
+    within the timeout and fits in the first page (jobless when the API allows).
+    Anything bigger or slower continues on the job jobs.query created."""
+    wait_timeout = SHORT_QUERY_TIMEOUT_SECONDS if deadline is None else min(SHORT_QUERY_TIMEOUT_SECONDS, deadline.remaining())
+    query_and_wait = getattr(client, "query_and_wait", None)
+    if query_and_wait is not None:
+        # newer client libraries implement the same path
+        rows = query_and_wait(query, job_config=job_config, wait_timeout=wait_timeout,
+                              page_size=SHORT_QUERY_MAX_RESULTS)
+        return "short", list(rows)
+
+    config = job_config.to_api_repr() if job_config is not None else {}
+    request = config.get("query", {})
+    if "jobTimeoutMs" in config:
+        request["jobTimeoutMs"] = config["jobTimeoutMs"]
+    request.update({
+        "query": query,
+        "useLegacySql": False,
+        "timeoutMs": int(wait_timeout * 1000),
+        "maxResults": SHORT_QUERY_MAX_RESULTS,
+        "formatOptions": {"useInt64Timestamp": True},
+        "requestId": f"short_{uuid4().hex}",
+    })
+    if client.location:
+        request["location"] = client.location
+    if SHORT_QUERY_JOBLESS:
+        request["jobCreationMode"] = "JOB_CREATION_OPTIONAL"
+    response = client._call_api(
+        DEFAULT_RETRY,
+        span_name="BigQuery.query",
+        method="POST",
+        path=f"/projects/{client.project}/queries",
+        data=request,
+        timeout=wait_timeout + 5,
+    )
+    if response.get("jobComplete") and not response.get("pageToken"):
+        return "short", _rows_from_json(response.get("rows", []), response["schema"]["fields"])
+
+    job_reference = response.get("jobReference")
+    if not job_reference:
+        return "short_fallback", _wait(client, client.query(query, job_config=job_config), deadline)
+    # keep waiting on / paging through the job that already exists instead of rerunning it
+    job = client.get_job(job_reference["jobId"], project=job_reference.get("projectId"), location=job_reference.get("location"))
+    return "short_fallback", _wait(client, job, deadline)
+
+def run_query(client: bigquery.Client, query: str, job_config: Optional[bigquery.QueryJobConfig] = None, short: bool = True) -> list:
+    """Rows of a read query, via the short path for small reads unless disabled.
+    Inside a request the job times out with the request deadline and is cancelled
+    when the deadline passes or the client disconnects. Runs within the read
+    concurrency limit, raising Overloaded (503) when it is saturated."""
+    round_trips.instrument(client)
+    deadline = current_deadline.get()
+    job_config = _with_deadline(job_config, deadline)
+    with bq_read_limiter.slot(query):
+        if short and SHORT_QUERY_ENABLED:
+            return round_trips.measure(lambda: _short_query(client, query, job_config, deadline))
+        return round_trips.measure(lambda: ("job", _wait(client, client.query(query, job_config=job_config), deadline)))
+
+def fetch_rows(client: bigquery.Client, query: str, job_config: Optional[bigquery.QueryJobConfig] = None,
+               tables: Optional[List[str]] = None, ttl: Optional[float] = None, warm: bool = False, short: bool = True,
+               hedge: Optional[HedgePolicy] = None) -> list:
+    """Run a read query and return its rows, coalescing identical concurrent calls.
+    With tables (every table the query reads) and ttl the result is cached until it
+    expires or one of the tables is written; warm=True also keeps it in the startup
+    snapshot. short=False skips the short query path, for reads known to be large.
+    A hedge policy duplicates the query when it is slower than usual (point reads only).
+    Rows may be shared between callers and must not be modified."""
+    key = query_key(query, job_config)
+    cacheable = bool(tables) and bool(ttl)
+    if cacheable and warm:
+        warm_queries.record(key, query, job_config, tables, ttl)
+    if cacheable:
+        rows = query_cache.get(key)
+        if rows is not None:
+            return rows
+
+    def load(generations):
+        if hedge is not None:
+            rows = hedge.run(lambda: run_query(client, query, job_config, short))
+        else:
+            rows = run_query(client, query, job_config, short)
+        if cacheable:
+            query_cache.put(key, rows, generations, ttl)
+        return rows
+
+    def flight():
+        # a call started before a write must not hand its rows to one started after it
+        generations = QueryCache.generations(tables) if tables else ()
+        return read_flight.do((key, generations), lambda: load(generations))
+
+    try:
+        return flight()
+    except DeadlineExceeded as e:
+        # the shared job belonged to another caller's request, run it again under ours
+        deadline = current_deadline.get()
+        if e.deadline.within(deadline) or (deadline is not None and deadline.done()):
+            raise
+        return flight()
+
+def run_dml(client: bigquery.Client, query: str, job_config: Optional[bigquery.QueryJobConfig] = None, table_id: Optional[str] = None):
+    """Run a DML statement to completion and bump the write generation of table_id.
+    The job times out with the request deadline but is not cancelled on disconnect:
+    the client asked for the write, so it is allowed to land."""
+    job_config = _with_deadline(job_config, current_deadline.get())
+    with bq_dml_limiter.slot(query):
+        query_job = client.query(query, job_config=job_config)
+        try:
+            query_job.result()
+        finally:
+            if table_id:
+                write_generations.bump(table_id)
+    return query_job
+
+def create_table(client: bigquery.Client, table: bigquery.Table) -> bigquery.Table:
+    """Create a (scratch) table within the DML concurrency limit, timing out with the request deadline"""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+    with bq_dml_limiter.slot("create table"):
+        return client.create_table(table, timeout=deadline.remaining() if deadline is not None else None)
+
+def delete_table(client: bigquery.Client, table_id: str):
+    """Drop a (scratch) table within the DML concurrency limit. Also runs for requests past their
+    deadline, as cleanup, so it gets at least a second"""
+    deadline = current_deadline.get()
+    with bq_dml_limiter.slot("delete table"):
+        client.delete_table(table_id, not_found_ok=True,
+                            timeout=max(1.0, deadline.remaining()) if deadline is not None else None)
+
+def run_load(client: bigquery.Client, rows: List[dict], table_id: str, schema: Optional[List[bigquery.SchemaField]] = None,
+             bump: bool = True, write_disposition: str = bigquery.WriteDisposition.WRITE_APPEND):
+    """Append rows to table_id with one load job (WRITE_TRUNCATE replaces its contents)
+    and bump its write generation (bump=False for scratch tables nobody reads through the cache).
+    Load jobs don't count against DML quotas and land all rows or none; columns
+    missing from the rows are left NULL. JSON-serializable values only."""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+    data = BytesIO("\n".join(json_dumps(row) for row in rows).encode("utf-8"))
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=write_disposition,
+    )
+    if schema is not None:
+        job_config.schema = schema
+    with bq_dml_limiter.slot(f"load {table_id}"):
+        load_job = client.load_table_from_file(data, table_id, job_config=job_config)
+        try:
+            load_job.result()
+        finally:
+            if bump:
+                write_generations.bump(table_id)
+    return load_job
@@ -0,0 +1,102 @@
+import sys
+import threading
+from hashlib import sha1
+from typing import Hashable, List, Optional, Tuple
+
+from google.cloud.bigquery import Row
+
+from core.cache_backend import ICacheBackend
+from core.versioning import write_generations
+
+def estimate_size(rows: list) -> int:
+    """Rough memory footprint of a list of rows, good enough for a budget"""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        values = row.values() if hasattr(row, "values") else row
+        size += sys.getsizeof(row)
+        for value in values:
+            size += sys.getsizeof(value)
+    return size
+
+def pack_rows(rows: list) -> tuple:
+    """BigQuery rows as (field names, value tuples), which pickles cleanly"""
+    if not rows:
+        return ((), [])
+    return (tuple(rows[0].keys()), [tuple(row.values()) for row in rows])
+
+def unpack_rows(packed: tuple) -> list:
+    fields, values = packed
+    field_to_index = {name: i for i, name in enumerate(fields)}
+    return [Row(v, field_to_index) for v in values]
+
+class QueryCache:
+    """Query results keyed by (SQL, params), tagged by the tables they read.
+
+    An entry is only served while the write generation of every table it read is
+    unchanged, so DML through a repository invalidates dependent entries at once.
+    Storage, expiry and eviction are up to the backend."""
+    def __init__(self, backend: ICacheBackend, default_ttl: float):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        write_generations.add_listener(self.invalidate_table)
+
+    def use_backend(self, backend: ICacheBackend):
+        self.backend = backend
+
+    @staticmethod
+    def cache_key(key: Hashable) -> str:
+        return "q:" + sha1(repr(key).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def generations(tables: List[str]) -> Tuple[Tuple[str, int], ...]:
+        """Snapshot of table generations, take it before running the query"""
+        return tuple((t, write_generations.get(t)) for t in tables)
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: Hashable) -> Optional[list]:
+        entry = self.backend.get(self.cache_key(key))
+        if entry is None:
+            self._count(False)
+            return None
+        generations, rows = entry
+        if any(write_generations.get(t) != g for t, g in generations):
+            self._count(False)
+            return None
+        self._count(True)
+        return unpack_rows(rows) if self.backend.shared else rows
+
+    def put(self, key: Hashable, rows: list, generations: Tuple[Tuple[str, int], ...], ttl: Optional[float] = None):
+        # A write landed while the query ran, the result may already be stale
+        if any(write_generations.get(t) != g for t, g in generations):
+            return
+        value = (generations, pack_rows(rows) if self.backend.shared else rows)
+        self.backend.set(self.cache_key(key), value, ttl or self.default_ttl,
+                         size=estimate_size(rows), tags=[t for t, _ in generations])
+
+    def invalidate_table(self, table_id: str):
+        """Drop every entry that read table_id (generations already hide them)"""
+        with self._lock:
+            self.invalidations += 1
+        self.backend.invalidate_tag(table_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+        stats.update(self.backend.stats())
+        return stats
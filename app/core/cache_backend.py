@@ -0,0 +1,273 @@
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from config import CACHE_BACKEND, CACHE_GENERATION_RESYNC_SECONDS, QUERY_CACHE_MAX_BYTES, REDIS_URL
+
+class ICacheBackend(ABC):
+    # True when entries and generations are visible to every instance
+    shared = False
+
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float, size: int = 0, tags: Iterable[str] = ()):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def invalidate_tag(self, tag: str):
+        pass
+
+    @abstractmethod
+    def incr(self, counter: str) -> int:
+        pass
+
+    @abstractmethod
+    def get_int(self, counter: str) -> int:
+        pass
+
+    @abstractmethod
+    def publish(self, message: str, channel: str = "invalidate"):
+        """Send a message to the other instances (cache invalidations by default)"""
+        pass
+
+    @abstractmethod
+    def listen(self, callback: Callable[[str], None], resync: Optional[Callable[[], None]] = None,
+               channel: str = "invalidate"):
+        """Deliver messages published on channel by the other instances to callback.
+        resync is called whenever messages may have been missed (reconnects) and periodically"""
+        pass
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take the named lease for ttl seconds, or renew it if owner already holds it"""
+        pass
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
+
+class InProcessCacheBackend(ICacheBackend):
+    """LRU dict with a byte budget, private to this instance"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (expires_at, size, tags, value)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_tag: Dict[str, set] = {}
+        self._counters: Dict[str, int] = {}
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[3]
+
+    def set(self, key: str, value: Any, ttl: float, size: int = 0, tags: Iterable[str] = ()):
+        if size > self.max_bytes:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, tags, value)
+            self._bytes += size
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag: str):
+        with self._lock:
+            for key in list(self._by_tag.get(tag, ())):
+                self._remove(key)
+
+    def incr(self, counter: str) -> int:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + 1
+            return self._counters[counter]
+
+    def get_int(self, counter: str) -> int:
+        with self._lock:
+            return self._counters.get(counter, 0)
+
+    def publish(self, message: str, channel: str = "invalidate"):
+        # single instance, nobody to tell
+        pass
+
+    def listen(self, callback: Callable[[str], None], resync: Optional[Callable[[], None]] = None,
+               channel: str = "invalidate"):
+        pass
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        # nobody else to share with
+        return True
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        for tag in entry[2]:
+            keys = self._by_tag.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+class RedisCacheBackend(ICacheBackend):
+    """Cache shared by all instances through Redis (or anything speaking its protocol).
+
+    Entries are pickled, so only point this at a Redis the service trusts. Every
+    Redis error is swallowed and counted: the cache must never fail a request."""
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "web_anti:", client=None, resync_interval: float = CACHE_GENERATION_RESYNC_SECONDS):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.redis = client
+        self.prefix = prefix
+        self.resync_interval = resync_interval
+        self.errors = 0
+        self.resyncs = 0
+        # channel -> listener thread
+        self._listeners: Dict[str, threading.Thread] = {}
+
+    def _call(self, fn: Callable, default: Any = None) -> Any:
+        try:
+            return fn()
+        except Exception as e:
+            self.errors += 1
+            if self.errors % 100 == 1:
+                print(f"Redis cache error: {str(e)}")
+            return default
+
+    def get(self, key: str) -> Any:
+        data = self._call(lambda: self.redis.get(self.prefix + key))
+        return pickle.loads(data) if data else None
+
+    def set(self, key: str, value: Any, ttl: float, size: int = 0, tags: Iterable[str] = ()):
+        # tags are not tracked: entries carry the shared generations they were
+        # read at, and Redis expires them, so no eager invalidation is needed
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._call(lambda: self.redis.set(self.prefix + key, data, px=max(1, int(ttl * 1000))))
+
+    def delete(self, key: str):
+        self._call(lambda: self.redis.delete(self.prefix + key))
+
+    def invalidate_tag(self, tag: str):
+        pass
+
+    def incr(self, counter: str) -> int:
+        value = self._call(lambda: self.redis.incr(f"{self.prefix}gen:{counter}"))
+        if value is None:
+            raise ConnectionError("Redis unavailable")
+        return int(value)
+
+    def get_int(self, counter: str) -> int:
+        value = self._call(lambda: self.redis.get(f"{self.prefix}gen:{counter}"))
+        return int(value) if value else 0
+
+    def publish(self, message: str, channel: str = "invalidate"):
+        self._call(lambda: self.redis.publish(self.prefix + channel, message))
+
+    def listen(self, callback: Callable[[str], None], resync: Optional[Callable[[], None]] = None,
+               channel: str = "invalidate"):
+        def do_resync():
+            if resync is not None:
+                self.resyncs += 1
+                resync()
+
+        def run():
+            while True:
+                pubsub = None
+                try:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.prefix + channel)
+                    # anything published while we were not subscribed is lost, catch up
+                    do_resync()
+                    resync_at = time.monotonic() + self.resync_interval
+                    while True:
+                        message = pubsub.get_message(timeout=1.0)
+                        data = message.get("data") if message else None
+                        if isinstance(data, bytes):
+                            data = data.decode("utf-8")
+                        if data:
+                            callback(data)
+                        if time.monotonic() >= resync_at:
+                            do_resync()
+                            resync_at = time.monotonic() + self.resync_interval
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Redis {channel} listener error: {str(e)}")
+                    time.sleep(1)
+                finally:
+                    if pubsub is not None:
+                        try:
+                            pubsub.close()
+                        except Exception:
+                            pass
+
+        listener = threading.Thread(target=run, name=f"cache-{channel}", daemon=True)
+        self._listeners[channel] = listener
+        listener.start()
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        key = f"{self.prefix}lease:{name}"
+        px = max(1, int(ttl * 1000))
+        if self._call(lambda: self.redis.set(key, owner, nx=True, px=px)):
+            return True
+        holder = self._call(lambda: self.redis.get(key))
+        if holder is not None and holder.decode("utf-8") == owner:
+            # ours already: extend it
+            return bool(self._call(lambda: self.redis.pexpire(key, px)))
+        # held by another instance, or Redis is down: better skip than run twice
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "errors": self.errors,
+            "resyncs": self.resyncs,
+            "listening": sorted(channel for channel, listener in self._listeners.items() if listener.is_alive()),
+        }
+
+def create_cache_backend() -> ICacheBackend:
+    """Backend selected by CACHE_BACKEND, falling back to in-process"""
+    if CACHE_BACKEND == "redis":
+        try:
+            return RedisCacheBackend(REDIS_URL)
+        except Exception as e:
+            print(f"Failed to init Redis cache backend, using in-process cache: {str(e)}")
+    return InProcessCacheBackend(QUERY_CACHE_MAX_BYTES)
@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+from google.cloud import bigquery
+
+from core.bigquery import run_dml
+from core.cache_backend import ICacheBackend
+from core.limiter import BULK, priority
+from core.mutation_scheduler import exclusive, is_serialization_conflict
+
+# Column set by soft deletes, rows with it are hidden from every read
+TOMBSTONE_COLUMN = "deleted_at"
+
+def parse_hours(value: str) -> Tuple[int, int]:
+    """"2-6" -> (2, 6), a window that may wrap past midnight ("22-4")"""
+    start, _, end = value.partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+class PurgeCompactor:
+    """Physically deletes tombstoned rows, off-peak and in large batches.
+
+    Soft deletes only set deleted_at, so user-facing deletes are one cheap
+    UPDATE through the mutation queue. This purges rows whose tombstone is
+    older than the retention period, a batch of keys per DELETE, only inside
+    the off-peak window and at bulk priority. Purged rows were already
+    invisible, so cached reads stay valid.
+
+    Each DELETE holds the table's mutation queue, so it never runs next to
+    this instance's own updates. With a shared cache backend only the instance
+    holding the lease purges."""
+    def __init__(self, client: bigquery.Client, off_peak_hours: str, interval: float, retention_hours: float, batch_size: int,
+                 lease_backend: Optional[ICacheBackend] = None):
+        self.client = client
+        self.off_peak = parse_hours(off_peak_hours)
+        self.interval = interval
+        self.retention = timedelta(hours=retention_hours)
+        self.batch_size = batch_size
+        # table_id -> key column
+        self.tables: Dict[str, str] = {}
+        self.lease_backend = lease_backend
+        self.lease_owner = uuid4().hex
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.skipped_runs = 0
+        self.purged: Dict[str, int] = {}
+        self.conflicts = 0
+        self.errors = 0
+        self.last_run_at: Optional[str] = None
+
+    def add(self, table_id: str, key_column: str):
+        self.tables[table_id] = key_column
+        self.purged.setdefault(table_id, 0)
+
+    def in_off_peak(self, now: Optional[datetime] = None) -> bool:
+        hour = (now or datetime.now(timezone.utc)).hour
+        start, end = self.off_peak
+        if start == end:
+            return True
+        if start < end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def _purge_batch(self, table_id: str, key_column: str, cutoff: datetime) -> int:
+        query = f"""
+            DELETE FROM `{table_id}`
+            WHERE {TOMBSTONE_COLUMN} < @cutoff AND {key_column} IN (
+                SELECT {key_column} FROM `{table_id}`
+                WHERE {TOMBSTONE_COLUMN} < @cutoff
+                LIMIT @batch_size
+            )
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("cutoff", "TIMESTAMP", cutoff),
+                bigquery.ScalarQueryParameter("batch_size", "INT64", self.batch_size),
+            ]
+        )
+        with priority(BULK), exclusive(table_id):
+            job = run_dml(self.client, query, job_config)
+        return job.num_dml_affected_rows or 0
+
+    def purge(self, table_id: str) -> int:
+        """Purge every expired tombstone of one table, batch by batch"""
+        key_column = self.tables[table_id]
+        cutoff = datetime.now(timezone.utc) - self.retention
+        total = 0
+        while True:
+            if not self.holds_lease():
+                # another instance took over, it purges the rest
+                break
+            try:
+                deleted = self._purge_batch(table_id, key_column, cutoff)
+            except Exception as e:
+                if not is_serialization_conflict(e):
+                    raise
+                # someone else is writing the table, the rest waits for the next run
+                with self._lock:
+                    self.conflicts += 1
+                break
+            total += deleted
+            with self._lock:
+                self.purged[table_id] += deleted
+            if deleted < self.batch_size:
+                break
+        return total
+
+    def holds_lease(self) -> bool:
+        """Take or renew the lease on the purge, good for two intervals (always held without a backend)"""
+        if self.lease_backend is None:
+            return True
+        return self.lease_backend.acquire_lease("purge_compactor", self.lease_owner, 2 * self.interval)
+
+    def run_once(self, force: bool = False) -> Dict[str, int]:
+        """Purge all tables, unless outside the off-peak window (force ignores it)"""
+        if not force and not self.in_off_peak():
+            return {}
+        results = {}
+        for table_id in list(self.tables):
+            try:
+                results[table_id] = self.purge(table_id)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"Failed to purge deleted rows of {table_id}: {str(e)}")
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = datetime.now(timezone.utc).isoformat()
+        return results
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            if self.holds_lease():
+                self.run_once()
+            else:
+                with self._lock:
+                    self.skipped_runs += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="purge-compactor", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "off_peak_hours": f"{self.off_peak[0]}-{self.off_peak[1]}",
+                "in_off_peak": self.in_off_peak(),
+                "runs": self.runs,
+                "skipped_runs": self.skipped_runs,
+                "last_run_at": self.last_run_at,
+                "purged": dict(self.purged),
+                "conflicts": self.conflicts,
+                "errors": self.errors,
+            }
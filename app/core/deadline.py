@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException, status
+from core import metrics
+
+class DeadlineExceeded(HTTPException):
+    """A request ran out of time, or its client went away, while BigQuery work was pending"""
+    def __init__(self, deadline: "RequestDeadline"):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Request {deadline.reason or 'deadline exceeded'}")
+        self.deadline = deadline
+
+class DeadlineStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.deadlines_exceeded = 0
+        self.disconnects = 0
+        # jobs still running when their request expired or disconnected
+        self.jobs_abandoned = 0
+        self.jobs_cancelled = 0
+        self.cancel_errors = 0
+
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "deadlines_exceeded": self.deadlines_exceeded,
+                "disconnects": self.disconnects,
+                "jobs_abandoned": self.jobs_abandoned,
+                "jobs_cancelled": self.jobs_cancelled,
+                "cancel_errors": self.cancel_errors,
+            }
+
+deadline_stats = DeadlineStats()
+metrics.register("request_deadlines", deadline_stats.stats)
+
+# cancel reason -> request-level counter
+_CANCEL_COUNTERS = {"client disconnected": "disconnects", "deadline exceeded": "deadlines_exceeded"}
+
+class RequestDeadline:
+    """Time budget of one request plus the BigQuery jobs running on its behalf.
+    A child (one attempt of a hedged read, say) shares its parent's budget and
+    jobs, and can also be cancelled on its own."""
+    def __init__(self, timeout: float, parent: Optional["RequestDeadline"] = None):
+        self.parent = parent
+        self.expires_at = time.monotonic() + timeout
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self._reason: Optional[str] = None
+        self._lock = threading.Lock()
+        # job id -> (client, job)
+        self._jobs = {}
+
+    @property
+    def reason(self) -> Optional[str]:
+        """Why the work was stopped early, None while it may go on"""
+        if self._reason is not None or self.parent is None:
+            return self._reason
+        return self.parent.reason
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def done(self) -> bool:
+        return self.reason is not None or self.remaining() <= 0
+
+    def within(self, other: Optional["RequestDeadline"]) -> bool:
+        """True if this is other or one of its children"""
+        deadline = self
+        while deadline is not None:
+            if deadline is other:
+                return True
+            deadline = deadline.parent
+        return False
+
+    def check(self):
+        """Raise instead of starting new work on behalf of an expired request"""
+        if self.done():
+            self._reason = self.reason or "deadline exceeded"
+            raise DeadlineExceeded(self)
+
+    def track(self, client, job):
+        with self._lock:
+            self._jobs[job.job_id] = (client, job)
+            # cancelled while the job was being created, it missed the cancel
+            cancelled = self._reason is not None
+        if self.parent is not None:
+            self.parent.track(client, job)
+        if cancelled:
+            cancel_job(client, job)
+
+    def untrack(self, job):
+        with self._lock:
+            self._jobs.pop(job.job_id, None)
+        if self.parent is not None:
+            self.parent.untrack(job)
+
+    def cancel(self, reason: str, wait: bool = True):
+        """Mark the work as finished early and cancel its outstanding jobs
+        (in a background thread unless wait)"""
+        with self._lock:
+            if self._reason is not None:
+                return
+            self._reason = reason
+            jobs = list(self._jobs.values())
+        counter = _CANCEL_COUNTERS.get(reason)
+        if counter:
+            deadline_stats.add(counter)
+            deadline_stats.add("jobs_abandoned", len(jobs))
+        if not jobs:
+            return
+        if not wait:
+            threading.Thread(target=_cancel_jobs, args=(jobs,), name="job-cancel", daemon=True).start()
+            return
+        _cancel_jobs(jobs)
+
+def _cancel_jobs(jobs):
+    for client, job in jobs:
+        cancel_job(client, job)
+
+def cancel_job(client, job):
+    try:
+        client.cancel_job(job.job_id, project=job.project, location=job.location)
+        deadline_stats.add("jobs_cancelled")
+    except Exception as e:
+        deadline_stats.add("cancel_errors")
+        print(f"Failed to cancel job {job.job_id}: {str(e)}")
+
+# Deadline of the request being handled, None outside of requests
+current_deadline: ContextVar[Optional[RequestDeadline]] = ContextVar("current_deadline", default=None)
+
+class DeadlineMiddleware:
+    """Give every HTTP request a deadline (optionally shortened by an X-Request-Timeout
+    header in seconds) and cancel its BigQuery jobs once the deadline passes or the
+    client disconnects. Long-lived streams listed in exempt_paths get no deadline.
+    In-process sub-requests pass their parent's deadline in scope["parent_deadline"]."""
+    def __init__(self, app, timeout: float, exempt_paths=()):
+        self.app = app
+        self.timeout = timeout
+        self.exempt_paths = set(exempt_paths)
+
+    def _timeout(self, scope) -> float:
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-timeout":
+                try:
+                    return max(0.0, min(self.timeout, float(value)))
+                except ValueError:
+                    break
+        return self.timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = RequestDeadline(self._timeout(scope), parent=scope.get("parent_deadline"))
+        deadline_stats.add("requests")
+        loop = asyncio.get_running_loop()
+
+        def cancel(reason: str):
+            # cancelling jobs is a blocking API call, keep it off the event loop
+            loop.run_in_executor(None, deadline.cancel, reason)
+
+        timer = loop.call_later(deadline.remaining(), cancel, "deadline exceeded")
+        messages: asyncio.Queue = asyncio.Queue()
+        watcher: Optional[asyncio.Task] = None
+        response_complete = False
+
+        async def watch():
+            # after the body is read the only message left is http.disconnect
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    # servers also report disconnect once the response is sent
+                    if not response_complete:
+                        cancel("client disconnected")
+                    return
+
+        def start_watching():
+            nonlocal watcher
+            if watcher is None:
+                watcher = asyncio.ensure_future(watch())
+
+        async def receive_wrapper():
+            if watcher is not None:
+                return await messages.get()
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                start_watching()
+            elif message["type"] == "http.disconnect":
+                cancel("client disconnected")
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        if scope["method"] in ("GET", "HEAD", "DELETE"):
+            # no body to read, the handler may never call receive
+            start_watching()
+        token = current_deadline.set(deadline)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            current_deadline.reset(token)
+            timer.cancel()
+            if watcher is not None:
+                watcher.cancel()
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count
+from json import dumps as json_dumps, loads as json_loads
+from typing import Optional, Tuple
+from uuid import uuid4
+
+from core.projection import encode
+
+class Subscription:
+    """One connected client. Lives on the event loop that created it."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, league_id: Optional[str], match_id: Optional[str], buffer_size: int):
+        self.loop = loop
+        self.league_id = league_id
+        self.match_id = match_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.overflowed = False
+        self.gap = False
+        self.last_event_id: Optional[str] = None
+
+    def matches(self, event: dict) -> bool:
+        data = event["data"]
+        # Events without league/match (e.g. deletes) go to everyone
+        if self.league_id and data.get("league_id") not in (None, self.league_id):
+            return False
+        if self.match_id and data.get("match_id") not in (None, self.match_id):
+            return False
+        return True
+
+    def offer(self, event: dict):
+        """Queue an event for this client, must run on self.loop"""
+        if self.overflowed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: stop buffering, it has to resume with Last-Event-ID
+            self.overflowed = True
+
+def parse_event_id(event_id: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """"<epoch>.<sequence>" -> (epoch, sequence), (None, None) when malformed"""
+    epoch, _, sequence = (event_id or "").rpartition(".")
+    if not epoch or not sequence.isdigit():
+        return None, None
+    return epoch, int(sequence)
+
+class EventBroker:
+    """Fan-out of change events to SSE subscribers with a replay history.
+
+    Event ids are "<epoch>.<sequence>". The epoch is unique to this broker (start
+    time plus a random instance id), so an id from before a restart or from
+    another instance is recognized as foreign instead of being compared with
+    this broker's sequence.
+
+    Attached to a shared cache backend, events are also sent to the brokers of
+    the other instances, which deliver them under their own ids."""
+    channel = "events"
+
+    def __init__(self, history_size: int = 1000, buffer_size: int = 100):
+        self.buffer_size = buffer_size
+        self.epoch = f"{int(time.time() * 1000):x}-{uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._ids = count(1)
+        # (sequence, event)
+        self._history: deque = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._listeners = []
+        self._backend = None
+
+    def attach(self, backend):
+        """Exchange events with the other instances through a cache backend (no-op for in-process backends)"""
+        if not backend.shared:
+            return
+        self._backend = backend
+        backend.listen(self._on_remote_event, channel=self.channel)
+
+    def add_listener(self, listener):
+        """Call listener(event) synchronously on every publish (e.g. to keep a local replica current)"""
+        self._listeners.append(listener)
+
+    def publish(self, event_type: str, data: dict) -> dict:
+        """Publish an event, safe to call from any thread"""
+        event = self._dispatch(event_type, encode(data), encode(datetime.now(timezone.utc)))
+        backend = self._backend
+        if backend is not None:
+            backend.publish(json_dumps({"origin": self.epoch, "type": event_type, "data": event["data"],
+                                        "emitted_at": event["emitted_at"]}), channel=self.channel)
+        return event
+
+    def _on_remote_event(self, message: str):
+        try:
+            remote = json_loads(message)
+            if remote["origin"] == self.epoch:
+                # our own, already delivered
+                return
+            self._dispatch(remote["type"], remote["data"], remote["emitted_at"])
+        except (ValueError, KeyError, TypeError):
+            print(f"Ignoring event message: {message}")
+
+    def _dispatch(self, event_type: str, data: dict, emitted_at: str) -> dict:
+        """Number an event in this broker's epoch and deliver it to listeners and subscribers"""
+        event = {"id": "", "type": event_type, "data": data, "emitted_at": emitted_at}
+        with self._lock:
+            sequence = next(self._ids)
+            event["id"] = f"{self.epoch}.{sequence}"
+            self._history.append((sequence, event))
+            subscribers = list(self._subscribers)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Event listener failed on event {event['id']}: {str(e)}")
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # loop already closed
+                self.unsubscribe(sub)
+        return event
+
+    def subscribe(self, league_id: Optional[str] = None, match_id: Optional[str] = None,
+                  last_event_id: Optional[str] = None) -> Subscription:
+        """Register a subscriber, replaying history after last_event_id if given. An id from
+        another epoch (restart, other instance) or one no longer in history sets gap"""
+        sub = Subscription(asyncio.get_running_loop(), league_id, match_id, self.buffer_size)
+        sub.last_event_id = last_event_id
+        with self._lock:
+            self._subscribers.add(sub)
+            backlog = []
+            if last_event_id is not None:
+                epoch, last = parse_event_id(last_event_id)
+                if epoch != self.epoch:
+                    # ids of another broker say nothing about what was missed here
+                    sub.gap = True
+                else:
+                    if self._history and self._history[0][0] > last + 1:
+                        # Part of what the client missed is no longer in history
+                        sub.gap = True
+                    backlog = [e for sequence, e in self._history if sequence > last]
+        for event in backlog:
+            sub.offer(event)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+def format_sse(event: dict) -> str:
+    """Encode an event as a text/event-stream frame"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json_dumps(event)}\n\n"
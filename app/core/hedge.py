@@ -0,0 +1,149 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+from config import HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_BUDGET_PERCENT, HEDGE_MIN_DELAY_MS, HEDGE_MIN_SAMPLES, REQUEST_DEADLINE_SECONDS
+from config import LIMITER_BQ_READ_LIMIT, LIMITER_QUEUE_SIZE
+from core import metrics
+from core.deadline import RequestDeadline, current_deadline
+from core.limiter import bq_read_limiter
+
+# Attempts of hedged reads, shared by every policy. Sized for every attempt that can
+# hold or wait for a read slot; the limiter turns away anything beyond that, so the
+# pool itself never caps hedged reads (threads are only created when needed)
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(bq_read_limiter, "max_limit", LIMITER_BQ_READ_LIMIT * 4) + LIMITER_QUEUE_SIZE,
+    thread_name_prefix="hedge",
+)
+
+class HedgePolicy:
+    """Hedged execution of an idempotent read.
+
+    The read starts as usual; if it has not finished after the configured
+    percentile of recent latencies, a duplicate is started and whichever
+    finishes first wins. The other attempt's BigQuery jobs are cancelled in the
+    background (a job it is still creating is cancelled once it is tracked).
+    Every read earns budget_percent/100 of a hedge, so hedges never add more
+    than that share of extra load."""
+    def __init__(self, name: str, percentile: float, budget_percent: float, min_delay_ms: float,
+                 min_samples: int, window: int = 500):
+        self.name = name
+        self.percentile = percentile
+        self.budget_ratio = budget_percent / 100
+        self.min_delay = min_delay_ms / 1000
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        # hedges may burst a little above the ratio after a quiet period
+        self._budget = 0.0
+        self._max_budget = max(1.0, 20 * self.budget_ratio)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.budget_denied = 0
+        self.errors = 0
+
+    def _percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None until enough latencies are known"""
+        value = self._percentile(self.percentile)
+        return None if value is None else max(self.min_delay, value)
+
+    def _record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._budget >= 1:
+                self._budget -= 1
+                self.hedged += 1
+                return True
+            self.budget_denied += 1
+            return False
+
+    def _start(self, fn: Callable[[], Any], parent: Optional[RequestDeadline]):
+        """Run fn in the pool under its own child deadline, so it can be cancelled alone"""
+        attempt = RequestDeadline(parent.remaining() if parent else REQUEST_DEADLINE_SECONDS, parent=parent)
+        context = contextvars.copy_context()
+        started = time.monotonic()
+
+        def run():
+            current_deadline.set(attempt)
+            result = fn()
+            self._record(time.monotonic() - started)
+            return result
+
+        return _executor.submit(context.run, run), attempt
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.calls += 1
+            self._budget = min(self._max_budget, self._budget + self.budget_ratio)
+        delay = self.delay()
+        parent = current_deadline.get()
+        primary, primary_deadline = self._start(fn, parent)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            return primary.result()
+
+        hedge, hedge_deadline = self._start(fn, parent)
+        attempts = {primary: primary_deadline, hedge: hedge_deadline}
+        pending = set(attempts)
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                for loser in pending:
+                    # don't hold up the winner's response on cancel round trips
+                    attempts[loser].cancel("hedge lost", wait=False)
+                with self._lock:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    else:
+                        self.primary_wins += 1
+                return future.result()
+        with self._lock:
+            self.errors += 1
+        raise first_error
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "primary_wins": self.primary_wins,
+                "budget_denied": self.budget_denied,
+                "errors": self.errors,
+                "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+                "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            }
+        for p in (50, 95, 99):
+            value = self._percentile(p)
+            stats[f"p{p}_ms"] = round(value * 1000, 1) if value is not None else None
+        return stats
+
+def hedge_policy(name: str) -> Optional[HedgePolicy]:
+    """Policy for one repository read, None when hedging is disabled"""
+    if not HEDGE_ENABLED:
+        return None
+    policy = HedgePolicy(name, HEDGE_PERCENTILE, HEDGE_BUDGET_PERCENT, HEDGE_MIN_DELAY_MS, HEDGE_MIN_SAMPLES)
+    metrics.register(f"hedge_{name}", policy.stats)
+    return policy
@@ -0,0 +1,36 @@
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+# 8x8 low-frequency DCT coefficients -> 64-bit hash
+HASH_SIZE = 8
+# side of the grayscale thumbnail the DCT runs on
+SAMPLE_SIZE = 32
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so dct(x) = M @ x"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(SAMPLE_SIZE)
+
+def perceptual_hash(content: bytes) -> Optional[str]:
+    """64-bit DCT perceptual hash of an image as 16 hex digits, None when it can't be decoded.
+
+    Images that look alike (rescaled, recompressed, slightly cropped or recolored
+    screenshots) get hashes a few bits apart."""
+    try:
+        with Image.open(BytesIO(content)) as image:
+            image.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+            pixels = np.asarray(image.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.LANCZOS), dtype=np.float64)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return None
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # the DC term is overall brightness, leave it out of the median
+    bits = low > np.median(low[1:])
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
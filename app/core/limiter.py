@@ -0,0 +1,224 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Hashable, Optional
+
+from fastapi import HTTPException, status
+from google.api_core import exceptions as api_exceptions
+
+from config import LIMITER_ENABLED, LIMITER_MAX_WAIT_SECONDS, LIMITER_QUEUE_SIZE, LIMITER_LATENCY_TOLERANCE
+from config import LIMITER_BQ_READ_LIMIT, LIMITER_BQ_DML_LIMIT, LIMITER_GCS_LIMIT
+from core import metrics
+from core.deadline import current_deadline
+
+# Lower runs first
+INTERACTIVE = 0
+BULK = 1
+
+# Priority of the work done on behalf of the current request
+current_priority: ContextVar[int] = ContextVar("current_priority", default=INTERACTIVE)
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed backend calls at the given priority (e.g. BULK for exports)"""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+class Overloaded(HTTPException):
+    """Backend is saturated, the client should come back later"""
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Service overloaded ({backend}), retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+def is_overload_error(e: BaseException) -> bool:
+    """Errors that mean the backend wants less traffic from us"""
+    if isinstance(e, (api_exceptions.TooManyRequests, api_exceptions.ServiceUnavailable, TimeoutError)):
+        return True
+    if isinstance(e, api_exceptions.Forbidden):
+        # BigQuery reports quota and rate limits as 403
+        return any(err.get("reason") in ("rateLimitExceeded", "quotaExceeded") for err in (e.errors or []))
+    return False
+
+class _Waiter:
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.event = threading.Event()
+        # True when handed a slot, False when evicted by a more important waiter
+        self.granted: Optional[bool] = None
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one backend.
+
+    The limit grows by one per limit's worth of successful calls and shrinks by
+    a factor when the backend signals overload: quota/rate errors and timeouts,
+    or latency far above the best recently seen for the same query class while
+    the limit is nearly used up (a slow query alone is not overload). Calls over
+    the limit wait in a bounded priority queue; when it is full, or the wait
+    would be too long, they fail at once with 503 and Retry-After instead of
+    piling onto the backend."""
+    def __init__(self, name: str, initial_limit: int, min_limit: int = 1, max_limit: Optional[int] = None,
+                 queue_size: int = 100, max_wait: float = 5.0, latency_tolerance: float = 4.0, backoff: float = 0.7,
+                 near_limit: float = 0.8, max_classes: int = 256):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial_limit * 4
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.near_limit = near_limit
+        self.max_classes = max_classes
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        # query class -> best latency seen lately, drifts up so one lucky call doesn't stick forever
+        self._min_latency: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._avg_latency = 0.0
+        self._since_decrease = 0
+        self.accepted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.timed_out = 0
+        self.decreases = 0
+        self.peak_in_flight = 0
+
+    def _retry_after(self) -> int:
+        # time to drain the queue at the current limit, at least a second
+        backlog = (len(self._queue) + 1) / max(1.0, self.limit)
+        return max(1, math.ceil(backlog * max(self._avg_latency, 0.1)))
+
+    def _grant(self):
+        self._in_flight += 1
+        self.accepted += 1
+        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+
+    def acquire(self, priority: int = INTERACTIVE):
+        deadline = current_deadline.get()
+        max_wait = self.max_wait if deadline is None else min(self.max_wait, deadline.remaining())
+        with self._lock:
+            if self._in_flight < int(self.limit) and not self._queue:
+                self._grant()
+                return
+            waiter = _Waiter(priority)
+            if len(self._queue) >= self.queue_size:
+                # full: make room only by dropping someone less important
+                worst = max(self._queue)
+                if worst[0] <= priority:
+                    self.rejected += 1
+                    raise Overloaded(self.name, self._retry_after())
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                worst[2].granted = False
+                worst[2].event.set()
+                self.evicted += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self.queued += 1
+        waiter.event.wait(max_wait)
+        with self._lock:
+            if waiter.granted:
+                return
+            if waiter.granted is None:
+                # timed out in the queue
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self.timed_out += 1
+            raise Overloaded(self.name, self._retry_after())
+
+    def _slow(self, query_class: Hashable, latency: float) -> bool:
+        """Compare latency with the baseline of its own query class (a full scan is not a slow point read)"""
+        baseline = self._min_latency.pop(query_class, None)
+        if baseline is None or latency < baseline:
+            self._min_latency[query_class] = latency
+            if len(self._min_latency) > self.max_classes:
+                self._min_latency.popitem(last=False)
+            return False
+        self._min_latency[query_class] = baseline * 1.01
+        return latency > self.latency_tolerance * baseline
+
+    def release(self, latency: float, overloaded: bool = False, query_class: Hashable = None):
+        with self._lock:
+            # calls in flight alongside this one, it included
+            busy = self._in_flight
+            self._in_flight -= 1
+            self._avg_latency = latency if not self._avg_latency else 0.9 * self._avg_latency + 0.1 * latency
+            # slowness only means overload while we are pushing the limit
+            slow = self._slow(query_class, latency) and busy >= self.near_limit * int(self.limit)
+            self._since_decrease += 1
+            if overloaded or slow:
+                # at most one decrease per window of calls, the calls of that window saw the same overload
+                if self._since_decrease >= self.limit:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._since_decrease = 0
+                    self.decreases += 1
+            elif busy >= int(self.limit):
+                # only grow while the limit is actually being used
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            while self._queue and self._in_flight < int(self.limit):
+                _, _, waiter = heapq.heappop(self._queue)
+                waiter.granted = True
+                self._grant()
+                waiter.event.set()
+
+    @contextmanager
+    def slot(self, query_class: Hashable = None):
+        """Hold one unit of concurrency for the enclosed backend call; its latency is
+        judged against earlier calls of the same query_class (e.g. the SQL text)"""
+        self.acquire(current_priority.get())
+        started = time.monotonic()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            raise
+        finally:
+            self.release(time.monotonic() - started, overloaded, query_class)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "queued_now": len(self._queue),
+                "accepted": self.accepted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "timed_out": self.timed_out,
+                "decreases": self.decreases,
+                "avg_latency_ms": round(self._avg_latency * 1000, 1),
+                "query_classes": len(self._min_latency),
+            }
+
+class _Unlimited:
+    @contextmanager
+    def slot(self, query_class: Hashable = None):
+        yield
+
+def _limiter(name: str, initial_limit: int):
+    if not LIMITER_ENABLED:
+        return _Unlimited()
+    limiter = AdaptiveLimiter(name, initial_limit, queue_size=LIMITER_QUEUE_SIZE, max_wait=LIMITER_MAX_WAIT_SECONDS,
+                              latency_tolerance=LIMITER_LATENCY_TOLERANCE)
+    metrics.register(f"limiter_{name}", limiter.stats)
+    return limiter
+
+# One limiter per backend
+bq_read_limiter = _limiter("bq_read", LIMITER_BQ_READ_LIMIT)
+bq_dml_limiter = _limiter("bq_dml", LIMITER_BQ_DML_LIMIT)
+gcs_limiter = _limiter("gcs", LIMITER_GCS_LIMIT)
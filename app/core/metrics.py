@@ -0,0 +1,17 @@
+from typing import Callable, Dict
+
+# name -> function returning a dict of counters/gauges
+_providers: Dict[str, Callable[[], dict]] = {}
+
+def register(name: str, provider: Callable[[], dict]):
+    """Expose a stats provider under /metrics"""
+    _providers[name] = provider
+
+def snapshot() -> dict:
+    stats = {}
+    for name, provider in _providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
@@ -0,0 +1,277 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+from google.api_core.exceptions import BadRequest
+from google.cloud import bigquery
+
+from config import MUTATION_BATCH_LINGER_MS, MUTATION_MAX_BATCH, MUTATION_MAX_RETRIES
+from core import metrics
+from core.bigquery import run_dml
+from core.deadline import DeadlineExceeded, current_deadline
+
+def is_serialization_conflict(e: BaseException) -> bool:
+    message = str(e)
+    return "Could not serialize access" in message or "concurrent update" in message
+
+def conflict_backoff(attempt: int) -> float:
+    """Seconds to wait before retrying DML that hit a serialization conflict (attempt from 1), jittered"""
+    return min(5.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+class _Pending:
+    """Merged state of every queued mutation of one key, plus who is waiting for it"""
+    def __init__(self):
+        self.delete = False
+        self.values: Dict[str, Any] = {}
+        self.waiters: List["_Waiter"] = []
+
+class _Waiter:
+    def __init__(self):
+        self.done = threading.Event()
+        self.matched: Optional[bool] = None
+        self.error: Optional[BaseException] = None
+        # queued behind a delete of the same key, so it finds no row
+        self.after_delete = False
+
+class TableMutationQueue:
+    """Serializes UPDATE/DELETE by key on one table.
+
+    Mutations queue per key and are folded into the key's final state (later
+    values win, a delete wins over everything before it and whatever follows it
+    finds no row). One worker drains the queue into a single MERGE per batch, so
+    the table never sees concurrent DML from this instance, and retries it when
+    BigQuery reports a serialization conflict with someone else's DML. A batch
+    with a rejected row is bisected until the row is isolated. Callers block
+    until their batch lands. Other DML on the table (purges, bulk MERGEs) holds
+    the queue with exclusive() so it doesn't race the worker.
+
+    With a tombstone_column, rows where it is set count as deleted: they are
+    neither matched nor changed."""
+    def __init__(self, client: bigquery.Client, table_id: str, key_column: str, key_type: str, columns: Dict[str, str],
+                 tombstone_column: Optional[str] = None):
+        self.client = client
+        self.table_id = table_id
+        self.key_column = key_column
+        self.key_type = key_type
+        self.columns = columns
+        self.tombstone_column = tombstone_column
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: "OrderedDict[Any, _Pending]" = OrderedDict()
+        # held by the worker while a batch runs, and by exclusive()
+        self._busy = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self.submitted = 0
+        self.merged = 0
+        self.batches = 0
+        self.conflict_retries = 0
+        self.failures = 0
+
+    def update(self, key: Any, values: Dict[str, Any]) -> bool:
+        """Set columns of the row with this key, True if the row existed"""
+        self._check_columns(values)
+        return self._wait(self._enqueue([(key, values, False)])[0])
+
+    def update_many(self, updates: Dict[Any, Dict[str, Any]]) -> set:
+        """Set columns of many rows, queued together so they share MERGEs; the keys that existed"""
+        for values in updates.values():
+            self._check_columns(values)
+        waiters = self._enqueue([(key, values, False) for key, values in updates.items()])
+        matched, error = set(), None
+        for key, waiter in zip(updates, waiters):
+            try:
+                if self._wait(waiter):
+                    matched.add(key)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return matched
+
+    def delete(self, key: Any) -> bool:
+        """Delete the row with this key, True if it existed"""
+        return self._wait(self._enqueue([(key, {}, True)])[0])
+
+    def _check_columns(self, values: Dict[str, Any]):
+        unknown = set(values) - set(self.columns)
+        if unknown:
+            raise ValueError(f"Unknown columns for {self.table_id}: {', '.join(sorted(unknown))}")
+
+    def _enqueue(self, mutations: List[tuple]) -> List[_Waiter]:
+        """Queue (key, values, delete) mutations, one waiter each"""
+        waiters = []
+        with self._lock:
+            for key, values, delete in mutations:
+                waiter = _Waiter()
+                self.submitted += 1
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = _Pending()
+                else:
+                    self.merged += 1
+                waiter.after_delete = pending.delete
+                if delete:
+                    pending.delete = True
+                    pending.values = {}
+                elif not pending.delete:
+                    pending.values.update(values)
+                pending.waiters.append(waiter)
+                waiters.append(waiter)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"mutations-{self.table_id}", daemon=True)
+                self._worker.start()
+            self._wakeup.notify()
+        return waiters
+
+    def _wait(self, waiter: _Waiter) -> bool:
+        deadline = current_deadline.get()
+        if deadline is None:
+            waiter.done.wait()
+        elif not waiter.done.wait(deadline.remaining()):
+            # the write still lands, only the caller stops waiting for it
+            raise DeadlineExceeded(deadline)
+        if waiter.error is not None:
+            raise waiter.error
+        return bool(waiter.matched)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wakeup.wait()
+            # let concurrent writers join the batch
+            time.sleep(MUTATION_BATCH_LINGER_MS / 1000)
+            with self._lock:
+                keys = list(self._pending)[:MUTATION_MAX_BATCH]
+                batch = [(key, self._pending.pop(key)) for key in keys]
+            with self._busy:
+                self._execute(batch)
+
+    @contextmanager
+    def exclusive(self):
+        """Keep the worker from starting a batch while the caller runs its own DML on the table"""
+        with self._busy:
+            yield
+
+    def _execute(self, batch: list):
+        try:
+            matched = self._merge_with_retries(batch)
+        except Exception as e:
+            if len(batch) > 1 and isinstance(e, BadRequest):
+                # a row's values were rejected: bisect to isolate it, the others still land
+                middle = len(batch) // 2
+                self._execute(batch[:middle])
+                self._execute(batch[middle:])
+                return
+            with self._lock:
+                self.failures += 1
+            print(f"Mutation on {self.table_id} failed: {str(e)}")
+            for _, pending in batch:
+                for waiter in pending.waiters:
+                    waiter.error = e
+                    waiter.done.set()
+            return
+        for key, pending in batch:
+            for waiter in pending.waiters:
+                waiter.matched = key in matched and not waiter.after_delete
+                waiter.done.set()
+
+    def _merge_with_retries(self, batch: list) -> set:
+        attempt = 0
+        while True:
+            try:
+                return self._merge(batch)
+            except Exception as e:
+                if not is_serialization_conflict(e) or attempt >= MUTATION_MAX_RETRIES:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.conflict_retries += 1
+                time.sleep(conflict_backoff(attempt))
+
+    def _merge(self, batch: list) -> set:
+        """One MERGE for the batch, returns the keys that matched a row"""
+        updated = [c for c in self.columns if any(c in pending.values for _, pending in batch)]
+        rows = []
+        for key, pending in batch:
+            fields = [
+                bigquery.ScalarQueryParameter("_key", self.key_type, key),
+                bigquery.ScalarQueryParameter("_delete", "BOOL", pending.delete),
+            ]
+            for column in updated:
+                fields.append(bigquery.ScalarQueryParameter(f"_set_{column}", "BOOL", column in pending.values))
+                fields.append(bigquery.ScalarQueryParameter(column, self.columns[column], pending.values.get(column)))
+            rows.append(bigquery.StructQueryParameter(None, *fields))
+
+        update_clause = ""
+        if updated:
+            assignments = ", ".join(f"{c} = IF(S._set_{c}, S.{c}, T.{c})" for c in updated)
+            update_clause = f"WHEN MATCHED THEN UPDATE SET {assignments}"
+        live, live_target = "", ""
+        if self.tombstone_column:
+            live = f"AND {self.tombstone_column} IS NULL"
+            live_target = f"AND T.{self.tombstone_column} IS NULL"
+        # the matched keys and the MERGE read one snapshot; a concurrent write in
+        # between aborts the commit as a conflict, which is retried
+        query = f"""
+        DECLARE matched ARRAY<{self.key_type}>;
+        BEGIN TRANSACTION;
+        SET matched = (
+            SELECT ARRAY_AGG({self.key_column}) FROM `{self.table_id}`
+            WHERE {self.key_column} IN (SELECT r._key FROM UNNEST(@rows) r) {live}
+        );
+        MERGE `{self.table_id}` T
+        USING (SELECT * FROM UNNEST(@rows)) S
+        ON T.{self.key_column} = S._key {live_target}
+        WHEN MATCHED AND S._delete THEN DELETE
+        {update_clause};
+        COMMIT TRANSACTION;
+        SELECT k FROM UNNEST(matched) k;
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", rows)])
+        job = run_dml(self.client, query, job_config, self.table_id)
+        with self._lock:
+            self.batches += 1
+        return {row.k for row in job.result()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_keys": len(self._pending),
+                "submitted": self.submitted,
+                "merged": self.merged,
+                "batches": self.batches,
+                "conflict_retries": self.conflict_retries,
+                "failures": self.failures,
+            }
+
+# table_id -> queue, shared by every repository writing the table
+_queues: Dict[str, TableMutationQueue] = {}
+_queues_lock = threading.Lock()
+
+def mutation_queue(client: bigquery.Client, table_id: str, key_column: str, key_type: str, columns: Dict[str, str],
+                   tombstone_column: Optional[str] = None) -> TableMutationQueue:
+    """The mutation queue of a table, created on first use"""
+    with _queues_lock:
+        queue = _queues.get(table_id)
+        if queue is None:
+            queue = _queues[table_id] = TableMutationQueue(client, table_id, key_column, key_type, columns, tombstone_column)
+        return queue
+
+def exclusive(table_id: str):
+    """Hold the mutation queue of a table, a no-op when this instance has none (it hasn't written the table)"""
+    with _queues_lock:
+        queue = _queues.get(table_id)
+    return queue.exclusive() if queue is not None else nullcontext()
+
+def stats() -> dict:
+    with _queues_lock:
+        queues = dict(_queues)
+    return {table_id: queue.stats() for table_id, queue in queues.items()}
+
+metrics.register("mutations", stats)
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+_datetime = TypeAdapter(datetime)
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Parse a comma separated fields= parameter, None means all columns"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    allowed = set(allowed)
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    # keep request order, drop duplicates
+    return list(dict.fromkeys(requested)) or None
+
+def select_list(fields: List[str], columns: Dict[str, str]) -> str:
+    """Build a SELECT list for the requested fields from a field -> SQL expression map"""
+    return ", ".join(columns[f] if columns[f] == f else f"{columns[f]} AS {f}" for f in fields)
+
+def project_row(row, fields: List[str]) -> dict:
+    return {f: row[f] for f in fields}
+
+def encode(value: Any) -> Any:
+    """jsonable_encoder with datetimes written the way response_model output writes them ("Z" for UTC),
+    so projected and expanded responses look the same as full ones"""
+    return jsonable_encoder(value, custom_encoder={datetime: lambda d: _datetime.dump_python(d, mode="json")})
+
+def parse_expand(expand: Optional[str], allowed: Iterable[str]) -> List[str]:
+    """Parse a comma separated expand= parameter (related data to embed)"""
+    requested = [e.strip() for e in (expand or "").split(",") if e.strip()]
+    unknown = [e for e in requested if e not in set(allowed)]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown expand: {', '.join(unknown)}"
+        )
+    return list(dict.fromkeys(requested))
+
+def parse_ids(ids: Optional[str], max_ids: int) -> List[str]:
+    """Parse a comma separated ids= parameter, keeping request order and repeats"""
+    requested = [i.strip() for i in (ids or "").split(",") if i.strip()]
+    if not requested:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids= is required")
+    if len(requested) > max_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {max_ids} ids per request")
+    return requested
+
+def in_request_order(ids: list, found: dict) -> List[dict]:
+    """One entry per requested id, with found=False for ids that don't exist"""
+    return [{"id": i, "found": i in found, "item": found.get(i)} for i in ids]
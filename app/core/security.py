@@ -1,7 +1,7 @@
 import jwt
 from datetime import datetime, timezone, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from config import JWT_ALGORITHM, JWT_EXPIRATION_HOURS, JWT_SECRET
 
@@ -21,8 +21,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def verify_token(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token"""
+    # sub-requests of /batch carry the token their batch already verified
+    verified = request.scope.get("verified_token")
+    if verified and verified[0] == credentials.credentials:
+        return verified[1]
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         return payload
@@ -0,0 +1,186 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import path as os_path, replace as os_replace
+from typing import Hashable, List, Optional
+
+from google.cloud import bigquery
+
+from core.cache import QueryCache, pack_rows, unpack_rows
+from core.limiter import BULK, priority
+from core.transport import transport
+
+# Bump when the snapshot layout changes, older snapshots are then ignored
+SNAPSHOT_FORMAT_VERSION = 1
+
+def params_from_api_repr(params: List[dict]) -> list:
+    query_params = []
+    for param in params:
+        param_type = param.get("parameterType", {})
+        if "arrayType" in param_type:
+            query_params.append(bigquery.ArrayQueryParameter.from_api_repr(param))
+        elif "structTypes" in param_type:
+            query_params.append(bigquery.StructQueryParameter.from_api_repr(param))
+        else:
+            query_params.append(bigquery.ScalarQueryParameter.from_api_repr(param))
+    return query_params
+
+class WarmQuerySet:
+    """Most recently used queries worth keeping warm across restarts"""
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # cache key -> (query, params api repr, tables, ttl)
+        self._queries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def record(self, key: Hashable, query: str, job_config: Optional[bigquery.QueryJobConfig], tables: List[str], ttl: float):
+        params = [p.to_api_repr() for p in job_config.query_parameters] if job_config is not None else []
+        with self._lock:
+            self._queries[key] = (query, params, list(tables), ttl)
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.max_entries:
+                self._queries.popitem(last=False)
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._queries.items())
+
+warm_queries = WarmQuerySet()
+
+class CacheSnapshotter:
+    """Persist warm query results to local disk or GCS and reload them at startup"""
+    def __init__(self, query_cache: QueryCache, uri: str, interval: float, warm_ttl: float, refresh_workers: int = 4):
+        self.query_cache = query_cache
+        self.uri = uri
+        self.interval = interval
+        self.warm_ttl = warm_ttl
+        self.refresh_workers = refresh_workers
+        self.loaded_entries = 0
+        self.loaded_at: Optional[str] = None
+        self.saved_entries = 0
+        self.saved_at: Optional[str] = None
+        self.refreshed = 0
+        self.errors = 0
+        self._thread: Optional[threading.Thread] = None
+
+    # storage
+    def _read(self) -> Optional[bytes]:
+        if self.uri.startswith("gs://"):
+            bucket, _, name = self.uri[5:].partition("/")
+            blob = transport.storage_client().bucket(bucket).blob(name)
+            return blob.download_as_bytes() if blob.exists() else None
+        path = self.uri[7:] if self.uri.startswith("file://") else self.uri
+        if not os_path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _write(self, data: bytes):
+        if self.uri.startswith("gs://"):
+            bucket, _, name = self.uri[5:].partition("/")
+            transport.storage_client().bucket(bucket).blob(name).upload_from_string(data, content_type="application/octet-stream")
+            return
+        path = self.uri[7:] if self.uri.startswith("file://") else self.uri
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os_replace(tmp_path, path)
+
+    def save(self) -> int:
+        """Write cached results of the warm queries, returns the number of entries saved"""
+        entries = []
+        for key, (query, params, tables, ttl) in warm_queries.items():
+            cached = self.query_cache.backend.get(QueryCache.cache_key(key))
+            if cached is None:
+                continue
+            rows = cached[1]
+            packed = rows if self.query_cache.backend.shared else pack_rows(rows)
+            entries.append((key, query, params, tables, ttl, packed))
+        snapshot = {
+            "version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "entries": entries,
+        }
+        try:
+            self._write(zlib.compress(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)))
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to write cache snapshot to {self.uri}: {str(e)}")
+            return 0
+        self.saved_entries = len(entries)
+        self.saved_at = snapshot["created_at"]
+        return len(entries)
+
+    def load(self) -> list:
+        """Seed the query cache from the last snapshot, returns the loaded entries"""
+        try:
+            data = self._read()
+            if not data:
+                return []
+            snapshot = pickle.loads(zlib.decompress(data))
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to read cache snapshot from {self.uri}: {str(e)}")
+            return []
+        if snapshot.get("version") != SNAPSHOT_FORMAT_VERSION:
+            print(f"Ignoring cache snapshot with version {snapshot.get('version')}")
+            return []
+        entries = snapshot["entries"]
+        for key, query, params, tables, ttl, packed in entries:
+            # valid as of now, the background refresh replaces it shortly
+            self.query_cache.put(key, unpack_rows(packed), QueryCache.generations(tables), self.warm_ttl)
+            warm_queries.record(key, query, bigquery.QueryJobConfig(query_parameters=params_from_api_repr(params)), tables, ttl)
+        self.loaded_entries = len(entries)
+        self.loaded_at = snapshot["created_at"]
+        return entries
+
+    def refresh(self, client: bigquery.Client, entries: list):
+        """Re-run snapshotted queries so the cache catches up with the tables"""
+        # core.bigquery imports this module
+        from core.bigquery import run_query
+
+        def run(entry):
+            key, query, params, tables, ttl, _ = entry
+            generations = QueryCache.generations(tables)
+            job_config = bigquery.QueryJobConfig(query_parameters=params_from_api_repr(params))
+            try:
+                # within the read limit, behind request traffic; warm reads are small
+                with priority(BULK):
+                    rows = run_query(client, query, job_config, short=True)
+                self.query_cache.put(key, rows, generations, ttl)
+                self.refreshed += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Failed to refresh snapshot entry: {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=self.refresh_workers) as executor:
+            list(executor.map(run, entries))
+
+    def start(self, client: bigquery.Client):
+        """Load the snapshot now, then refresh it and save periodically in the background"""
+        entries = self.load()
+
+        def run():
+            if entries:
+                self.refresh(client, entries)
+            while True:
+                time.sleep(self.interval)
+                self.save()
+
+        self._thread = threading.Thread(target=run, name="cache-snapshot", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        return {
+            "uri": self.uri,
+            "loaded_entries": self.loaded_entries,
+            "loaded_at": self.loaded_at,
+            "refreshed": self.refreshed,
+            "saved_entries": self.saved_entries,
+            "saved_at": self.saved_at,
+            "errors": self.errors,
+        }
@@ -0,0 +1,196 @@
+from datetime import timezone
+from typing import Iterable, List
+
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, Index, Integer, MetaData, String, Table, Text,
+                        TypeDecorator, create_engine, event, insert, inspect, literal, select, text, update)
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+class UtcDateTime(TypeDecorator):
+    """Timestamps stored as naive UTC, read back timezone-aware like BigQuery TIMESTAMPs"""
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+metadata = MetaData()
+
+# Same tables and columns as the BigQuery dataset, plus the indexes point reads need.
+# Deletes are physical here, so there is no deleted_at column.
+users = Table(
+    "users", metadata,
+    Column("user_id", String(64), primary_key=True),
+    Column("username", String(255), nullable=False, unique=True),
+    Column("email", String(255)),
+    Column("password_hash", String(255)),
+    Column("role", String(64)),
+    Column("is_active", Boolean),
+    Column("created_at", UtcDateTime),
+    Column("last_login", UtcDateTime),
+)
+
+leagues = Table(
+    "leagues", metadata,
+    Column("league_id", String(64), primary_key=True),
+    Column("league_name", String(255)),
+    Column("country", String(255)),
+    Column("season", String(64)),
+    Column("status", String(64)),
+    Column("created_at", UtcDateTime),
+    Column("updated_at", UtcDateTime),
+    Index("ix_leagues_created_at", "created_at"),
+)
+
+matches = Table(
+    "matches", metadata,
+    Column("match_id", BigInteger, primary_key=True, autoincrement=False),
+    Column("home_team", String(255)),
+    Column("away_team", String(255)),
+    Column("league_id", String(64)),
+    Column("match_date", UtcDateTime),
+    Column("status", String(64)),
+    Index("ix_matches_league_id", "league_id"),
+    Index("ix_matches_match_date", "match_date"),
+)
+
+url_submission = Table(
+    "url_submission", metadata,
+    Column("submission_id", String(64), primary_key=True),
+    Column("url", Text, nullable=False),
+    Column("type", String(64)),
+    Column("league_id", String(64)),
+    Column("match_id", String(64)),
+    Column("status", String(64)),
+    Column("image_file_name", String(255)),
+    Column("created_at", UtcDateTime),
+    Column("updated_at", UtcDateTime),
+    # duplicate check by (match_id, url); url is Text, so match_id leads
+    Index("ix_url_submission_match_id_url", "match_id", "url"),
+    Index("ix_url_submission_league_id", "league_id"),
+    Index("ix_url_submission_created_at", "created_at"),
+)
+
+uploadfile = Table(
+    "uploadfile", metadata,
+    Column("file_name", String(255), primary_key=True),
+    Column("submission_id", String(64)),
+    Column("orig_file_name", String(255)),
+    Column("file_url", Text),
+    Column("file_size", Integer),
+    Column("content_type", String(255)),
+    Column("uploaded_at", UtcDateTime),
+    Column("bucket_path", Text),
+    Column("phash", String(16)),
+    Index("ix_uploadfile_submission_id", "submission_id"),
+)
+
+# One counter per table, bumped in the transaction of every write: conditional GETs
+# and the BigQuery export read it instead of scanning the tables
+table_versions = Table(
+    "table_versions", metadata,
+    Column("table_name", String(64), primary_key=True),
+    Column("version", BigInteger, nullable=False),
+)
+
+# Tables whose BigQuery copy this database has taken over (copied in by the bootstrap, or
+# found missing or empty there); the export only ever replaces those
+bootstrap_markers = Table(
+    "bootstrap_markers", metadata,
+    Column("table_name", String(64), primary_key=True),
+    Column("completed_at", UtcDateTime, nullable=False),
+)
+
+def create_sql_engine(url: str, pool_size: int, max_overflow: int, pool_timeout: float) -> Engine:
+    """Pooled engine for the SQL repositories (SQLite for local runs, PostgreSQL in production)"""
+    options = {"pool_pre_ping": True}
+    sql_url = make_url(url)
+    if sql_url.get_backend_name() == "sqlite":
+        # connections move between threadpool threads
+        options["connect_args"] = {"check_same_thread": False}
+    if issubclass(sql_url.get_dialect().get_pool_class(sql_url), QueuePool):
+        # in-memory SQLite gets a single-connection pool that takes no sizing
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    engine = create_engine(url, **options)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, _):
+            # readers don't block the writer, and writers wait for each other instead of failing
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+    return engine
+
+def _add_missing_columns(engine: Engine):
+    """ALTER TABLE ... ADD COLUMN for nullable columns added since a table was created
+    (create_all leaves existing tables alone), e.g. uploadfile.phash"""
+    for table in metadata.sorted_tables:
+        existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable or column.primary_key:
+                raise RuntimeError(f"Can't add required column {table.name}.{column.name} to an existing table, migrate it by hand")
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            except Exception:
+                # another instance starting at the same time may have added it first
+                if column.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+                    raise
+                continue
+            print(f"Added column {table.name}.{column.name}")
+
+def init_schema(engine: Engine):
+    """Create missing tables, columns and indexes, and a version row per table"""
+    metadata.create_all(engine)
+    _add_missing_columns(engine)
+    with engine.begin() as conn:
+        existing = set(conn.execute(select(table_versions.c.table_name)).scalars())
+        missing = [t.name for t in metadata.sorted_tables
+                   if t not in (table_versions, bootstrap_markers) and t.name not in existing]
+        if missing:
+            conn.execute(insert(table_versions), [{"table_name": name, "version": 0} for name in missing])
+
+def bump_versions(conn: Connection, tables: Iterable[Table]):
+    """Bump the version of tables written in this transaction"""
+    for table in tables:
+        conn.execute(update(table_versions).where(table_versions.c.table_name == table.name)
+                     .values(version=table_versions.c.version + 1))
+
+def read_versions(conn: Connection, tables: List[Table]) -> dict:
+    """table name -> version"""
+    rows = conn.execute(select(table_versions.c.table_name, table_versions.c.version)
+                        .where(table_versions.c.table_name.in_([t.name for t in tables])))
+    return {row.table_name: row.version for row in rows}
+
+def sql_version_token(engine: Engine, tables: List[Table]) -> str:
+    """Version of a set of tables for conditional GETs, one primary key read"""
+    with engine.connect() as conn:
+        versions = read_versions(conn, tables)
+    return "|".join(f"sql:{t.name}:{versions.get(t.name, 0)}" for t in tables)
+
+def ping(engine: Engine):
+    """Round trip to the database, raises while it is unreachable"""
+    with engine.connect() as conn:
+        conn.execute(select(literal(1)))
+
+def pool_stats(engine: Engine):
+    """Metrics provider for the engine's connection pool"""
+    def stats() -> dict:
+        pool = engine.pool
+        result = {"dialect": engine.dialect.name, "pool": type(pool).__name__}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                result[name] = getattr(pool, name)()
+        return result
+    return stats
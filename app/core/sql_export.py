@@ -0,0 +1,219 @@
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+from sqlalchemy import Boolean, Integer, Table, func, insert, select
+from sqlalchemy.engine import Connection, Engine
+
+from core.bigquery import run_dml, run_load
+from core.compactor import TOMBSTONE_COLUMN
+from core.limiter import BULK, priority
+from core.sql import (UtcDateTime, bootstrap_markers, bump_versions, leagues, matches, read_versions, uploadfile,
+                      url_submission, users)
+
+# Tables replicated to BigQuery; users stay out of the warehouse
+EXPORTED_TABLES = [leagues, matches, url_submission, uploadfile]
+# Tables copied from BigQuery into a fresh SQL database
+BOOTSTRAP_TABLES = [users, leagues, matches, url_submission, uploadfile]
+
+def _bigquery_type(column) -> str:
+    if isinstance(column.type, Boolean):
+        return "BOOL"
+    if isinstance(column.type, Integer):
+        return "INT64"
+    if isinstance(column.type, UtcDateTime):
+        return "TIMESTAMP"
+    return "STRING"
+
+def _export_value(value, field_type: str):
+    """SQL value -> JSON value for a load job into a column of field_type"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if field_type == "STRING" and not isinstance(value, str):
+        return str(value)
+    return value
+
+def _import_value(value, column):
+    """BigQuery value -> value for a SQL column (NUMERIC ids, sizes stored as STRING)"""
+    if value is None:
+        return None
+    if isinstance(column.type, Integer) and isinstance(value, (str, Decimal)):
+        return int(value)
+    return value
+
+def _bootstrapped(conn: Connection) -> set:
+    """Names of the tables with a bootstrap-complete marker"""
+    return set(conn.execute(select(bootstrap_markers.c.table_name)).scalars())
+
+def _mark_bootstrapped(conn: Connection, table: Table):
+    if table.name not in _bootstrapped(conn):
+        conn.execute(insert(bootstrap_markers).values(table_name=table.name, completed_at=datetime.now(timezone.utc)))
+
+class BigQueryExporter:
+    """Replicates the SQL tables to BigQuery for analytics.
+
+    Interactive traffic reads and writes the SQL database; every interval each
+    table whose version moved since its last export is copied whole into the
+    BigQuery table of the same name with one WRITE_TRUNCATE load job, at bulk
+    priority. The BigQuery schema is kept (deleted_at stays NULL), so the
+    bigquery backend can read the replica as is.
+
+    A BigQuery table is only replaced once this database has taken it over: it
+    has a bootstrap-complete marker, or it is missing or empty in BigQuery (and
+    gets one then). Tables never written here (version 0) are never exported."""
+    def __init__(self, engine: Engine, client: bigquery.Client, project_id: str, dataset_name: str, interval: float):
+        self.engine = engine
+        self.client = client
+        self.dataset_id = f"{project_id}.{dataset_name}"
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # table name -> version last exported
+        self.exported_versions: Dict[str, int] = {}
+        self.exported_rows: Dict[str, int] = {}
+        # tables holding rows in BigQuery that were never bootstrapped into this database
+        self.waiting_for_bootstrap: set = set()
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at: Optional[str] = None
+
+    def _schema(self, table: Table) -> List[bigquery.SchemaField]:
+        try:
+            return list(self.client.get_table(f"{self.dataset_id}.{table.name}").schema)
+        except api_exceptions.NotFound:
+            schema = [bigquery.SchemaField(c.name, _bigquery_type(c)) for c in table.columns]
+            return schema + [bigquery.SchemaField(TOMBSTONE_COLUMN, "TIMESTAMP")]
+
+    def _may_replace(self, table: Table) -> bool:
+        """True once replacing the BigQuery table can't lose rows this database never had"""
+        with self.engine.connect() as conn:
+            if table.name in _bootstrapped(conn):
+                return True
+        try:
+            num_rows = self.client.get_table(f"{self.dataset_id}.{table.name}").num_rows
+        except api_exceptions.NotFound:
+            num_rows = 0
+        if num_rows != 0:
+            with self._lock:
+                first = table.name not in self.waiting_for_bootstrap
+                self.waiting_for_bootstrap.add(table.name)
+            if first:
+                print(f"Not exporting {table.name}: the BigQuery table has rows that were never bootstrapped into the SQL database")
+            return False
+        with self.engine.begin() as conn:
+            _mark_bootstrapped(conn, table)
+        return True
+
+    def export(self, table: Table) -> Optional[int]:
+        """Copy one table to BigQuery, returns the rows exported (None when it may not be replaced yet)"""
+        table_id = f"{self.dataset_id}.{table.name}"
+        with self.engine.connect() as conn:
+            # read before the rows: a write in between only causes one extra export
+            version = read_versions(conn, [table]).get(table.name)
+        if not version or not self._may_replace(table):
+            # never written here, or BigQuery still holds the only copy of its rows
+            return None
+        with self._lock:
+            self.waiting_for_bootstrap.discard(table.name)
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(table)).mappings().all()
+        schema = self._schema(table)
+        with priority(BULK):
+            if rows:
+                data = [{f.name: _export_value(row.get(f.name), f.field_type) for f in schema} for row in rows]
+                run_load(self.client, data, table_id, schema=schema,
+                         write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+            else:
+                run_dml(self.client, f"TRUNCATE TABLE `{table_id}`", table_id=table_id)
+        with self._lock:
+            self.exported_versions[table.name] = version
+            self.exported_rows[table.name] = len(rows)
+        return len(rows)
+
+    def run_once(self) -> Dict[str, int]:
+        """Export every table changed since its last export"""
+        with self.engine.connect() as conn:
+            versions = read_versions(conn, EXPORTED_TABLES)
+        results = {}
+        for table in EXPORTED_TABLES:
+            with self._lock:
+                unchanged = self.exported_versions.get(table.name) == versions.get(table.name, 0)
+            if unchanged:
+                continue
+            try:
+                exported = self.export(table)
+                if exported is not None:
+                    results[table.name] = exported
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"Failed to export {table.name} to BigQuery: {str(e)}")
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = datetime.now(timezone.utc).isoformat()
+        return results
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="sql-export", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "last_run_at": self.last_run_at,
+                "exported_versions": dict(self.exported_versions),
+                "exported_rows": dict(self.exported_rows),
+                "waiting_for_bootstrap": sorted(self.waiting_for_bootstrap),
+                "errors": self.errors,
+            }
+
+def bootstrap_from_bigquery(engine: Engine, client: bigquery.Client, project_id: str, dataset_name: str) -> Dict[str, int]:
+    """Copy the BigQuery tables into SQL tables that were never written to.
+
+    Each table is copied once, while its version is still 0, so the SQL backend
+    starts with the existing users, leagues, matches and submissions. The copy
+    and its bootstrap-complete marker commit together, which is what lets the
+    export replace the BigQuery table later. Rows are read with tabledata.list
+    (no query job), soft-deleted rows are skipped."""
+    copied = {}
+    for table in BOOTSTRAP_TABLES:
+        with engine.connect() as conn:
+            if table.name in _bootstrapped(conn) or read_versions(conn, [table]).get(table.name):
+                continue
+        try:
+            source = client.list_rows(f"{project_id}.{dataset_name}.{table.name}")
+            rows = [
+                {c.name: _import_value(row.get(c.name), c) for c in table.columns}
+                for row in source if row.get(TOMBSTONE_COLUMN) is None
+            ]
+            # BigQuery doesn't enforce primary keys, the last copy of a key wins
+            key = table.primary_key.columns.values()[0].name
+            rows = list({row[key]: row for row in rows}.values())
+        except api_exceptions.NotFound:
+            # nothing in BigQuery to lose
+            with engine.begin() as conn:
+                _mark_bootstrapped(conn, table)
+            continue
+        with engine.begin() as conn:
+            if conn.execute(select(func.count()).select_from(table)).scalar():
+                continue
+            for i in range(0, len(rows), 1000):
+                conn.execute(insert(table), rows[i:i + 1000])
+            bump_versions(conn, [table])
+            _mark_bootstrapped(conn, table)
+        copied[table.name] = len(rows)
+        print(f"Copied {len(rows)} rows of {table.name} from BigQuery")
+    return copied
@@ -0,0 +1,171 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional, Sequence
+
+def describe_error(e: Exception) -> str:
+    """Message for the readiness report; str() of an HTTPException is empty, its detail is not"""
+    return str(getattr(e, "detail", None) or repr(e))
+
+class Dependency:
+    def __init__(self, name: str, init: Callable[..., Any], depends_on: Sequence[str], timeout: float, required: bool,
+                 check: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.init = init
+        self.check = check
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+        self.required = required
+        self.state = "pending"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.latency_ms: Optional[float] = None
+        # outcome of the latest periodic check, for dependencies that were ready
+        self.healthy = True
+        self.check_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+class Startup:
+    """Initialize clients and services concurrently, honouring dependencies and timeouts"""
+    def __init__(self):
+        self._deps: Dict[str, Dependency] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.total_ms: Optional[float] = None
+        self.checks = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, name: str, init: Callable[..., Any], depends_on: Sequence[str] = (), timeout: float = 30.0, required: bool = True,
+            check: Optional[Callable[[Any], Any]] = None):
+        """Register init(*results of depends_on) under name; check(result) raises while it is unavailable"""
+        self._deps[name] = Dependency(name, init, depends_on, timeout, required, check)
+
+    def _run_one(self, dep: Dependency) -> Any:
+        args = []
+        for parent in dep.depends_on:
+            # parents have their own timeouts, wait for them to settle
+            try:
+                args.append(self._futures[parent].result())
+            except Exception:
+                args.append(None)
+            if self._deps[parent].state != "ready":
+                with self._lock:
+                    if dep.state == "pending":
+                        dep.state = "failed"
+                        dep.error = f"dependency {parent} is {self._deps[parent].state}"
+                raise RuntimeError(f"dependency {parent} is not ready")
+        started = time.perf_counter()
+        try:
+            result = dep.init(*args)
+        except Exception as e:
+            with self._lock:
+                dep.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+                dep.state = "failed"
+                dep.error = describe_error(e)
+            print(f"Startup: {dep.name} failed after {dep.latency_ms} ms: {dep.error}")
+            raise
+        with self._lock:
+            dep.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            if dep.state == "timeout":
+                # finished after we gave up on it, keep it out of service but report it
+                dep.error = f"finished late after {dep.latency_ms} ms"
+            else:
+                dep.state = "ready"
+                dep.result = result
+        return result
+
+    def run(self):
+        """Start every dependency and wait until each is ready, failed or timed out"""
+        self.started_at = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self._deps)), thread_name_prefix="startup")
+        for name, dep in self._deps.items():
+            self._futures[name] = executor.submit(self._run_one, dep)
+        for name, dep in self._deps.items():
+            try:
+                # deadlines count from the start of the run, not from this wait
+                remaining = self.started_at + self._deadline(dep) - time.perf_counter()
+                self._futures[name].result(timeout=max(0.0, remaining))
+            except FutureTimeoutError:
+                with self._lock:
+                    if dep.state == "pending":
+                        dep.state = "timeout"
+                        dep.error = f"not ready within {self._deadline(dep):.1f}s"
+                print(f"Startup: {name} timed out")
+            except Exception:
+                pass
+        # don't block on timed out inits, their threads finish on their own
+        executor.shutdown(wait=False)
+        self.total_ms = round((time.perf_counter() - self.started_at) * 1000, 1)
+
+    def _deadline(self, dep: Dependency) -> float:
+        """A dependency's own timeout plus the longest chain of parents before it"""
+        parents = [self._deadline(self._deps[p]) for p in dep.depends_on]
+        return dep.timeout + (max(parents) if parents else 0)
+
+    def get(self, name: str) -> Any:
+        dep = self._deps.get(name)
+        return dep.result if dep and dep.state == "ready" else None
+
+    def recheck(self):
+        """Run the check of every ready dependency, so readiness follows outages after startup"""
+        for dep in self._deps.values():
+            if dep.state != "ready" or dep.check is None:
+                continue
+            try:
+                dep.check(dep.result)
+                healthy, error = True, None
+            except Exception as e:
+                healthy, error = False, describe_error(e)
+            with self._lock:
+                if dep.healthy != healthy:
+                    print(f"Startup: {dep.name} is {'healthy again' if healthy else 'unhealthy'}" + (f": {error}" if error else ""))
+                dep.healthy = healthy
+                dep.check_error = error
+                dep.checked_at = time.time()
+        with self._lock:
+            self.checks += 1
+
+    def _loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.recheck()
+            except Exception as e:
+                print(f"Startup: readiness check failed: {str(e)}")
+
+    def start(self, interval: float):
+        """Recheck ready dependencies every interval seconds in the background"""
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="readiness-check", daemon=True)
+        self._thread.start()
+
+    def _healthy(self, dep: Dependency) -> bool:
+        # a service is only as available as the clients it was built on
+        return dep.state == "ready" and dep.healthy and all(self._healthy(self._deps[p]) for p in dep.depends_on)
+
+    def is_ready(self, name: Optional[str] = None) -> bool:
+        """One dependency, or every required one when name is None"""
+        if name is not None:
+            dep = self._deps.get(name)
+            return bool(dep) and self._healthy(dep)
+        return all(self._healthy(dep) for dep in self._deps.values() if dep.required)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.is_ready(),
+                "total_ms": self.total_ms,
+                "checks": self.checks,
+                "dependencies": {
+                    name: {
+                        "state": dep.state,
+                        "healthy": self._healthy(dep),
+                        "latency_ms": dep.latency_ms,
+                        "required": dep.required,
+                        "error": dep.error or dep.check_error,
+                    }
+                    for name, dep in self._deps.items()
+                },
+            }
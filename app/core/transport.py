@@ -0,0 +1,136 @@
+import socket
+import threading
+from os import path as os_path
+from typing import Optional
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from config import TRANSPORT_POOL_SIZE, TRANSPORT_POOL_BLOCK, TRANSPORT_RETRIES, TRANSPORT_KEEPALIVE_SECONDS
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+def _keepalive_socket_options(idle: int) -> list:
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # Linux only, elsewhere the OS defaults apply
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 3)),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+        ]
+    return options
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP keep-alive that tracks how busy its pools are"""
+    def __init__(self, pool_size: int, pool_block: bool, retries: int, keepalive: int):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # requests started while every pooled connection was busy: they waited
+        # for one (pool_block) or opened a throwaway connection
+        self.saturated = 0
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            # API calls that are not idempotent are retried by the client libraries
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            backoff_factor=0.2,
+            raise_on_status=False,
+        )
+        super().__init__(pool_connections=10, pool_maxsize=pool_size, max_retries=retry, pool_block=pool_block)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = _keepalive_socket_options(self.keepalive)
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= self.pool_size:
+                self.saturated += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return super().send(request, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        opened = 0
+        idle = 0
+        with self.poolmanager.pools.lock:
+            pools = list(self.poolmanager.pools._container.values())
+        for pool in pools:
+            opened += pool.num_connections
+            idle += pool.pool.qsize() if pool.pool is not None else 0
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "saturated": self.saturated,
+                "connections_opened": opened,
+                "idle_connections": idle,
+            }
+
+class SharedTransport:
+    """One set of credentials and one pooled, authorized HTTP session for every Google client"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.credentials = None
+        self.project: Optional[str] = None
+        self.adapter: Optional[PooledAdapter] = None
+        self.session: Optional[AuthorizedSession] = None
+        self._storage_client = None
+
+    def configure(self, service_account_path: Optional[str] = None, project: Optional[str] = None) -> AuthorizedSession:
+        """Build the session once, from a service account file if it exists, else default credentials"""
+        with self._lock:
+            if self.session is not None:
+                return self.session
+            if service_account_path and os_path.exists(service_account_path):
+                credentials = service_account.Credentials.from_service_account_file(service_account_path, scopes=SCOPES)
+            else:
+                # Use default credentials (for Cloud Run)
+                credentials, default_project = google.auth.default(scopes=SCOPES)
+                project = project or default_project
+            adapter = PooledAdapter(TRANSPORT_POOL_SIZE, TRANSPORT_POOL_BLOCK, TRANSPORT_RETRIES, TRANSPORT_KEEPALIVE_SECONDS)
+            session = AuthorizedSession(credentials)
+            session.mount("https://", adapter)
+            self.credentials = credentials
+            self.project = project
+            self.adapter = adapter
+            self.session = session
+            return session
+
+    def storage_client(self, project: Optional[str] = None):
+        """Storage client on the shared session, created (and imported) on first use"""
+        with self._lock:
+            if self._storage_client is not None:
+                return self._storage_client
+        self.configure(project=project)
+        from google.cloud import storage
+        with self._lock:
+            if self._storage_client is None:
+                self._storage_client = storage.Client(project=project or self.project, credentials=self.credentials, _http=self.session)
+            return self._storage_client
+
+    def stats(self) -> dict:
+        if self.adapter is None:
+            return {"configured": False}
+        return {"configured": True, **self.adapter.stats()}
+
+transport = SharedTransport()
@@ -0,0 +1,158 @@
+import threading
+import time
+from hashlib import sha1
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import TABLE_METADATA_TTL_SECONDS
+
+class WriteGenerations:
+    """Write generation per table, bumped by repository mutations.
+
+    With a shared cache backend attached the counters live in the backend and
+    every bump is broadcast, so a write on one instance invalidates everywhere;
+    this object then keeps the local mirror of those counters."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._backend = None
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call listener(table_id) after every bump, local or remote"""
+        self._listeners.append(listener)
+
+    def attach(self, backend):
+        """Share generations through a cache backend (no-op for in-process backends)"""
+        if not backend.shared:
+            return
+        with self._lock:
+            self._backend = backend
+            # mirrored values may be behind the shared counters, reload lazily
+            self._generations.clear()
+        backend.listen(self._on_remote_bump, self.resync)
+
+    def bump(self, table_id: str) -> int:
+        generation = None
+        backend = self._backend
+        if backend is not None:
+            try:
+                generation = backend.incr(table_id)
+                backend.publish(f"{generation} {table_id}")
+            except Exception as e:
+                print(f"Failed to bump shared generation of {table_id}: {str(e)}")
+        with self._lock:
+            if generation is None:
+                generation = self._generations.get(table_id, 0) + 1
+            generation = max(generation, self._generations.get(table_id, 0) + 1)
+            self._generations[table_id] = generation
+        self._notify(table_id)
+        return generation
+
+    def observe(self, table_id: str, generation: int):
+        """Apply a generation bumped elsewhere"""
+        with self._lock:
+            if generation <= self._generations.get(table_id, 0):
+                return
+            self._generations[table_id] = generation
+        self._notify(table_id)
+
+    def get(self, table_id: str) -> int:
+        with self._lock:
+            generation = self._generations.get(table_id)
+            backend = self._backend
+        if generation is not None:
+            return generation
+        generation = 0
+        if backend is not None:
+            try:
+                generation = backend.get_int(table_id)
+            except Exception as e:
+                print(f"Failed to read shared generation of {table_id}: {str(e)}")
+        with self._lock:
+            generation = max(generation, self._generations.get(table_id, 0))
+            self._generations[table_id] = generation
+        return generation
+
+    def resync(self):
+        """Re-read the shared counters of every mirrored table, for bumps whose message was missed"""
+        with self._lock:
+            backend = self._backend
+            table_ids = list(self._generations)
+        if backend is None:
+            return
+        for table_id in table_ids:
+            try:
+                self.observe(table_id, backend.get_int(table_id))
+            except Exception as e:
+                print(f"Failed to resync shared generation of {table_id}: {str(e)}")
+
+    def _on_remote_bump(self, message: str):
+        generation, _, table_id = message.partition(" ")
+        try:
+            self.observe(table_id, int(generation))
+        except ValueError:
+            print(f"Ignoring invalidation message: {message}")
+
+    def _notify(self, table_id: str):
+        for listener in self._listeners:
+            listener(table_id)
+
+write_generations = WriteGenerations()
+
+# table_id -> (fetched_at, modified), keeps tables.get calls down when many clients poll
+_modified_cache: Dict[str, Tuple[float, Optional[str]]] = {}
+_modified_lock = threading.Lock()
+
+def table_modified(client, table_id: str) -> Optional[str]:
+    """Table last-modified time from metadata (no query job), briefly cached"""
+    now = time.monotonic()
+    with _modified_lock:
+        cached = _modified_cache.get(table_id)
+    if cached and now - cached[0] < TABLE_METADATA_TTL_SECONDS:
+        return cached[1]
+    try:
+        modified = client.get_table(table_id).modified
+        modified = modified.isoformat() if modified else None
+    except Exception as e:
+        print(f"Failed to read metadata for {table_id}: {str(e)}")
+        modified = None
+    with _modified_lock:
+        _modified_cache[table_id] = (now, modified)
+    return modified
+
+def version_token(client, table_ids: List[str]) -> Optional[str]:
+    """Cheap version of a set of tables: metadata modified time plus local write generation.
+    None when a table's modified time can't be read: the local generation alone would miss
+    writes made by other instances"""
+    parts = []
+    for table_id in table_ids:
+        modified = table_modified(client, table_id)
+        if modified is None:
+            return None
+        parts.append(f"{table_id}:{modified}:{write_generations.get(table_id)}")
+    return "|".join(parts)
+
+def make_etag(version: Optional[str], *variant: Optional[str]) -> Optional[str]:
+    """Weak ETag for a version token and the request variant (e.g. fields=), None without a version"""
+    if version is None:
+        return None
+    digest = sha1("|".join([version, *[v or "" for v in variant]]).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+def etag_headers(etag: Optional[str]) -> Dict[str, str]:
+    return {"ETag": etag} if etag else {}
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Evaluate an If-None-Match header against our ETag (weak comparison), never without one"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
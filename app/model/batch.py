@@ -0,0 +1,22 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+class BatchSubRequest(BaseModel):
+    # echoed back to match responses to requests, defaults to the position
+    id: Optional[str] = None
+    method: str = "GET"
+    # path and query string, e.g. /matches?fields=match_id,status
+    path: str
+    headers: Dict[str, str] = Field(default_factory=dict)
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
+class BatchSubResponse(BaseModel):
+    id: str
+    status: int
+    headers: Dict[str, str] = Field(default_factory=dict)
+    body: Any = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchSubResponse]
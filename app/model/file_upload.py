@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class FileUploadResponse(BaseModel):
@@ -8,6 +8,8 @@ class FileUploadResponse(BaseModel):
     file_size: int
     content_type: str
     uploaded_at: datetime
+    # perceptual hash of images, 16 hex digits
+    phash: Optional[str] = None
 
 class FileUploadInternal(BaseModel):
     file_name: str
@@ -17,4 +19,23 @@ class FileUploadInternal(BaseModel):
     content_type: str
     uploaded_at: datetime
     submission_id: str
-    bucket_path: str 
\ No newline at end of file
+    bucket_path: str
+    phash: Optional[str] = None 
+
+class SimilarFile(BaseModel):
+    file_name: str
+    submission_id: str
+    # differing bits between the perceptual hashes, 0-64
+    distance: int
+
+class SimilarSubmission(BaseModel):
+    submission_id: str
+    # distance of its closest file
+    distance: int
+    file_count: int
+
+class SimilarFilesResponse(BaseModel):
+    file_name: str
+    phash: str
+    files: List[SimilarFile]
+    submissions: List[SimilarSubmission]
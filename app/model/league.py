@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 
 class LeagueRequest(BaseModel):
@@ -16,3 +17,7 @@ class LeagueResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class LeagueBatchItem(BaseModel):
+    id: str
+    found: bool
+    item: Optional[LeagueResponse] = None
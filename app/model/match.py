@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Field
 
 class MatchRequest(BaseModel):
@@ -16,4 +17,16 @@ class MatchResponse(BaseModel):
     match_date: datetime
     league_id: str
     league_name: str
-    status: str
\ No newline at end of file
+    status: str
+
+class MatchUpsertResponse(BaseModel):
+    # distinct match ids received (the last entry of a repeated id wins)
+    received: int
+    inserted: int
+    updated: int
+    unchanged: int
+
+class MatchBatchItem(BaseModel):
+    id: int
+    found: bool
+    item: Optional[MatchResponse] = None
@@ -1,6 +1,20 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, field_validator
+from typing import List, Optional
 from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
+
+def normalize_url(url: str) -> str:
+    """Trimmed URL; absolute URLs also get a lowercase scheme and host and lose the fragment.
+    Anything else (no scheme or host) is only trimmed"""
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+def is_http_url(url: str) -> bool:
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and bool(parts.netloc)
 
 class UrlSubmissionRequest(BaseModel):
     url: str
@@ -10,6 +24,13 @@ class UrlSubmissionRequest(BaseModel):
     status: Optional[str] = None
     image_file_name: Optional[str] = None
 
+    # every way in (single, bulk, update) stores and duplicate-checks the same form of a URL;
+    # only bulk imports reject URLs that aren't http(s)
+    @field_validator("url")
+    @classmethod
+    def _normalize_url(cls, url: str) -> str:
+        return normalize_url(url)
+
 class UrlSubmissionResponse(BaseModel):
     submission_id: str
     url: str
@@ -21,4 +42,44 @@ class UrlSubmissionResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     league_name: Optional[str] = None
-    matches_name: Optional[str] = None 
\ No newline at end of file
+    matches_name: Optional[str] = None 
+
+class BulkUrlSubmissionItem(BaseModel):
+    index: int
+    # accepted, duplicate or rejected
+    status: str
+    url: Optional[str] = None
+    submission_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class BulkUrlSubmissionResponse(BaseModel):
+    accepted: int
+    duplicates: int
+    rejected: int
+    items: List[BulkUrlSubmissionItem]
+
+class UrlSubmissionBatchItem(BaseModel):
+    id: str
+    found: bool
+    item: Optional[UrlSubmissionResponse] = None
+
+class UrlSubmissionListItem(UrlSubmissionResponse):
+    domain: Optional[str] = None
+    file_count: int = 0
+
+class UrlSubmissionFilterResponse(BaseModel):
+    # submissions matching the filters, across all pages
+    total: int
+    items: List[UrlSubmissionListItem]
+
+class UrlSubmissionStatsItem(BaseModel):
+    key: Optional[str] = None
+    count: int
+    file_count: int
+
+class UrlSubmissionSearchResponse(BaseModel):
+    # submissions whose URL matches, across all pages
+    total: int
+    # index or repository
+    source: str
+    items: List[UrlSubmissionResponse]
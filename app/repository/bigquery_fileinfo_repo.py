@@ -1,20 +1,39 @@
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 from fastapi import HTTPException, status
 from google.cloud import bigquery
+from config import QUERY_CACHE_TTL_SECONDS
+from core.bigquery import fetch_rows, run_dml
+from core.compactor import TOMBSTONE_COLUMN
+from core.mutation_scheduler import mutation_queue
+from core.versioning import version_token
 from model.file_upload import FileUploadInternal
 from repository.fileinfo_repo_interface import IDbFileInfoRepository
 
 class DbFileInfoRepository(IDbFileInfoRepository):
-    def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str):
+    # Opt in to the shared query result cache (seconds, None to disable)
+    query_cache_ttl = QUERY_CACHE_TTL_SECONDS
+
+    def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str,
+                 submission_table_name: str = "url_submission"):
         self.client = client
         self.project_id = project_id
         self.dataset_name = dataset_name
         self.table_name = table_name
+        self.table_id = f"{project_id}.{dataset_name}.{table_name}"
+        self.submission_table_id = f"{project_id}.{dataset_name}.{submission_table_name}"
+        self.read_tables = [self.table_id]
+        # deletes by file_name go through the table's mutation queue
+        self.mutations = mutation_queue(client, self.table_id, "file_name", "STRING", {TOMBSTONE_COLUMN: "TIMESTAMP"},
+                                        tombstone_column=TOMBSTONE_COLUMN)
+
+    def version_token(self) -> Optional[str]:
+        return version_token(self.client, [self.table_id])
 
     def save_fileinfo(self, fileinfo: FileUploadInternal) -> bool:
         query = f"""
-        INSERT INTO `{self.project_id}.{self.dataset_name}.{self.table_name}` (submission_id, file_name, orig_file_name, file_url, file_size, content_type, uploaded_at, bucket_path)
-        VALUES (@submission_id, @file_name, @orig_file_name, @file_url, @file_size, @content_type, @uploaded_at, @bucket_path)
+        INSERT INTO `{self.project_id}.{self.dataset_name}.{self.table_name}` (submission_id, file_name, orig_file_name, file_url, file_size, content_type, uploaded_at, bucket_path, phash)
+        VALUES (@submission_id, @file_name, @orig_file_name, @file_url, @file_size, @content_type, @uploaded_at, @bucket_path, @phash)
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
@@ -25,32 +44,33 @@ class DbFileInfoRepository(IDbFileInfoRepository):
                 bigquery.ScalarQueryParameter("file_size", "STRING", fileinfo.file_size),
                 bigquery.ScalarQueryParameter("content_type", "STRING", fileinfo.content_type),
                 bigquery.ScalarQueryParameter("uploaded_at", "TIMESTAMP", fileinfo.uploaded_at),
-                bigquery.ScalarQueryParameter("bucket_path", "STRING", fileinfo.bucket_path)
+                bigquery.ScalarQueryParameter("bucket_path", "STRING", fileinfo.bucket_path),
+                bigquery.ScalarQueryParameter("phash", "STRING", fileinfo.phash)
             ]
         )
-        job = self.client.query(query, job_config=job_config)
         try:
-            job.result()
+            job = run_dml(self.client, query, job_config, self.table_id)
             return job.num_dml_affected_rows is not None and job.num_dml_affected_rows > 0
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
     def get_fileinfo(self, file_name: str) -> Optional[FileUploadInternal]:
         query = f"""
-            SELECT submission_id, file_name, file_url, file_size, content_type, uploaded_at, bucket_path
+            SELECT submission_id, file_name, file_url, file_size, content_type, uploaded_at, bucket_path, phash
             FROM `{self.project_id}.{self.dataset_name}.{self.table_name}`
-            WHERE file_name = @file_name
+            WHERE file_name = @file_name AND deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("file_name", "STRING", file_name)
             ]
         )
-        query_job = self.client.query(query, job_config=job_config)
         try:
-            results = query_job.result()
-            if results.total_rows == 0:
+            results = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+            if not results:
                 return None
             for row in results:
                 return FileUploadInternal(
@@ -60,44 +80,37 @@ class DbFileInfoRepository(IDbFileInfoRepository):
                     file_size=row["file_size"],
                     content_type=row["content_type"],
                     uploaded_at=row["uploaded_at"],
-                    bucket_path=row["bucket_path"]
+                    bucket_path=row["bucket_path"],
+                    phash=row["phash"]
                 )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
     def delete_fileinfo(self, file_name: str) -> bool:
-        query = f"""
-            DELETE FROM `{self.project_id}.{self.dataset_name}.{self.table_name}`
-            WHERE file_name = @file_name
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("file_name", "STRING", file_name)
-            ]
-        )
-        query_job = self.client.query(query, job_config=job_config)
         try:
-            query_job.result()
-            deleted = query_job.num_dml_affected_rows
-            return deleted is not None and deleted > 0
+            # soft delete, the row is purged later
+            return self.mutations.update(file_name, {TOMBSTONE_COLUMN: datetime.now(timezone.utc)})
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
     def get_fileinfo_by_submission_id(self, submission_id: str) -> Optional[List[FileUploadInternal]]:
         query = f"""
-            SELECT submission_id, file_name, file_url, file_size, content_type, uploaded_at, bucket_path
+            SELECT submission_id, file_name, file_url, file_size, content_type, uploaded_at, bucket_path, phash
             FROM `{self.project_id}.{self.dataset_name}.{self.table_name}`
-            WHERE submission_id = @submission_id
+            WHERE submission_id = @submission_id AND deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("submission_id", "STRING", submission_id)
             ]
         )
-        query_job = self.client.query(query, job_config=job_config)
         try:
-            results = query_job.result()
-            if results.total_rows == 0:
+            results = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+            if not results:
                 return None
             ret = []
             for row in results:
@@ -108,8 +121,65 @@ class DbFileInfoRepository(IDbFileInfoRepository):
                     file_size=row["file_size"],
                     content_type=row["content_type"],
                     uploaded_at=row["uploaded_at"],
-                    bucket_path=row["bucket_path"]
+                    bucket_path=row["bucket_path"],
+                    phash=row["phash"]
+                ))
+            return ret
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def _files_by_submission(self, where: str, job_config: Optional[bigquery.QueryJobConfig], tables: List[str]) -> Dict[str, List[FileUploadInternal]]:
+        query = f"""
+            SELECT submission_id, file_name, file_url, file_size, content_type, uploaded_at, bucket_path, phash
+            FROM `{self.project_id}.{self.dataset_name}.{self.table_name}`
+            WHERE {where} AND deleted_at IS NULL
+            ORDER BY uploaded_at
+        """
+        try:
+            results = fetch_rows(self.client, query, job_config, tables=tables, ttl=self.query_cache_ttl)
+            ret: Dict[str, List[FileUploadInternal]] = {}
+            for row in results:
+                ret.setdefault(row["submission_id"], []).append(FileUploadInternal(
+                    submission_id=row["submission_id"],
+                    file_name=row["file_name"],
+                    file_url=row["file_url"],
+                    file_size=row["file_size"],
+                    content_type=row["content_type"],
+                    uploaded_at=row["uploaded_at"],
+                    bucket_path=row["bucket_path"],
+                    phash=row["phash"]
                 ))
             return ret
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def get_fileinfo_by_submission_ids(self, submission_ids: List[str]) -> Dict[str, List[FileUploadInternal]]:
+        if not submission_ids:
+            return {}
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("submission_ids", "STRING", sorted(set(submission_ids)))
+            ]
+        )
+        return self._files_by_submission("submission_id IN UNNEST(@submission_ids)", job_config, self.read_tables)
+
+    def get_fileinfo_of_all_submissions(self) -> Dict[str, List[FileUploadInternal]]:
+        where = f"submission_id IN (SELECT submission_id FROM `{self.submission_table_id}` WHERE deleted_at IS NULL)"
+        return self._files_by_submission(where, None, [*self.read_tables, self.submission_table_id])
+
+    def list_image_hashes(self) -> List[dict]:
+        query = f"""
+            SELECT file_name, submission_id, phash
+            FROM `{self.project_id}.{self.dataset_name}.{self.table_name}`
+            WHERE phash IS NOT NULL AND deleted_at IS NULL
+        """
+        try:
+            return [dict(row.items()) for row in fetch_rows(self.client, query)]
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -3,15 +3,33 @@ from typing import List, Optional
 from uuid import uuid4
 from fastapi import HTTPException, status
 from google.cloud import bigquery
+from config import QUERY_CACHE_TTL_SECONDS
+from core.bigquery import fetch_rows, run_dml
+from core.compactor import TOMBSTONE_COLUMN
+from core.mutation_scheduler import mutation_queue
+from core.projection import project_row, select_list
+from core.versioning import version_token
 from model.league import LeagueRequest, LeagueResponse
 from repository.league_repo_interface import ILeagueRepository
 
 class LeagueRepository(ILeagueRepository):
+    # Opt in to the shared query result cache (seconds, None to disable)
+    query_cache_ttl = QUERY_CACHE_TTL_SECONDS
+    # field -> SQL expression, used for fields= projections
+    COLUMNS = {f: f for f in ("league_id", "league_name", "country", "season", "status", "created_at", "updated_at")}
+
     def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str):
         self.client = client
         self.project_id = project_id
         self.dataset = dataset_name
         self.table = table_name
+        self.table_id = f"{project_id}.{dataset_name}.{table_name}"
+        self.read_tables = [self.table_id]
+        # updates and deletes by league_id go through the table's mutation queue
+        self.mutations = mutation_queue(client, self.table_id, "league_id", "STRING", {
+            "league_name": "STRING", "country": "STRING", "season": "STRING",
+            "status": "STRING", "updated_at": "TIMESTAMP", TOMBSTONE_COLUMN: "TIMESTAMP",
+        }, tombstone_column=TOMBSTONE_COLUMN)
     
     def add(self, league_data: LeagueRequest) -> LeagueResponse:
         # Generate unique league_id
@@ -36,26 +54,31 @@ class LeagueRepository(ILeagueRepository):
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
+            query_job = run_dml(self.client, query, job_config, self.table_id)
             league_info=LeagueResponse(league_id=league_id, league_name=league_data.league_name, country=league_data.country, season=league_data.season, status=league_data.status, created_at=current_timestamp, updated_at=current_timestamp)
             return league_info
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to add league to database: {str(e)}"
             )
-    def list(self) -> List[LeagueResponse]:
-        """ List all leagues"""
+    def list(self, fields: Optional[List[str]] = None) -> List[LeagueResponse]:
+        """ List all leagues, only the given fields (as dicts) when fields is set"""
+        columns = select_list(fields, self.COLUMNS) if fields else "league_id, league_name, country, season, status, created_at, updated_at"
         query = f"""
-            SELECT league_id, league_name, country, season, status, created_at, updated_at
+            SELECT {columns}
             FROM `{self.project_id}.{self.dataset}.{self.table}`
+            WHERE deleted_at IS NULL
             ORDER BY created_at DESC
         """
         try:
-            query_job = self.client.query(query)
+            rows = fetch_rows(self.client, query, tables=self.read_tables, ttl=self.query_cache_ttl, warm=not fields)
+            if fields:
+                return [project_row(row, fields) for row in rows]
             leagues = []
-            for row in query_job:
+            for row in rows:
                 leagues.append(LeagueResponse(
                     league_id=row.league_id,
                     league_name=row.league_name,
@@ -66,41 +89,37 @@ class LeagueRepository(ILeagueRepository):
                     updated_at=row.updated_at
                 ))
             return leagues
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to fetch leagues: {str(e)}"
             )
     
+    def version_token(self) -> Optional[str]:
+        """Version of the leagues table for conditional GETs"""
+        return version_token(self.client, [self.table_id])
+
     def delete(self, league_id: str) -> int:
         """ Delete a league by league_id"""
-        query = f"""
-            DELETE FROM `{self.project_id}.{self.dataset}.{self.table}`
-            WHERE league_id = @league_id
-        """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("league_id", "STRING", league_id),
-            ]
-        )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
-            #print("results.total_rows:",results.total_rows)
-            #print("results.num_results:",results.num_results)
-            # TODO: check affected row
-            return 1
+            # soft delete, the row is purged later
+            return 1 if self.mutations.update(league_id, {TOMBSTONE_COLUMN: datetime.now(timezone.utc)}) else 0
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to delete league: {str(e)}"
             )
         
-    def get(self, league_id: str) -> Optional[LeagueResponse]:
+    def get(self, league_id: str, fields: Optional[List[str]] = None) -> Optional[LeagueResponse]:
+        columns = select_list(fields, self.COLUMNS) if fields else "league_id, league_name, country, season, status, created_at, updated_at"
         query = f"""
-            SELECT league_id, league_name, country, season, status, created_at, updated_at
+            SELECT {columns}
             FROM `{self.project_id}.{self.dataset}.{self.table}`
-            WHERE league_id = @league_id
+            WHERE league_id = @league_id AND deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
@@ -108,8 +127,10 @@ class LeagueRepository(ILeagueRepository):
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            for row in query_job:
+            rows = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+            for row in rows:
+                if fields:
+                    return project_row(row, fields)
                 return LeagueResponse(
                     league_id=row.league_id,
                     league_name=row.league_name,
@@ -119,6 +140,8 @@ class LeagueRepository(ILeagueRepository):
                     created_at=row.created_at,
                     updated_at=row.updated_at
                 )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -126,27 +149,58 @@ class LeagueRepository(ILeagueRepository):
             )
         return None
     
-    def update(self, league_id: str, leage_info: LeagueRequest) -> Optional[LeagueResponse]:
-        """ Update a league by league_id"""
-        current_timestamp = datetime.now(timezone.utc)
+    def get_many(self, league_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """Leagues by id in one query, league_id -> league (dict of the given fields when fields is set)"""
+        # league_id is always selected, to key the result
+        selected = list(dict.fromkeys(["league_id", *fields])) if fields else None
+        columns = select_list(selected, self.COLUMNS) if fields else "league_id, league_name, country, season, status, created_at, updated_at"
         query = f"""
-            UPDATE `{self.project_id}.{self.dataset}.{self.table}`
-            SET league_name = @league_name, country = @country, season = @season, status = @status, updated_at = @updated_at
-            WHERE league_id = @league_id
+            SELECT {columns}
+            FROM `{self.project_id}.{self.dataset}.{self.table}`
+            WHERE league_id IN UNNEST(@league_ids) AND deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("league_name", "STRING", leage_info.league_name),
-                bigquery.ScalarQueryParameter("country", "STRING", leage_info.country),
-                bigquery.ScalarQueryParameter("season", "STRING", leage_info.season),
-                bigquery.ScalarQueryParameter("status", "STRING", leage_info.status),
-                bigquery.ScalarQueryParameter("updated_at", "TIMESTAMP", current_timestamp),
-                bigquery.ScalarQueryParameter("league_id", "STRING", league_id),
+                bigquery.ArrayQueryParameter("league_ids", "STRING", sorted(set(league_ids))),
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
+            rows = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+            leagues = {}
+            for row in rows:
+                if fields:
+                    leagues[row.league_id] = project_row(row, fields)
+                    continue
+                leagues[row.league_id] = LeagueResponse(
+                    league_id=row.league_id,
+                    league_name=row.league_name,
+                    country=row.country,
+                    season=row.season,
+                    status=row.status,
+                    created_at=row.created_at,
+                    updated_at=row.updated_at
+                )
+            return leagues
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch leagues: {str(e)}"
+            )
+
+    def update(self, league_id: str, leage_info: LeagueRequest) -> Optional[LeagueResponse]:
+        """ Update a league by league_id"""
+        current_timestamp = datetime.now(timezone.utc)
+        values = {
+            "league_name": leage_info.league_name,
+            "country": leage_info.country,
+            "season": leage_info.season,
+            "status": leage_info.status,
+            "updated_at": current_timestamp,
+        }
+        try:
+            self.mutations.update(league_id, values)
             # TODO: get updated row
             return LeagueResponse(
                 league_id=league_id,
@@ -157,6 +211,8 @@ class LeagueRepository(ILeagueRepository):
                 created_at=current_timestamp,
                 updated_at=current_timestamp
             )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,6 +1,16 @@
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
+from uuid import uuid4
 from fastapi import HTTPException, status
 from google.cloud import bigquery
+from config import MUTATION_MAX_RETRIES, QUERY_CACHE_TTL_SECONDS
+from core.bigquery import create_table, delete_table, fetch_rows, run_dml, run_load
+from core.compactor import TOMBSTONE_COLUMN
+from core.hedge import hedge_policy
+from core.mutation_scheduler import conflict_backoff, is_serialization_conflict, mutation_queue
+from core.projection import project_row, select_list
+from core.versioning import version_token
 from model.match import MatchRequest, MatchResponse
 from repository.match_repo_interface import IMatchRepository
 
@@ -12,28 +22,85 @@ CREATE TABLE user.matches (
   league_id STRING REFERENCES user.leagues(league_id) NOT ENFORCED,
   match_date TIMESTAMP,
   status STRING,
+  deleted_at TIMESTAMP,
   PRIMARY KEY(match_id) NOT ENFORCED
 )
 """
 
 class MatchRepository(IMatchRepository):
+    # Opt in to the shared query result cache (seconds, None to disable)
+    query_cache_ttl = QUERY_CACHE_TTL_SECONDS
+    # Hedged point reads by id (None unless HEDGE_ENABLED)
+    get_hedge = hedge_policy("match_get")
+    # field -> SQL expression, used for fields= projections
+    COLUMNS = {
+        "match_id": "m.match_id",
+        "home_team": "m.home_team",
+        "away_team": "m.away_team",
+        "match_date": "m.match_date",
+        "league_id": "m.league_id",
+        "league_name": "l.league_name",
+        "status": "m.status",
+    }
+    # fields that need the leagues join
+    JOINED_COLUMNS = {"league_name"}
+    # columns written by upsert_many, with their types
+    WRITE_COLUMNS = {
+        "match_id": "NUMERIC",
+        "home_team": "STRING",
+        "away_team": "STRING",
+        "league_id": "STRING",
+        "match_date": "TIMESTAMP",
+        "status": "STRING",
+    }
+
     def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str, league_table_name: str):
         self.client = client
         self.project_id = project_id
         self.dataset = dataset_name
         self.table = table_name
         self.league_table = league_table_name
+        self.table_id = f"{project_id}.{dataset_name}.{table_name}"
+        self.league_table_id = f"{project_id}.{dataset_name}.{league_table_name}"
+        self.read_tables = [self.table_id, self.league_table_id]
+        # updates and deletes by match_id go through the table's mutation queue
+        self.mutations = mutation_queue(client, self.table_id, "match_id", "NUMERIC", {
+            "home_team": "STRING", "away_team": "STRING", "league_id": "STRING",
+            "match_date": "TIMESTAMP", "status": "STRING", TOMBSTONE_COLUMN: "TIMESTAMP",
+        }, tombstone_column=TOMBSTONE_COLUMN)
+
+    def _from_clause(self, fields: Optional[List[str]]) -> str:
+        """Matches table, joined with leagues only when a league column is requested"""
+        if fields and not self.JOINED_COLUMNS.intersection(fields):
+            return f"`{self.project_id}.{self.dataset}.{self.table}` m"
+        return f"`{self.project_id}.{self.dataset}.{self.table}` m LEFT JOIN {self.dataset}.{self.league_table} l ON m.league_id = l.league_id AND l.deleted_at IS NULL"
 
-    def list_all(self) -> List[MatchResponse]:
-        """List all matches"""
+    def list_all(self, fields: Optional[List[str]] = None) -> List[MatchResponse]:
+        """List all matches, only the given fields (as dicts) when fields is set"""
+        if fields:
+            query = f"""
+                SELECT {select_list(fields, self.COLUMNS)}
+                FROM {self._from_clause(fields)}
+                WHERE m.deleted_at IS NULL
+                ORDER BY m.match_date DESC"""
+            try:
+                return [project_row(row, fields) for row in fetch_rows(self.client, query, tables=self.read_tables, ttl=self.query_cache_ttl)]
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to fetch matches: {str(e)}"
+                )
         query = f"""
             SELECT m.match_id, m.home_team, m.away_team, m.league_id, m.match_date, m.status, l.league_name 
-            FROM {self.dataset}.{self.table} m LEFT JOIN {self.dataset}.{self.league_table} l USING (league_id) 
+            FROM {self.dataset}.{self.table} m LEFT JOIN {self.dataset}.{self.league_table} l ON m.league_id = l.league_id AND l.deleted_at IS NULL
+            WHERE m.deleted_at IS NULL
             ORDER BY m.match_date DESC;"""
         try:
-            query_job = self.client.query(query)
+            rows = fetch_rows(self.client, query, tables=self.read_tables, ttl=self.query_cache_ttl, warm=True)
             matches = []
-            for row in query_job:
+            for row in rows:
                 matches.append(MatchResponse(
                     match_id=row.match_id,
                     home_team=row.home_team,
@@ -43,6 +110,8 @@ class MatchRepository(IMatchRepository):
                     league_name=row.league_name,
                     status=row.status
                 ))
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -50,6 +119,10 @@ class MatchRepository(IMatchRepository):
             )
         return matches
     
+    def version_token(self) -> Optional[str]:
+        """Version of the matches and leagues tables for conditional GETs"""
+        return version_token(self.client, [self.table_id, self.league_table_id])
+
     def add(self, match_data: MatchRequest) -> int:
         """Add match"""
         query = f"""
@@ -68,25 +141,33 @@ class MatchRepository(IMatchRepository):
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            query_job.result() # wait for job done
+            query_job = run_dml(self.client, query, job_config, self.table_id)
             inserted = 0
             if query_job.dml_stats:
                 #print(query_job.dml_stats)
                 inserted = query_job.dml_stats.inserted_row_count
             return inserted
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to add match: {str(e)}"
             )
 
-    def get(self, match_id: int) -> Optional[MatchResponse]:
-        """Get match info"""
-        query = f"""
+    def get(self, match_id: int, fields: Optional[List[str]] = None) -> Optional[MatchResponse]:
+        """Get match info, only the given fields (as dict) when fields is set"""
+        if fields:
+            query = f"""
+                SELECT {select_list(fields, self.COLUMNS)}
+                FROM {self._from_clause(fields)}
+                WHERE m.match_id = @match_id AND m.deleted_at IS NULL
+            """
+        else:
+            query = f"""
             SELECT m.match_id, m.home_team, m.away_team, m.league_id, l.league_name, m.match_date, m.status
-            FROM `{self.project_id}.{self.dataset}.{self.table}` m LEFT JOIN {self.dataset}.{self.league_table} l USING (league_id) 
-            WHERE match_id = @match_id
+            FROM `{self.project_id}.{self.dataset}.{self.table}` m LEFT JOIN {self.dataset}.{self.league_table} l ON m.league_id = l.league_id AND l.deleted_at IS NULL
+            WHERE m.match_id = @match_id AND m.deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
@@ -94,8 +175,10 @@ class MatchRepository(IMatchRepository):
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            for row in query_job:
+            rows = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl, hedge=self.get_hedge)
+            for row in rows:
+                if fields:
+                    return project_row(row, fields)
                 return MatchResponse(
                     match_id=row.match_id,
                     home_team=row.home_team,
@@ -105,6 +188,8 @@ class MatchRepository(IMatchRepository):
                     match_date=row.match_date,
                     status=row.status
                 )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -112,24 +197,59 @@ class MatchRepository(IMatchRepository):
             )
         return None
 
-    def delete(self, match_id: int) -> Optional[int]:
-        """Delete a match"""
-        query = f"""
-            DELETE FROM `{self.project_id}.{self.dataset}.{self.table}`
-            WHERE match_id = @match_id
+    def get_many(self, match_ids: List[int], fields: Optional[List[str]] = None) -> dict:
+        """Matches by id in one query, match_id -> match (dict of the given fields when fields is set)"""
+        if fields:
+            # match_id is always selected, to key the result
+            selected = list(dict.fromkeys(["match_id", *fields]))
+            query = f"""
+                SELECT {select_list(selected, self.COLUMNS)}
+                FROM {self._from_clause(selected)}
+                WHERE m.match_id IN UNNEST(@match_ids) AND m.deleted_at IS NULL
+            """
+        else:
+            query = f"""
+            SELECT m.match_id, m.home_team, m.away_team, m.league_id, l.league_name, m.match_date, m.status
+            FROM `{self.project_id}.{self.dataset}.{self.table}` m LEFT JOIN {self.dataset}.{self.league_table} l ON m.league_id = l.league_id AND l.deleted_at IS NULL
+            WHERE m.match_id IN UNNEST(@match_ids) AND m.deleted_at IS NULL
         """
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("match_id", "NUMERIC", match_id),
+                bigquery.ArrayQueryParameter("match_ids", "NUMERIC", sorted(set(match_ids))),
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            query_job.result() # wait for job done
-            deleted = 0
-            if query_job.dml_stats:
-                deleted = query_job.dml_stats.deleted_row_count
-            return deleted
+            rows = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+            matches = {}
+            for row in rows:
+                if fields:
+                    matches[int(row.match_id)] = project_row(row, fields)
+                    continue
+                matches[int(row.match_id)] = MatchResponse(
+                    match_id=row.match_id,
+                    home_team=row.home_team,
+                    away_team=row.away_team,
+                    league_id=row.league_id,
+                    league_name=row.league_name,
+                    match_date=row.match_date,
+                    status=row.status
+                )
+            return matches
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch matches: {str(e)}"
+            )
+
+    def delete(self, match_id: int) -> Optional[int]:
+        """Delete a match"""
+        try:
+            # soft delete, the row is purged later
+            return 1 if self.mutations.update(match_id, {TOMBSTONE_COLUMN: datetime.now(timezone.utc)}) else 0
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -138,30 +258,85 @@ class MatchRepository(IMatchRepository):
 
     def update(self, match_id: int, match_info: MatchRequest) -> int:
         """Update a match"""
+        values = {
+            "home_team": match_info.home_team,
+            "away_team": match_info.away_team,
+            "league_id": match_info.league_id,
+            "match_date": match_info.match_date,
+            "status": match_info.status,
+        }
+        try:
+            return 1 if self.mutations.update(match_id, values) else 0
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to update match: {str(e)}"
+            )
+
+    def _merge_staging(self, query: str):
+        """Run the upsert MERGE while holding the table's mutation queue, so it never races this
+        instance's updates, retrying serialization conflicts with other writers like the queue does"""
+        attempt = 0
+        while True:
+            try:
+                with self.mutations.exclusive():
+                    return run_dml(self.client, query, table_id=self.table_id)
+            except Exception as e:
+                if not is_serialization_conflict(e) or attempt >= MUTATION_MAX_RETRIES:
+                    raise
+                attempt += 1
+                time.sleep(conflict_backoff(attempt))
+
+    def upsert_many(self, matches: List[MatchRequest]) -> dict:
+        """Insert or update many matches: one load job into a staging table and one MERGE.
+        Match ids must be unique; returns the inserted, updated and unchanged counts"""
+        staging_id = f"{self.project_id}.{self.dataset}._staging_{self.table}_{uuid4().hex}"
+        schema = [bigquery.SchemaField(name, type_) for name, type_ in self.WRITE_COLUMNS.items()]
+        rows = [{**match.model_dump(), "match_date": match.match_date.isoformat()} for match in matches]
+        columns = list(self.WRITE_COLUMNS)
+        # NULL-safe comparison of every data column
+        same = " AND ".join(f"IFNULL(T.{c} = S.{c}, T.{c} IS NULL AND S.{c} IS NULL)" for c in columns if c != "match_id")
+        # counts and MERGE read one snapshot, a concurrent write aborts the commit as a conflict
         query = f"""
-            UPDATE `{self.project_id}.{self.dataset}.{self.table}`
-            SET home_team = @home_team, away_team = @away_team, league_id = @league_id, match_date = @match_date, status = @status
-            WHERE match_id = @match_id
+        DECLARE counts STRUCT<inserted INT64, updated INT64, unchanged INT64>;
+        BEGIN TRANSACTION;
+        SET counts = (
+            SELECT AS STRUCT
+                COUNTIF(T.match_id IS NULL),
+                COUNTIF(T.match_id IS NOT NULL AND NOT ({same})),
+                COUNTIF(T.match_id IS NOT NULL AND {same})
+            FROM `{staging_id}` S
+            LEFT JOIN (SELECT * FROM `{self.table_id}` WHERE deleted_at IS NULL) T ON T.match_id = S.match_id
+        );
+        MERGE `{self.table_id}` T
+        USING `{staging_id}` S
+        ON T.match_id = S.match_id AND T.deleted_at IS NULL
+        WHEN MATCHED AND NOT ({same}) THEN
+            UPDATE SET {", ".join(f"{c} = S.{c}" for c in columns if c != "match_id")}
+        WHEN NOT MATCHED THEN
+            INSERT ({", ".join(columns)}) VALUES ({", ".join(f"S.{c}" for c in columns)});
+        COMMIT TRANSACTION;
+        SELECT counts.inserted, counts.updated, counts.unchanged;
         """
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("match_id", "NUMERIC", match_id),
-                bigquery.ScalarQueryParameter("home_team", "STRING", match_info.home_team),
-                bigquery.ScalarQueryParameter("away_team", "STRING", match_info.away_team),
-                bigquery.ScalarQueryParameter("league_id", "STRING", match_info.league_id),
-                bigquery.ScalarQueryParameter("match_date", "TIMESTAMP", match_info.match_date),
-                bigquery.ScalarQueryParameter("status", "STRING", match_info.status),
-            ]
-        )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            query_job.result()
-            updated = 0
-            if query_job.dml_stats:
-                updated = query_job.dml_stats.updated_row_count
-            return updated
+            # expires on its own should the cleanup below never run
+            staging = bigquery.Table(staging_id, schema=schema)
+            staging.expires = datetime.now(timezone.utc) + timedelta(hours=1)
+            create_table(self.client, staging)
+            try:
+                run_load(self.client, rows, staging_id, schema=schema, bump=False)
+                query_job = self._merge_staging(query)
+                for row in query_job.result():
+                    return {"inserted": row.inserted, "updated": row.updated, "unchanged": row.unchanged}
+                return {"inserted": 0, "updated": 0, "unchanged": 0}
+            finally:
+                delete_table(self.client, staging_id)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to update match: {str(e)}"
-            )
\ No newline at end of file
+                detail=f"Failed to upsert matches: {str(e)}"
+            )
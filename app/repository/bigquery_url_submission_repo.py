@@ -1,16 +1,52 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+import re
 import uuid
+from fastapi import HTTPException
 from google.cloud import bigquery
 from datetime import datetime, timezone
+from config import QUERY_CACHE_TTL_SECONDS
+from core.bigquery import fetch_rows, run_dml, run_load
+from core.compactor import TOMBSTONE_COLUMN
+from core.hedge import hedge_policy
+from core.mutation_scheduler import mutation_queue
+from core.projection import project_row, select_list
+from core.versioning import version_token
+from repository.url_search_index import BOUNDARY
 from repository.url_submission_repo_interface import IUrlSubmissionRepository
 
 class UrlSubmissionRepository(IUrlSubmissionRepository):
+    # Opt in to the shared query result cache (seconds, None to disable)
+    query_cache_ttl = QUERY_CACHE_TTL_SECONDS
+    # Hedged point reads by id (None unless HEDGE_ENABLED)
+    get_hedge = hedge_policy("url_submission_get")
+    # field -> SQL expression, used for fields= projections
+    COLUMNS = {
+        "submission_id": "us.submission_id",
+        "url": "us.url",
+        "type": "us.type",
+        "league_id": "us.league_id",
+        "match_id": "us.match_id",
+        "status": "us.status",
+        "image_file_name": "us.image_file_name",
+        "created_at": "us.created_at",
+        "updated_at": "us.updated_at",
+        "league_name": "l.league_name",
+        "matches_name": "CONCAT(m.home_team, ' VS ', m.away_team, ' (', FORMAT_DATETIME('%Y-%m-%d', m.match_date), ')')",
+    }
+
     def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str = "url_submission"):
         self.client = client
         self.project_id = project_id
         self.dataset_name = dataset_name
         self.table_name = table_name
         self.table_id = f"{project_id}.{dataset_name}.{table_name}"
+        # url_submission plus the tables joined for league_name/matches_name
+        self.read_tables = [self.table_id, f"{project_id}.{dataset_name}.leagues", f"{project_id}.{dataset_name}.matches"]
+        # updates and deletes by submission_id go through the table's mutation queue
+        self.mutations = mutation_queue(client, self.table_id, "submission_id", "STRING", {
+            "url": "STRING", "type": "STRING", "league_id": "STRING", "match_id": "STRING",
+            "status": "STRING", "image_file_name": "STRING", "updated_at": "TIMESTAMP", TOMBSTONE_COLUMN: "TIMESTAMP",
+        }, tombstone_column=TOMBSTONE_COLUMN)
 
     def add_url_submission(self, url: str, type: Optional[str] = None, league_id: Optional[str] = None, 
                           match_id: Optional[str] = None, status: Optional[str] = None, 
@@ -40,8 +76,7 @@ class UrlSubmissionRepository(IUrlSubmissionRepository):
         )
         
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            query_job.result()  # Wait for the query to complete
+            run_dml(self.client, query, job_config, self.table_id)
             
             return {
                 "submission_id": submission_id,
@@ -54,28 +89,63 @@ class UrlSubmissionRepository(IUrlSubmissionRepository):
                 "created_at": current_time,
                 "updated_at": current_time
             }
+        except HTTPException:
+            raise
         except Exception as e:
             raise Exception(f"Error inserting row: {str(e)}")
 
-    def get_url_submission_by_id(self, submission_id: str) -> Optional[dict]:
-        """Get URL submission by submission_id with league and match information"""
+    def add_url_submissions(self, submissions: List[dict]) -> List[dict]:
+        """Add many URL submissions with a single load job, all or none"""
+        current_time = datetime.now(timezone.utc)
+        added = []
+        for submission in submissions:
+            added.append({
+                "submission_id": str(uuid.uuid4()),
+                "url": submission["url"],
+                "type": submission.get("type"),
+                "league_id": submission.get("league_id"),
+                "match_id": submission.get("match_id"),
+                "status": submission.get("status"),
+                "image_file_name": submission.get("image_file_name"),
+                "created_at": current_time,
+                "updated_at": current_time,
+            })
+        if not added:
+            return added
+        timestamp = current_time.isoformat()
+        rows = [{**row, "created_at": timestamp, "updated_at": timestamp} for row in added]
+        try:
+            run_load(self.client, rows, self.table_id)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise Exception(f"Error inserting rows: {str(e)}")
+        return added
+
+    def _select_query(self, fields: Optional[List[str]]) -> str:
+        """SELECT ... FROM ... WHERE with only the joins the requested fields need, deleted rows left out"""
+        fields = fields or list(self.COLUMNS)
         query = f"""
-        SELECT 
-            us.submission_id,
-            us.url,
-            us.type,
-            us.league_id,
-            us.match_id,
-            us.status,
-            us.image_file_name,
-            us.created_at,
-            us.updated_at,
-            l.league_name,
-            CONCAT(m.home_team, ' VS ', m.away_team, ' (', FORMAT_DATETIME('%Y-%m-%d', m.match_date), ')') as matches_name
-        FROM `{self.table_id}` us
-        LEFT JOIN `{self.project_id}.{self.dataset_name}.leagues` l ON us.league_id = l.league_id
-        LEFT JOIN `{self.project_id}.{self.dataset_name}.matches` m ON us.match_id = CAST(m.match_id AS STRING)
-        WHERE us.submission_id = @submission_id
+        SELECT {select_list(fields, self.COLUMNS)}
+        FROM `{self.table_id}` us"""
+        if "league_name" in fields:
+            query += f"""
+        LEFT JOIN `{self.project_id}.{self.dataset_name}.leagues` l ON us.league_id = l.league_id AND l.deleted_at IS NULL"""
+        if "matches_name" in fields:
+            query += f"""
+        LEFT JOIN `{self.project_id}.{self.dataset_name}.matches` m ON us.match_id = CAST(m.match_id AS STRING) AND m.deleted_at IS NULL"""
+        query += """
+        WHERE us.deleted_at IS NULL"""
+        return query
+
+    def version_token(self) -> Optional[str]:
+        """Version of url_submission and the joined tables for conditional GETs"""
+        return version_token(self.client, self.read_tables)
+
+    def get_url_submission_by_id(self, submission_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        """Get URL submission by submission_id with league and match information"""
+        query = self._select_query(fields) + """
+        AND us.submission_id = @submission_id
         """
         
         job_config = bigquery.QueryJobConfig(
@@ -84,67 +154,39 @@ class UrlSubmissionRepository(IUrlSubmissionRepository):
             ]
         )
         
-        query_job = self.client.query(query, job_config=job_config)
-        results = list(query_job)
+        results = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl, hedge=self.get_hedge)
         
         if results:
-            row = results[0]
-            return {
-                "submission_id": row.submission_id,
-                "url": row.url,
-                "type": row.type,
-                "league_id": row.league_id,
-                "match_id": row.match_id,
-                "status": row.status,
-                "image_file_name": row.image_file_name,
-                "created_at": row.created_at,
-                "updated_at": row.updated_at,
-                "league_name": row.league_name,
-                "matches_name": row.matches_name
-            }
+            return project_row(results[0], fields or list(self.COLUMNS))
         return None
 
-    def list_all_url_submissions(self) -> List[dict]:
+    def get_url_submissions_by_ids(self, submission_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """URL submissions by id in one query, submission_id -> submission dict"""
+        fields = fields or list(self.COLUMNS)
+        # submission_id is always selected, to key the result
+        selected = list(dict.fromkeys(["submission_id", *fields]))
+        query = self._select_query(selected) + """
+        AND us.submission_id IN UNNEST(@submission_ids)
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("submission_ids", "STRING", sorted(set(submission_ids))),
+            ]
+        )
+        
+        rows = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
+        return {row.submission_id: project_row(row, fields) for row in rows}
+
+    def list_all_url_submissions(self, fields: Optional[List[str]] = None) -> List[dict]:
         """List all URL submissions with league and match information"""
-        query = f"""
-        SELECT 
-            us.submission_id,
-            us.url,
-            us.type,
-            us.league_id,
-            us.match_id,
-            us.status,
-            us.image_file_name,
-            us.created_at,
-            us.updated_at,
-            l.league_name,
-            CONCAT(m.home_team, ' VS ', m.away_team, ' (', FORMAT_DATETIME('%Y-%m-%d', m.match_date), ')') as matches_name
-        FROM `{self.table_id}` us
-        LEFT JOIN `{self.project_id}.{self.dataset_name}.leagues` l ON us.league_id = l.league_id
-        LEFT JOIN `{self.project_id}.{self.dataset_name}.matches` m ON us.match_id = CAST(m.match_id AS STRING)
+        query = self._select_query(fields) + """
         ORDER BY us.created_at DESC
         """
         
-        query_job = self.client.query(query)
-        results = list(query_job)
-        
-        submissions = []
-        for row in results:
-            submissions.append({
-                "submission_id": row.submission_id,
-                "url": row.url,
-                "type": row.type,
-                "league_id": row.league_id,
-                "match_id": row.match_id,
-                "status": row.status,
-                "image_file_name": row.image_file_name,
-                "created_at": row.created_at,
-                "updated_at": row.updated_at,
-                "league_name": row.league_name,
-                "matches_name": row.matches_name
-            })
-        
-        return submissions
+        rows = fetch_rows(self.client, query, tables=self.read_tables, ttl=self.query_cache_ttl)
+        fields = fields or list(self.COLUMNS)
+        return [project_row(row, fields) for row in rows]
 
     def update_url_submission(self, submission_id: str, url: Optional[str] = None, type: Optional[str] = None,
                              league_id: Optional[str] = None, match_id: Optional[str] = None,
@@ -152,60 +194,32 @@ class UrlSubmissionRepository(IUrlSubmissionRepository):
         """Update URL submission by submission_id"""
         current_time = datetime.now(timezone.utc)
         
-        # Build dynamic update query
-        update_fields = []
-        query_params = [
-            bigquery.ScalarQueryParameter("submission_id", "STRING", submission_id),
-            bigquery.ScalarQueryParameter("updated_at", "TIMESTAMP", current_time)
-        ]
-        
-        if url is not None:
-            update_fields.append("url = @url")
-            query_params.append(bigquery.ScalarQueryParameter("url", "STRING", url))
-        
-        if type is not None:
-            update_fields.append("type = @type")
-            query_params.append(bigquery.ScalarQueryParameter("type", "STRING", type))
-        
-        if league_id is not None:
-            update_fields.append("league_id = @league_id")
-            query_params.append(bigquery.ScalarQueryParameter("league_id", "STRING", league_id))
-        
-        if match_id is not None:
-            update_fields.append("match_id = @match_id")
-            query_params.append(bigquery.ScalarQueryParameter("match_id", "STRING", match_id))
-        
-        if status is not None:
-            update_fields.append("status = @status")
-            query_params.append(bigquery.ScalarQueryParameter("status", "STRING", status))
-        
-        if image_file_name is not None:
-            update_fields.append("image_file_name = @image_file_name")
-            query_params.append(bigquery.ScalarQueryParameter("image_file_name", "STRING", image_file_name))
+        # Only the given fields change
+        candidates = {"url": url, "type": type, "league_id": league_id, "match_id": match_id,
+                      "status": status, "image_file_name": image_file_name}
+        values = {column: value for column, value in candidates.items() if value is not None}
         
-        if not update_fields:
+        if not values:
             return self.get_url_submission_by_id(submission_id)
         
-        update_fields.append("updated_at = @updated_at")
-        
-        query = f"""
-        UPDATE `{self.table_id}`
-        SET {', '.join(update_fields)}
-        WHERE submission_id = @submission_id
-        """
-        
-        job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        query_job = self.client.query(query, job_config=job_config)
-        query_job.result()  # Wait for the query to complete
+        values["updated_at"] = current_time
+        self.mutations.update(submission_id, values)
         
         return self.get_url_submission_by_id(submission_id)
 
+    def update_url_submission_statuses(self, statuses: Dict[str, str]) -> set:
+        """Set the status of many submissions, queued together so they land in shared MERGEs"""
+        current_time = datetime.now(timezone.utc)
+        return self.mutations.update_many({
+            submission_id: {"status": status, "updated_at": current_time} for submission_id, status in statuses.items()
+        })
+
     def check_url_exists_in_match(self, url: str, match_id: str) -> bool:
         """Check if URL already exists for a specific match_id"""
         query = f"""
         SELECT COUNT(*) as count
         FROM `{self.table_id}`
-        WHERE url = @url AND match_id = @match_id
+        WHERE url = @url AND match_id = @match_id AND deleted_at IS NULL
         """
         
         job_config = bigquery.QueryJobConfig(
@@ -215,26 +229,139 @@ class UrlSubmissionRepository(IUrlSubmissionRepository):
             ]
         )
         
-        query_job = self.client.query(query, job_config=job_config)
-        results = list(query_job)
+        # not cached: a miss must see submissions made through other instances
+        results = fetch_rows(self.client, query, job_config, tables=[self.table_id])
         
         return results[0].count > 0
 
+    def find_existing_urls(self, pairs: List[tuple]) -> set:
+        """The (url, match_id) pairs that are already submitted, in one query"""
+        if not pairs:
+            return set()
+        query = f"""
+        SELECT DISTINCT us.url, us.match_id
+        FROM `{self.table_id}` us
+        JOIN UNNEST(@pairs) p ON us.url = p.url AND us.match_id = p.match_id
+        WHERE us.deleted_at IS NULL
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("pairs", "STRUCT", [
+                    bigquery.StructQueryParameter(
+                        None,
+                        bigquery.ScalarQueryParameter("url", "STRING", url),
+                        bigquery.ScalarQueryParameter("match_id", "STRING", match_id),
+                    )
+                    for url, match_id in pairs
+                ]),
+            ]
+        )
+        # not cached, like check_url_exists_in_match
+        rows = fetch_rows(self.client, query, job_config, tables=[self.table_id])
+        return {(row.url, row.match_id) for row in rows}
+
     def delete_url_submission(self, submission_id: str) -> bool:
         """Delete URL submission by submission_id"""
+        # soft delete, the row is purged later; True if it existed.
+        # updated_at moves too, so readers following it see the delete
+        current_time = datetime.now(timezone.utc)
+        return self.mutations.update(submission_id, {TOMBSTONE_COLUMN: current_time, "updated_at": current_time})
+
+    def list_changed_url_submissions(self, since: Optional[datetime] = None) -> List[dict]:
+        """Submissions changed since a watermark, with file counts, for local replicas. Soft deletes of
+        leagues and matches count as changes; matches have no updated_at, so renamed matches only reach
+        replicas with a full sync"""
+        files_table = f"{self.project_id}.{self.dataset_name}.uploadfile"
+        if since is None:
+            changed = "us.deleted_at IS NULL"
+            parameters = []
+        else:
+            # tombstoned leagues and matches are filtered out of the joins, hence the subqueries
+            changed = f"""(us.updated_at >= @since OR l.updated_at >= @since OR us.submission_id IN (
+            SELECT submission_id FROM `{files_table}` WHERE uploaded_at >= @since OR deleted_at >= @since)
+            OR us.league_id IN (
+            SELECT league_id FROM `{self.project_id}.{self.dataset_name}.leagues` WHERE deleted_at >= @since)
+            OR us.match_id IN (
+            SELECT CAST(match_id AS STRING) FROM `{self.project_id}.{self.dataset_name}.matches` WHERE deleted_at >= @since))"""
+            parameters = [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]
         query = f"""
-        DELETE FROM `{self.table_id}`
-        WHERE submission_id = @submission_id
+        SELECT us.submission_id, us.url, us.type, us.league_id, us.match_id, us.status, us.image_file_name,
+            us.created_at, us.updated_at, {self.COLUMNS["league_name"]} AS league_name,
+            {self.COLUMNS["matches_name"]} AS matches_name,
+            IFNULL(f.file_count, 0) AS file_count, us.deleted_at IS NOT NULL AS deleted
+        FROM `{self.table_id}` us
+        LEFT JOIN `{self.project_id}.{self.dataset_name}.leagues` l ON us.league_id = l.league_id AND l.deleted_at IS NULL
+        LEFT JOIN `{self.project_id}.{self.dataset_name}.matches` m ON us.match_id = CAST(m.match_id AS STRING) AND m.deleted_at IS NULL
+        LEFT JOIN (
+            SELECT submission_id, COUNT(*) AS file_count FROM `{files_table}`
+            WHERE deleted_at IS NULL GROUP BY submission_id
+        ) f ON f.submission_id = us.submission_id
+        WHERE {changed}
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+        rows = fetch_rows(self.client, query, job_config, short=since is not None)
+        return [dict(row.items()) for row in rows]
+
+    @staticmethod
+    def _search_terms(q: str) -> str:
+        """Parts of q that any URL containing it has as whole tokens, for SEARCH: the ones
+        between two delimiters (the edges may be partial tokens), letters and digits only"""
+        parts = re.split(r"[./:?=&@]+", q)
+        return " ".join(part for part in parts[1:-1] if part.isascii() and part.isalnum())
+
+    def search_url_submissions(self, q: str, limit: int, offset: int) -> Tuple[int, List[str]]:
+        """Ranked URL substring search in one query. When q has whole tokens, SEARCH narrows
+        the scan first (pruned by a search index on url, if the table has one)"""
+        where, parameters = self._search_filter(q)
+        query = f"""
+        WITH hits AS (
+            SELECT us.submission_id, us.created_at, LOWER(us.url) AS url,
+                REGEXP_REPLACE(LOWER(us.url), r'^[a-z][a-z0-9+.-]*://', '') AS bare,
+                IFNULL(NET.HOST(LOWER(us.url)), '') AS host, STRPOS(LOWER(us.url), @q) AS position
+            FROM `{self.table_id}` us
+            {where}
+        )
+        SELECT submission_id, COUNT(*) OVER () AS total
+        FROM hits
+        ORDER BY
+            CASE
+                WHEN url = @q OR bare = @q THEN 0
+                WHEN host = @q OR ENDS_WITH(host, CONCAT('.', @q)) THEN 1
+                WHEN position = 1 OR STARTS_WITH(bare, @q) OR REGEXP_CONTAINS(url, @boundary) THEN 2
+                ELSE 3
+            END,
+            position, LENGTH(url), created_at DESC, submission_id
+        LIMIT @limit OFFSET @offset
         """
-        
         job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("submission_id", "STRING", submission_id),
+            query_parameters=parameters + [
+                bigquery.ScalarQueryParameter("boundary", "STRING", f"[{re.escape(BOUNDARY)}]{re.escape(q)}"),
+                bigquery.ScalarQueryParameter("limit", "INT64", limit),
+                bigquery.ScalarQueryParameter("offset", "INT64", offset),
             ]
         )
-        
-        query_job = self.client.query(query, job_config=job_config)
-        query_job.result()  # Wait for the query to complete
-        
-        # Check if any rows were affected
-        return query_job.num_dml_affected_rows is not None and query_job.num_dml_affected_rows > 0 
\ No newline at end of file
+        rows = fetch_rows(self.client, query, job_config, tables=[self.table_id], ttl=self.query_cache_ttl)
+        if not rows:
+            # past the last page there is no row to carry the total
+            return (self._count_matches(where, parameters) if offset else 0), []
+        return rows[0].total, [row.submission_id for row in rows]
+
+    def _search_filter(self, q: str) -> tuple:
+        """WHERE clause and parameters selecting the live submissions whose URL contains q"""
+        where = "WHERE us.deleted_at IS NULL AND STRPOS(LOWER(us.url), @q) > 0"
+        parameters = [bigquery.ScalarQueryParameter("q", "STRING", q)]
+        terms = self._search_terms(q)
+        if terms:
+            where += " AND SEARCH(us.url, @terms)"
+            parameters.append(bigquery.ScalarQueryParameter("terms", "STRING", terms))
+        return where, parameters
+
+    def _count_matches(self, where: str, parameters: list) -> int:
+        query = f"""
+        SELECT COUNT(*) AS total
+        FROM `{self.table_id}` us
+        {where}
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+        rows = fetch_rows(self.client, query, job_config, tables=[self.table_id], ttl=self.query_cache_ttl)
+        return rows[0].total
@@ -1,15 +1,22 @@
 from typing import Optional
 from fastapi import HTTPException, status
 from google.cloud import bigquery
+from config import QUERY_CACHE_TTL_SECONDS
+from core.bigquery import fetch_rows
 
 from repository.user_repo_interface import IUserRepository
 
 class UserRepository(IUserRepository):
+    # Opt in to the shared query result cache (seconds, None to disable)
+    query_cache_ttl = QUERY_CACHE_TTL_SECONDS
+
     def __init__(self, client: bigquery.Client, project_id: str, dataset_name: str, table_name: str):
         self.client = client
         self.project_id = project_id
         self.dataset = dataset_name
         self.table = table_name
+        self.table_id = f"{project_id}.{dataset_name}.{table_name}"
+        self.read_tables = [self.table_id]
     
     def get_user_by_username(self, username: str) -> Optional[dict]:
         """Get user by username from BigQuery"""
@@ -27,8 +34,7 @@ class UserRepository(IUserRepository):
         )
         
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = list(query_job.result())
+            results = fetch_rows(self.client, query, job_config, tables=self.read_tables, ttl=self.query_cache_ttl)
             
             if results:
                 row = results[0]
@@ -43,6 +49,8 @@ class UserRepository(IUserRepository):
                     "last_login": row.last_login
                 }
             return None
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Dict, List, Optional
 from model.file_upload import FileUploadInternal
 
 class IDbFileInfoRepository(ABC):
@@ -7,6 +7,22 @@ class IDbFileInfoRepository(ABC):
     def get_fileinfo_by_submission_id(self, submission_id: str) -> Optional[List[FileUploadInternal]]:
         pass
 
+    @abstractmethod
+    def get_fileinfo_by_submission_ids(self, submission_ids: List[str]) -> Dict[str, List[FileUploadInternal]]:
+        """submission_id -> its files, in one query"""
+        pass
+
+    @abstractmethod
+    def get_fileinfo_of_all_submissions(self) -> Dict[str, List[FileUploadInternal]]:
+        """submission_id -> its files for every live submission, joined in the database
+        rather than shipping every id"""
+        pass
+
+    @abstractmethod
+    def version_token(self) -> Optional[str]:
+        """Cheap token that changes whenever the stored file info may have changed"""
+        pass
+
     @abstractmethod
     def get_fileinfo(self, file_name: str) -> Optional[FileUploadInternal]:
         pass
@@ -17,4 +33,9 @@ class IDbFileInfoRepository(ABC):
 
     @abstractmethod
     def delete_fileinfo(self, file_name: str) -> bool:
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def list_image_hashes(self) -> List[dict]:
+        """file_name, submission_id and phash of every file that has a perceptual hash"""
+        pass
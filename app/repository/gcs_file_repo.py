@@ -1,22 +1,40 @@
-from google.cloud import storage
+import threading
 from datetime import datetime, timezone, timedelta
 import uuid
 import os
 from typing import Optional
 from repository.file_repo_interface import IGCSFileRepository
+from core.limiter import Overloaded, gcs_limiter
+from core.transport import transport
 
 class GCSFileRepository(IGCSFileRepository):
     def __init__(self, bucket_name: str = "web_anti", project_id: str = "practise-bi", service_account_path: Optional[str] = None):
         self.bucket_name = bucket_name
         self.project_id = project_id
-        
-        # Use service account file if provided
-        if service_account_path:
-            self.client = storage.Client.from_service_account_json(service_account_path, project=project_id)
-        else:
-            self.client = storage.Client(project=project_id)
-            
-        self.bucket = self.client.bucket(bucket_name)
+        self.service_account_path = service_account_path
+        # The storage client is created on first use, it is only needed for uploads
+        self._client = None
+        self._bucket = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # Use service account file if provided, else the shared pooled transport
+                    if self.service_account_path:
+                        from google.cloud import storage
+                        self._client = storage.Client.from_service_account_json(self.service_account_path, project=self.project_id)
+                    else:
+                        self._client = transport.storage_client(self.project_id)
+        return self._client
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = self.client.bucket(self.bucket_name)
+        return self._bucket
 
     def upload_file(self, file_content: bytes, unique_file_name: str, content_type: str, prefix: str) -> dict:
         """Upload file to Google Cloud Storage"""
@@ -31,12 +49,13 @@ class GCSFileRepository(IGCSFileRepository):
         # Set content type
         blob.content_type = content_type
         
-        # Upload file
-        blob.upload_from_string(file_content, content_type=content_type)
-        
-        # Get file size
-        blob.reload()
-        file_size = blob.size
+        with gcs_limiter.slot("upload"):
+            # Upload file
+            blob.upload_from_string(file_content, content_type=content_type)
+
+            # Get file size
+            blob.reload()
+            file_size = blob.size
         
         # Try to generate signed URL, fallback to public URL if no private key
         try:
@@ -68,8 +87,11 @@ class GCSFileRepository(IGCSFileRepository):
         try:
             blob_path = f"{prefix}{file_name}"
             blob = self.bucket.blob(blob_path)
-            blob.delete()
+            with gcs_limiter.slot("delete"):
+                blob.delete()
             return True
+        except Overloaded:
+            raise
         except Exception:
             return False
 
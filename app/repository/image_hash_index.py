@@ -0,0 +1,165 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.limiter import BULK, priority
+from repository.fileinfo_repo_interface import IDbFileInfoRepository
+
+# set bits of every 16-bit value, for numpy without bitwise_count
+_POPCOUNT16 = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT16[values.view(np.uint16)].reshape(-1, 4).sum(axis=1, dtype=np.uint8)
+
+class _HashTable:
+    """Packed 64-bit hashes in one array, with the file and submission of each slot"""
+    def __init__(self, capacity: int = 1024):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.file_names: List[str] = []
+        self.submission_ids: List[str] = []
+        # file_name -> slot
+        self.slots: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.file_names)
+
+    def add(self, file_name: str, submission_id: str, phash: str):
+        self.remove(file_name)
+        size = len(self.file_names)
+        if size == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros(size, dtype=np.uint64)])
+        self.hashes[size] = int(phash, 16)
+        self.file_names.append(file_name)
+        self.submission_ids.append(submission_id)
+        self.slots[file_name] = size
+
+    def remove(self, file_name: str):
+        slot = self.slots.pop(file_name, None)
+        if slot is None:
+            return
+        # the last entry moves into the freed slot
+        last = len(self.file_names) - 1
+        if slot != last:
+            self.hashes[slot] = self.hashes[last]
+            self.file_names[slot] = self.file_names[last]
+            self.submission_ids[slot] = self.submission_ids[last]
+            self.slots[self.file_names[slot]] = slot
+        self.file_names.pop()
+        self.submission_ids.pop()
+
+    def get(self, file_name: str) -> Optional[str]:
+        slot = self.slots.get(file_name)
+        return f"{int(self.hashes[slot]):016x}" if slot is not None else None
+
+    def within(self, phash: str, max_distance: int) -> List[Tuple[int, str, str]]:
+        """(distance, file_name, submission_id) of every hash at most max_distance bits away"""
+        distances = _popcount(self.hashes[:len(self.file_names)] ^ np.uint64(int(phash, 16)))
+        slots = np.flatnonzero(distances <= max_distance)
+        return [(int(distances[i]), self.file_names[i], self.submission_ids[i]) for i in slots]
+
+class ImageHashIndex:
+    """Perceptual hashes of every uploaded image, for near-duplicate lookups.
+
+    The hashes sit in one packed uint64 array, so a lookup is a vectorized XOR
+    and popcount over all of them (a few milliseconds for hundreds of thousands
+    of images). The index is built from the file info repository in the
+    background, updated by this instance's uploads and deletes, and rebuilt
+    periodically to pick up other instances' uploads."""
+    def __init__(self, fileinfo_repo: IDbFileInfoRepository, rebuild_interval: float):
+        self.fileinfo_repo = fileinfo_repo
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._table = _HashTable()
+        # changes made while a rebuild reads the repository, replayed onto the new table
+        self._pending: Optional[list] = None
+        self.built_at: Optional[str] = None
+        self.build_seconds: Optional[float] = None
+        self.builds = 0
+        self.lookups = 0
+        self.errors = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def add(self, file_name: str, submission_id: str, phash: str):
+        with self._lock:
+            self._table.add(file_name, submission_id, phash)
+            if self._pending is not None:
+                self._pending.append((file_name, submission_id, phash))
+
+    def remove(self, file_name: str):
+        with self._lock:
+            self._table.remove(file_name)
+            if self._pending is not None:
+                self._pending.append((file_name, None, None))
+
+    def get(self, file_name: str) -> Optional[str]:
+        with self._lock:
+            return self._table.get(file_name)
+
+    def similar(self, phash: str, max_distance: int) -> List[Tuple[int, str, str]]:
+        """(distance, file_name, submission_id) of the images within max_distance bits, closest first"""
+        with self._lock:
+            self.lookups += 1
+            matches = self._table.within(phash, max_distance)
+        return sorted(matches)
+
+    def build(self):
+        """Reload every hash from the repository, then swap the new table in"""
+        with self._build_lock:
+            started = time.monotonic()
+            with self._lock:
+                self._pending = []
+            try:
+                with priority(BULK):
+                    rows = self.fileinfo_repo.list_image_hashes()
+                table = _HashTable(max(1024, len(rows) * 2))
+                for row in rows:
+                    table.add(row["file_name"], row["submission_id"], row["phash"])
+                with self._lock:
+                    for file_name, submission_id, phash in self._pending:
+                        if phash is None:
+                            table.remove(file_name)
+                        else:
+                            table.add(file_name, submission_id, phash)
+                    self._table = table
+                    self.built_at = datetime.now(timezone.utc).isoformat()
+                    self.build_seconds = round(time.monotonic() - started, 3)
+                    self.builds += 1
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    def _loop(self):
+        while True:
+            try:
+                self.build()
+            except Exception as e:
+                self.errors += 1
+                print(f"Image hash index build failed: {str(e)}")
+            time.sleep(self.rebuild_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="image-hash-index", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "images": len(self._table),
+                "built_at": self.built_at,
+                "build_seconds": self.build_seconds,
+                "builds": self.builds,
+                "lookups": self.lookups,
+                "errors": self.errors,
+            }
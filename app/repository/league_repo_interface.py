@@ -8,7 +8,12 @@ class ILeagueRepository(ABC):
         pass
 
     @abstractmethod
-    def list(self) -> List[LeagueResponse]:
+    def list(self, fields: Optional[List[str]] = None) -> List[LeagueResponse]:
+        pass
+
+    @abstractmethod
+    def version_token(self) -> Optional[str]:
+        """Cheap token that changes whenever the listed data may have changed"""
         pass
 
     @abstractmethod
@@ -16,7 +21,12 @@ class ILeagueRepository(ABC):
         pass
 
     @abstractmethod
-    def get(self, league_id: str) -> Optional[LeagueResponse]:
+    def get(self, league_id: str, fields: Optional[List[str]] = None) -> Optional[LeagueResponse]:
+        pass
+
+    @abstractmethod
+    def get_many(self, league_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """league_id -> league for the ids that exist"""
         pass
 
     @abstractmethod
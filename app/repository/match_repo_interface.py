@@ -4,7 +4,12 @@ from model.match import MatchRequest, MatchResponse
 
 class IMatchRepository(ABC):
     @abstractmethod
-    def list_all(self) -> List[MatchResponse]:
+    def list_all(self, fields: Optional[List[str]] = None) -> List[MatchResponse]:
+        pass
+
+    @abstractmethod
+    def version_token(self) -> Optional[str]:
+        """Cheap token that changes whenever the listed data may have changed"""
         pass
 
     @abstractmethod
@@ -12,9 +17,14 @@ class IMatchRepository(ABC):
         pass
 
     @abstractmethod
-    def get(self, match_id: int) -> Optional[MatchResponse]:
+    def get(self, match_id: int, fields: Optional[List[str]] = None) -> Optional[MatchResponse]:
         pass
     
+    @abstractmethod
+    def get_many(self, match_ids: List[int], fields: Optional[List[str]] = None) -> dict:
+        """match_id -> match for the ids that exist"""
+        pass
+
     @abstractmethod
     def delete(self, match_id: int) -> Optional[int]:
         pass
@@ -22,3 +32,8 @@ class IMatchRepository(ABC):
     @abstractmethod
     def update(self, match_id: int, match_info: MatchRequest) -> int:
         pass
+
+    @abstractmethod
+    def upsert_many(self, matches: List[MatchRequest]) -> dict:
+        """Insert or update matches by match_id, returns inserted/updated/unchanged counts"""
+        pass
@@ -0,0 +1,75 @@
+from typing import Dict, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import delete, insert, select
+from sqlalchemy.engine import Engine
+from core.sql import bump_versions, sql_version_token, uploadfile, url_submission
+from model.file_upload import FileUploadInternal
+from repository.fileinfo_repo_interface import IDbFileInfoRepository
+
+class SqlDbFileInfoRepository(IDbFileInfoRepository):
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def _fileinfo(self, row) -> FileUploadInternal:
+        return FileUploadInternal(**{**row, "orig_file_name": row["orig_file_name"] or ""})
+
+    def version_token(self) -> str:
+        return sql_version_token(self.engine, [uploadfile])
+
+    def save_fileinfo(self, fileinfo: FileUploadInternal) -> bool:
+        try:
+            with self.engine.begin() as conn:
+                saved = conn.execute(insert(uploadfile).values(**fileinfo.model_dump())).rowcount
+                bump_versions(conn, [uploadfile])
+            return saved > 0
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def get_fileinfo(self, file_name: str) -> Optional[FileUploadInternal]:
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(select(uploadfile).where(uploadfile.c.file_name == file_name)).mappings().first()
+            return self._fileinfo(row) if row is not None else None
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def delete_fileinfo(self, file_name: str) -> bool:
+        try:
+            with self.engine.begin() as conn:
+                deleted = conn.execute(delete(uploadfile).where(uploadfile.c.file_name == file_name)).rowcount
+                if deleted:
+                    bump_versions(conn, [uploadfile])
+            return deleted > 0
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def get_fileinfo_by_submission_id(self, submission_id: str) -> Optional[List[FileUploadInternal]]:
+        return self.get_fileinfo_by_submission_ids([submission_id]).get(submission_id)
+
+    def get_fileinfo_by_submission_ids(self, submission_ids: List[str]) -> Dict[str, List[FileUploadInternal]]:
+        if not submission_ids:
+            return {}
+        return self._files_by_submission(uploadfile.c.submission_id.in_(sorted(set(submission_ids))))
+
+    def get_fileinfo_of_all_submissions(self) -> Dict[str, List[FileUploadInternal]]:
+        return self._files_by_submission(uploadfile.c.submission_id.in_(select(url_submission.c.submission_id)))
+
+    def _files_by_submission(self, condition) -> Dict[str, List[FileUploadInternal]]:
+        query = select(uploadfile).where(condition).order_by(uploadfile.c.uploaded_at)
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+            ret: Dict[str, List[FileUploadInternal]] = {}
+            for row in rows:
+                ret.setdefault(row["submission_id"], []).append(self._fileinfo(row))
+            return ret
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    def list_image_hashes(self) -> List[dict]:
+        query = select(uploadfile.c.file_name, uploadfile.c.submission_id, uploadfile.c.phash).where(uploadfile.c.phash.isnot(None))
+        try:
+            with self.engine.connect() as conn:
+                return [dict(row) for row in conn.execute(query).mappings()]
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from uuid import uuid4
+from fastapi import HTTPException, status
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Engine
+from core.projection import project_row
+from core.sql import bump_versions, leagues, sql_version_token
+from model.league import LeagueRequest, LeagueResponse
+from repository.league_repo_interface import ILeagueRepository
+
+class SqlLeagueRepository(ILeagueRepository):
+    # field -> column, used for fields= projections
+    COLUMNS = {c.name: c for c in leagues.columns}
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def _select(self, fields: Optional[List[str]]):
+        return select(*(self.COLUMNS[f] for f in fields)) if fields else select(leagues)
+
+    def add(self, league_data: LeagueRequest) -> LeagueResponse:
+        league_id = str(uuid4())
+        current_timestamp = datetime.now(timezone.utc)
+        league = LeagueResponse(league_id=league_id, created_at=current_timestamp, updated_at=current_timestamp,
+                                **league_data.model_dump())
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(leagues).values(**league.model_dump()))
+                bump_versions(conn, [leagues])
+            return league
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to add league to database: {str(e)}"
+            )
+
+    def list(self, fields: Optional[List[str]] = None) -> List[LeagueResponse]:
+        """ List all leagues, only the given fields (as dicts) when fields is set"""
+        query = self._select(fields).order_by(leagues.c.created_at.desc())
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch leagues: {str(e)}"
+            )
+        if fields:
+            return [project_row(row, fields) for row in rows]
+        return [LeagueResponse(**row) for row in rows]
+
+    def version_token(self) -> str:
+        """Version of the leagues table for conditional GETs"""
+        return sql_version_token(self.engine, [leagues])
+
+    def delete(self, league_id: str) -> int:
+        """ Delete a league by league_id"""
+        try:
+            with self.engine.begin() as conn:
+                deleted = conn.execute(delete(leagues).where(leagues.c.league_id == league_id)).rowcount
+                if deleted:
+                    bump_versions(conn, [leagues])
+            return deleted
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to delete league: {str(e)}"
+            )
+
+    def get(self, league_id: str, fields: Optional[List[str]] = None) -> Optional[LeagueResponse]:
+        query = self._select(fields).where(leagues.c.league_id == league_id)
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(query).mappings().first()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch league: {str(e)}"
+            )
+        if row is None:
+            return None
+        return project_row(row, fields) if fields else LeagueResponse(**row)
+
+    def get_many(self, league_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """Leagues by id in one query, league_id -> league (dict of the given fields when fields is set)"""
+        # league_id is always selected, to key the result
+        selected = list(dict.fromkeys(["league_id", *fields])) if fields else None
+        query = self._select(selected).where(leagues.c.league_id.in_(sorted(set(league_ids))))
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch leagues: {str(e)}"
+            )
+        if fields:
+            return {row["league_id"]: project_row(row, fields) for row in rows}
+        return {row["league_id"]: LeagueResponse(**row) for row in rows}
+
+    def update(self, league_id: str, leage_info: LeagueRequest) -> Optional[LeagueResponse]:
+        """ Update a league by league_id, None when it doesn't exist"""
+        current_timestamp = datetime.now(timezone.utc)
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(
+                    update(leagues).where(leagues.c.league_id == league_id)
+                    .values(**leage_info.model_dump(), updated_at=current_timestamp)
+                    .returning(*leagues.columns)
+                ).mappings().first()
+                if row is not None:
+                    bump_versions(conn, [leagues])
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to update league: {str(e)}"
+            )
+        return LeagueResponse(**row) if row is not None else None
@@ -0,0 +1,160 @@
+from typing import Optional, List
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.engine import Engine
+from core.projection import project_row
+from core.sql import bump_versions, leagues, matches, sql_version_token
+from model.match import MatchRequest, MatchResponse
+from repository.match_repo_interface import IMatchRepository
+
+class SqlMatchRepository(IMatchRepository):
+    # field -> column, used for fields= projections
+    COLUMNS = {
+        "match_id": matches.c.match_id,
+        "home_team": matches.c.home_team,
+        "away_team": matches.c.away_team,
+        "match_date": matches.c.match_date,
+        "league_id": matches.c.league_id,
+        "league_name": leagues.c.league_name,
+        "status": matches.c.status,
+    }
+    # fields that need the leagues join
+    JOINED_COLUMNS = {"league_name"}
+    # ids per IN list, below SQLite's bound parameter limit
+    CHUNK_SIZE = 500
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def _select(self, fields: Optional[List[str]]):
+        """Matches, joined with leagues only when a league column is requested"""
+        fields = fields or list(self.COLUMNS)
+        query = select(*(self.COLUMNS[f] for f in fields))
+        if self.JOINED_COLUMNS.intersection(fields):
+            return query.select_from(matches.outerjoin(leagues, matches.c.league_id == leagues.c.league_id))
+        return query.select_from(matches)
+
+    def list_all(self, fields: Optional[List[str]] = None) -> List[MatchResponse]:
+        """List all matches, only the given fields (as dicts) when fields is set"""
+        query = self._select(fields).order_by(matches.c.match_date.desc())
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch matches: {str(e)}"
+            )
+        if fields:
+            return [project_row(row, fields) for row in rows]
+        return [MatchResponse(**row) for row in rows]
+
+    def version_token(self) -> str:
+        """Version of the matches and leagues tables for conditional GETs"""
+        return sql_version_token(self.engine, [matches, leagues])
+
+    def add(self, match_data: MatchRequest) -> int:
+        """Add match"""
+        try:
+            with self.engine.begin() as conn:
+                inserted = conn.execute(insert(matches).values(**match_data.model_dump())).rowcount
+                bump_versions(conn, [matches])
+            return inserted
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to add match: {str(e)}"
+            )
+
+    def get(self, match_id: int, fields: Optional[List[str]] = None) -> Optional[MatchResponse]:
+        """Get match info, only the given fields (as dict) when fields is set"""
+        query = self._select(fields).where(matches.c.match_id == match_id)
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(query).mappings().first()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch match: {str(e)}"
+            )
+        if row is None:
+            return None
+        return project_row(row, fields) if fields else MatchResponse(**row)
+
+    def get_many(self, match_ids: List[int], fields: Optional[List[str]] = None) -> dict:
+        """Matches by id in one query, match_id -> match (dict of the given fields when fields is set)"""
+        # match_id is always selected, to key the result
+        selected = list(dict.fromkeys(["match_id", *fields])) if fields else None
+        query = self._select(selected).where(matches.c.match_id.in_(sorted(set(match_ids))))
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to fetch matches: {str(e)}"
+            )
+        if fields:
+            return {int(row["match_id"]): project_row(row, fields) for row in rows}
+        return {int(row["match_id"]): MatchResponse(**row) for row in rows}
+
+    def delete(self, match_id: int) -> Optional[int]:
+        """Delete a match"""
+        try:
+            with self.engine.begin() as conn:
+                deleted = conn.execute(delete(matches).where(matches.c.match_id == match_id)).rowcount
+                if deleted:
+                    bump_versions(conn, [matches])
+            return deleted
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to delete match: {str(e)}"
+            )
+
+    def update(self, match_id: int, match_info: MatchRequest) -> int:
+        """Update a match"""
+        values = match_info.model_dump(exclude={"match_id"})
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(update(matches).where(matches.c.match_id == match_id).values(**values)).rowcount
+                if updated:
+                    bump_versions(conn, [matches])
+            return updated
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to update match: {str(e)}"
+            )
+
+    def upsert_many(self, matches_data: List[MatchRequest]) -> dict:
+        """Insert or update many matches in one transaction: one read of the existing rows,
+        then one batched INSERT and one batched UPDATE. Match ids must be unique;
+        returns the inserted, updated and unchanged counts"""
+        incoming = {match.match_id: match.model_dump() for match in matches_data}
+        ids = list(incoming)
+        try:
+            with self.engine.begin() as conn:
+                existing = {}
+                for i in range(0, len(ids), self.CHUNK_SIZE):
+                    rows = conn.execute(select(matches).where(matches.c.match_id.in_(ids[i:i + self.CHUNK_SIZE]))).mappings()
+                    existing.update((row["match_id"], dict(row)) for row in rows)
+                new = [row for match_id, row in incoming.items() if match_id not in existing]
+                changed = [row for match_id, row in incoming.items() if match_id in existing and existing[match_id] != row]
+                if new:
+                    conn.execute(insert(matches), new)
+                if changed:
+                    columns = [c for c in matches.c.keys() if c != "match_id"]
+                    conn.execute(
+                        update(matches).where(matches.c.match_id == bindparam("_match_id"))
+                        .values({c: bindparam(c) for c in columns}),
+                        [{"_match_id": row["match_id"], **{c: row[c] for c in columns}} for row in changed],
+                    )
+                if new or changed:
+                    bump_versions(conn, [matches])
+            return {"inserted": len(new), "updated": len(changed), "unchanged": len(incoming) - len(new) - len(changed)}
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to upsert matches: {str(e)}"
+            )
@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Tuple
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import String, bindparam, cast, delete, false, func, insert, or_, select, update
+from sqlalchemy.engine import Engine
+from core.sql import bump_versions, leagues, matches, sql_version_token, uploadfile, url_submission
+from repository.url_search_index import rank_key
+from repository.url_submission_repo_interface import IUrlSubmissionRepository
+
+class SqlUrlSubmissionRepository(IUrlSubmissionRepository):
+    # field -> column, used for fields= projections; matches_name is built from MATCH_NAME_COLUMNS
+    COLUMNS = {
+        "submission_id": url_submission.c.submission_id,
+        "url": url_submission.c.url,
+        "type": url_submission.c.type,
+        "league_id": url_submission.c.league_id,
+        "match_id": url_submission.c.match_id,
+        "status": url_submission.c.status,
+        "image_file_name": url_submission.c.image_file_name,
+        "created_at": url_submission.c.created_at,
+        "updated_at": url_submission.c.updated_at,
+        "league_name": leagues.c.league_name,
+        "matches_name": None,
+    }
+    MATCH_NAME_COLUMNS = [
+        matches.c.home_team.label("_home_team"),
+        matches.c.away_team.label("_away_team"),
+        matches.c.match_date.label("_match_date"),
+    ]
+    # pairs per duplicate check query, below SQLite's bound parameter limit
+    CHUNK_SIZE = 400
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def _select(self, fields: Optional[List[str]]):
+        """SELECT with only the joins the requested fields need"""
+        fields = fields or list(self.COLUMNS)
+        columns = [self.COLUMNS[f].label(f) for f in fields if f != "matches_name"]
+        source = url_submission
+        if "league_name" in fields:
+            source = source.outerjoin(leagues, url_submission.c.league_id == leagues.c.league_id)
+        if "matches_name" in fields:
+            columns += self.MATCH_NAME_COLUMNS
+            source = source.outerjoin(matches, url_submission.c.match_id == cast(matches.c.match_id, String))
+        return select(*columns).select_from(source)
+
+    def _project(self, row, fields: Optional[List[str]]) -> dict:
+        submission = {}
+        for f in fields or list(self.COLUMNS):
+            if f != "matches_name":
+                submission[f] = row[f]
+            elif row["_home_team"] is None or row["_away_team"] is None or row["_match_date"] is None:
+                submission[f] = None
+            else:
+                submission[f] = f"{row['_home_team']} VS {row['_away_team']} ({row['_match_date']:%Y-%m-%d})"
+        return submission
+
+    def add_url_submission(self, url: str, type: Optional[str] = None, league_id: Optional[str] = None,
+                          match_id: Optional[str] = None, status: Optional[str] = None,
+                          image_file_name: Optional[str] = None) -> dict:
+        """Add a new URL submission"""
+        return self.add_url_submissions([{
+            "url": url, "type": type, "league_id": league_id, "match_id": match_id,
+            "status": status, "image_file_name": image_file_name,
+        }])[0]
+
+    def add_url_submissions(self, submissions: List[dict]) -> List[dict]:
+        """Add many URL submissions in one transaction, all or none"""
+        current_time = datetime.now(timezone.utc)
+        added = []
+        for submission in submissions:
+            added.append({
+                "submission_id": str(uuid.uuid4()),
+                "url": submission["url"],
+                "type": submission.get("type"),
+                "league_id": submission.get("league_id"),
+                "match_id": submission.get("match_id"),
+                "status": submission.get("status"),
+                "image_file_name": submission.get("image_file_name"),
+                "created_at": current_time,
+                "updated_at": current_time,
+            })
+        if not added:
+            return added
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(url_submission), added)
+                bump_versions(conn, [url_submission])
+        except Exception as e:
+            raise Exception(f"Error inserting rows: {str(e)}")
+        return added
+
+    def version_token(self) -> str:
+        """Version of url_submission and the joined tables for conditional GETs"""
+        return sql_version_token(self.engine, [url_submission, leagues, matches])
+
+    def get_url_submission_by_id(self, submission_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        """Get URL submission by submission_id with league and match information"""
+        query = self._select(fields).where(url_submission.c.submission_id == submission_id)
+        with self.engine.connect() as conn:
+            row = conn.execute(query).mappings().first()
+        return self._project(row, fields) if row is not None else None
+
+    def get_url_submissions_by_ids(self, submission_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """URL submissions by id in one query, submission_id -> submission dict"""
+        fields = fields or list(self.COLUMNS)
+        # submission_id is always selected, to key the result
+        selected = list(dict.fromkeys(["submission_id", *fields]))
+        query = self._select(selected).where(url_submission.c.submission_id.in_(sorted(set(submission_ids))))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        return {row["submission_id"]: self._project(row, fields) for row in rows}
+
+    def list_all_url_submissions(self, fields: Optional[List[str]] = None) -> List[dict]:
+        """List all URL submissions with league and match information"""
+        query = self._select(fields).order_by(url_submission.c.created_at.desc())
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        return [self._project(row, fields) for row in rows]
+
+    def update_url_submission(self, submission_id: str, url: Optional[str] = None, type: Optional[str] = None,
+                             league_id: Optional[str] = None, match_id: Optional[str] = None,
+                             status: Optional[str] = None, image_file_name: Optional[str] = None) -> Optional[dict]:
+        """Update URL submission by submission_id"""
+        # Only the given fields change
+        candidates = {"url": url, "type": type, "league_id": league_id, "match_id": match_id,
+                      "status": status, "image_file_name": image_file_name}
+        values = {column: value for column, value in candidates.items() if value is not None}
+
+        if values:
+            values["updated_at"] = datetime.now(timezone.utc)
+            with self.engine.begin() as conn:
+                updated = conn.execute(
+                    update(url_submission).where(url_submission.c.submission_id == submission_id).values(**values)
+                ).rowcount
+                if updated:
+                    bump_versions(conn, [url_submission])
+
+        return self.get_url_submission_by_id(submission_id)
+
+    def update_url_submission_statuses(self, statuses: Dict[str, str]) -> set:
+        """Set the status of many submissions with one batched UPDATE in one transaction"""
+        ids = list(statuses)
+        current_time = datetime.now(timezone.utc)
+        with self.engine.begin() as conn:
+            existing = set()
+            for i in range(0, len(ids), self.CHUNK_SIZE):
+                query = select(url_submission.c.submission_id).where(url_submission.c.submission_id.in_(ids[i:i + self.CHUNK_SIZE]))
+                existing.update(conn.execute(query).scalars())
+            if existing:
+                conn.execute(
+                    update(url_submission).where(url_submission.c.submission_id == bindparam("_submission_id"))
+                    .values(status=bindparam("status"), updated_at=bindparam("updated_at")),
+                    [{"_submission_id": i, "status": statuses[i], "updated_at": current_time} for i in existing],
+                )
+                bump_versions(conn, [url_submission])
+        return existing
+
+    def check_url_exists_in_match(self, url: str, match_id: str) -> bool:
+        """Check if URL already exists for a specific match_id"""
+        query = select(func.count()).select_from(url_submission).where(
+            url_submission.c.match_id == match_id, url_submission.c.url == url
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar() > 0
+
+    def find_existing_urls(self, pairs: List[tuple]) -> set:
+        """The (url, match_id) pairs that are already submitted, one indexed query per chunk"""
+        pairs = list(dict.fromkeys(pairs))
+        existing = set()
+        with self.engine.connect() as conn:
+            for i in range(0, len(pairs), self.CHUNK_SIZE):
+                chunk = pairs[i:i + self.CHUNK_SIZE]
+                query = select(url_submission.c.url, url_submission.c.match_id).distinct().where(
+                    url_submission.c.match_id.in_({match_id for _, match_id in chunk}),
+                    url_submission.c.url.in_({url for url, _ in chunk}),
+                )
+                # the IN lists cover the cross product of the chunk, keep the actual pairs
+                existing.update((row.url, row.match_id) for row in conn.execute(query))
+        return existing.intersection(pairs)
+
+    def delete_url_submission(self, submission_id: str) -> bool:
+        """Delete URL submission by submission_id"""
+        with self.engine.begin() as conn:
+            deleted = conn.execute(delete(url_submission).where(url_submission.c.submission_id == submission_id)).rowcount
+            if deleted:
+                bump_versions(conn, [url_submission])
+        return deleted > 0
+
+    def list_changed_url_submissions(self, since: Optional[datetime] = None) -> List[dict]:
+        """Submissions changed since a watermark, with file counts, for local replicas.
+        Deletes are physical here, so they only reach replicas through events and full loads"""
+        file_counts = (select(uploadfile.c.submission_id, func.count().label("file_count"))
+                       .group_by(uploadfile.c.submission_id).subquery())
+        query = (self._select(list(self.COLUMNS))
+                 .add_columns(func.coalesce(file_counts.c.file_count, 0).label("file_count"), false().label("deleted"))
+                 .outerjoin(file_counts, file_counts.c.submission_id == url_submission.c.submission_id))
+        if since is not None:
+            query = query.where(or_(
+                url_submission.c.updated_at >= since,
+                leagues.c.updated_at >= since,
+                url_submission.c.submission_id.in_(select(uploadfile.c.submission_id).where(uploadfile.c.uploaded_at >= since)),
+            ))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        return [{**self._project(row, None), "file_count": row["file_count"], "deleted": row["deleted"]} for row in rows]
+
+    def search_url_submissions(self, q: str, limit: int, offset: int) -> Tuple[int, List[str]]:
+        """URL substring search: the matching rows are read with one query and ranked here"""
+        query = select(url_submission.c.submission_id, url_submission.c.url, url_submission.c.created_at).where(
+            func.lower(url_submission.c.url).contains(q, autoescape=True)
+        )
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        hits = []
+        for row in rows:
+            key = rank_key(row.url.lower(), q, row.created_at.timestamp() if row.created_at else 0.0)
+            if key is not None:
+                hits.append((key, row.submission_id))
+        hits.sort()
+        return len(hits), [submission_id for _, submission_id in hits[offset:offset + limit]]
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.engine import Engine
+from core.sql import users
+
+from repository.user_repo_interface import IUserRepository
+
+class SqlUserRepository(IUserRepository):
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def get_user_by_username(self, username: str) -> Optional[dict]:
+        """Get user by username"""
+        query = select(users).where(users.c.username == username).limit(1)
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(query).mappings().first()
+            return dict(row) if row is not None else None
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Database query failed: {str(e)}"
+            )
+
+    def update_last_login(self, user_id: str):
+        """Update last_login timestamp for user"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(update(users).where(users.c.user_id == user_id).values(last_login=datetime.now(timezone.utc)))
+        except Exception as e:
+            # Log error but don't fail the login process
+            print(f"Failed to update last_login for user {user_id}: {str(e)}")
@@ -0,0 +1,196 @@
+import heapq
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from core.limiter import BULK, priority
+from repository.url_submission_repo_interface import IUrlSubmissionRepository
+
+# characters after which a match counts as the start of a URL component
+BOUNDARY = "/.?=&:#_-"
+
+def _epoch(value) -> float:
+    """datetime or ISO string -> seconds since the epoch, 0 when missing"""
+    if value is None:
+        return 0.0
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def rank_key(url: str, q: str, created_at: float = 0.0) -> Optional[tuple]:
+    """Sort key of a lowercased URL for the lowercased query, None when it doesn't match.
+
+    Whole URL first, then host (or parent domain), then matches at the start of
+    a component, then any substring; ties go to the earliest match, the shortest
+    URL and the newest submission."""
+    position = url.find(q)
+    if position < 0:
+        return None
+    bare = url.split("://", 1)[-1]
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        host = ""
+    if url == q or bare == q:
+        tier = 0
+    elif host == q or host.endswith("." + q):
+        tier = 1
+    elif position == 0 or bare.startswith(q) or re.search(f"[{re.escape(BOUNDARY)}]{re.escape(q)}", url):
+        tier = 2
+    else:
+        tier = 3
+    return (tier, position, len(url), -created_at)
+
+class UrlSearchIndex:
+    """In-memory trigram index over submission URLs for substring search.
+
+    Every lowercased URL is filed under each of its 3-character substrings; a
+    query intersects the sets of its own trigrams and checks the few candidates
+    left. The index is built from the repository in the background, kept
+    current by the URL submission service's events and rebuilt periodically to
+    pick up writes made by other instances. Until the first build finishes
+    searches go to the repository instead."""
+    GRAM = 3
+
+    def __init__(self, repo: IUrlSubmissionRepository, rebuild_interval: float):
+        self.repo = repo
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # submission_id -> (lowercased url, created_at epoch)
+        self._docs: Dict[str, Tuple[str, float]] = {}
+        # trigram -> submission_ids
+        self._postings: Dict[str, Set[str]] = {}
+        # events seen while a rebuild reads the repository, replayed onto the new index
+        self._pending: Optional[list] = None
+        self.built_at: Optional[str] = None
+        self.build_seconds: Optional[float] = None
+        self.builds = 0
+        self.searches = 0
+        self.events_applied = 0
+        self.errors = 0
+
+    @classmethod
+    def _grams(cls, text: str) -> Set[str]:
+        return {text[i:i + cls.GRAM] for i in range(len(text) - cls.GRAM + 1)}
+
+    @classmethod
+    def _add(cls, docs: dict, postings: dict, submission_id: str, url: str, created_at: float):
+        cls._remove(docs, postings, submission_id)
+        url = url.lower()
+        docs[submission_id] = (url, created_at)
+        for gram in cls._grams(url):
+            postings.setdefault(gram, set()).add(submission_id)
+
+    @classmethod
+    def _remove(cls, docs: dict, postings: dict, submission_id: str):
+        doc = docs.pop(submission_id, None)
+        if doc is None:
+            return
+        for gram in cls._grams(doc[0]):
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(submission_id)
+                if not ids:
+                    del postings[gram]
+
+    @classmethod
+    def _apply_event(cls, docs: dict, postings: dict, event: dict):
+        data = event["data"]
+        if event["type"] == "deleted":
+            cls._remove(docs, postings, data["submission_id"])
+        elif event["type"] in ("created", "updated") and data.get("url"):
+            cls._add(docs, postings, data["submission_id"], data["url"], _epoch(data.get("created_at")))
+
+    def on_event(self, event: dict):
+        """Apply a created/updated/deleted event published by the URL submission service"""
+        if event["type"] not in ("created", "updated", "deleted"):
+            return
+        with self._lock:
+            self._apply_event(self._docs, self._postings, event)
+            if self._pending is not None:
+                self._pending.append(event)
+            self.events_applied += 1
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def build(self):
+        """Rebuild the index from every live submission, then swap it in"""
+        with self._build_lock:
+            started = time.monotonic()
+            with self._lock:
+                self._pending = []
+            try:
+                with priority(BULK):
+                    rows = self.repo.list_all_url_submissions(["submission_id", "url", "created_at"])
+                docs, postings = {}, {}
+                for row in rows:
+                    if row.get("url"):
+                        self._add(docs, postings, row["submission_id"], row["url"], _epoch(row.get("created_at")))
+                with self._lock:
+                    # writes made here while the rows were read
+                    for event in self._pending:
+                        self._apply_event(docs, postings, event)
+                    self._docs, self._postings = docs, postings
+                    self.built_at = datetime.now(timezone.utc).isoformat()
+                    self.build_seconds = round(time.monotonic() - started, 3)
+                    self.builds += 1
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    def search(self, q: str, limit: int, offset: int) -> Tuple[int, List[str]]:
+        """Number of URLs containing q and one page of their submission ids, best first"""
+        q = q.strip().lower()
+        with self._lock:
+            self.searches += 1
+            if len(q) < self.GRAM:
+                # too short for a trigram, check every URL
+                candidates = self._docs.keys()
+            else:
+                postings = sorted((self._postings.get(gram, set()) for gram in self._grams(q)), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            hits = []
+            for submission_id in candidates:
+                url, created_at = self._docs[submission_id]
+                key = rank_key(url, q, created_at)
+                if key is not None:
+                    hits.append((key, submission_id))
+        page = heapq.nsmallest(offset + limit, hits)[offset:]
+        return len(hits), [submission_id for _, submission_id in page]
+
+    def _loop(self):
+        while True:
+            try:
+                self.build()
+            except Exception as e:
+                self.errors += 1
+                print(f"URL search index build failed: {str(e)}")
+            time.sleep(self.rebuild_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="url-search-index", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "urls": len(self._docs),
+                "trigrams": len(self._postings),
+                "built_at": self.built_at,
+                "build_seconds": self.build_seconds,
+                "builds": self.builds,
+                "searches": self.searches,
+                "events_applied": self.events_applied,
+                "errors": self.errors,
+            }
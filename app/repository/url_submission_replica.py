@@ -0,0 +1,285 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi import HTTPException, status
+
+from core.limiter import BULK, priority
+from repository.url_submission_repo_interface import IUrlSubmissionRepository
+
+# columns copied from the repository, in table order
+COLUMNS = ["submission_id", "url", "type", "league_id", "match_id", "status", "image_file_name",
+           "created_at", "updated_at", "league_name", "matches_name", "file_count"]
+TIMESTAMP_COLUMNS = {"created_at", "updated_at"}
+
+def _timestamp(value) -> Optional[str]:
+    """datetime or ISO string -> sortable UTC ISO string"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+def _domain(url: Optional[str]) -> Optional[str]:
+    try:
+        return urlsplit(url).hostname if url else None
+    except ValueError:
+        return None
+
+class UrlSubmissionReplica:
+    """Local copy of url_submission (with league/match names and file counts) for
+    filters, sorting and aggregates without a BigQuery job per variant.
+
+    It lives in an in-memory SQLite database. The first sync loads every live
+    submission with one query; later syncs fetch only submissions changed since
+    the last one (updated_at watermark, minus an overlap for writes that were in
+    flight), and a periodic full sync drops anything deleted elsewhere. Writes
+    made through this instance are applied at once from the service's events.
+    Reads on a replica older than max_staleness catch up first."""
+    # sort= values (prefix with - for descending)
+    SORTABLE = {"created_at", "updated_at", "url", "status", "file_count"}
+    # group_by= values -> SQL expression
+    GROUPABLE = {
+        "status": "status",
+        "type": "type",
+        "league_id": "league_id",
+        "league_name": "league_name",
+        "match_id": "match_id",
+        "domain": "domain",
+        "day": "substr(created_at, 1, 10)",
+    }
+
+    def __init__(self, repo: IUrlSubmissionRepository, sync_interval: float, max_staleness: float,
+                 full_sync_interval: float, overlap: float):
+        self.repo = repo
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.full_sync_interval = full_sync_interval
+        self.overlap = timedelta(seconds=overlap)
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE url_submission (
+                submission_id TEXT PRIMARY KEY, url TEXT, domain TEXT, type TEXT, league_id TEXT, match_id TEXT,
+                status TEXT, image_file_name TEXT, created_at TEXT, updated_at TEXT,
+                league_name TEXT, matches_name TEXT, file_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX ix_league_id ON url_submission (league_id, created_at);
+            CREATE INDEX ix_match_id ON url_submission (match_id, created_at);
+            CREATE INDEX ix_status ON url_submission (status, created_at);
+            CREATE INDEX ix_domain ON url_submission (domain);
+            CREATE INDEX ix_created_at ON url_submission (created_at);
+        """)
+        # guards the database; syncs also hold _sync_lock so only one runs at a time
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.watermark: Optional[datetime] = None
+        # last check that the replica is current, and last time rows were actually fetched
+        self.synced_at: Optional[float] = None
+        self.fetched_at: Optional[float] = None
+        self.full_synced_at: Optional[float] = None
+        self._version: Optional[str] = None
+        # submission_id -> when this instance deleted it, so a sync that read the row before can't revive it
+        self._deleted: Dict[str, str] = {}
+        # bumped on every change, for ETags
+        self.generation = 0
+        self.syncs = 0
+        self.full_syncs = 0
+        self.skipped_syncs = 0
+        self.catch_ups = 0
+        self.rows_applied = 0
+        self.events_applied = 0
+        self.errors = 0
+
+    def _upsert(self, row: dict):
+        """Insert or update the given columns, unless the replica already has a newer version"""
+        row = {c: _timestamp(v) if c in TIMESTAMP_COLUMNS else v for c, v in row.items() if c in COLUMNS}
+        if "url" in row:
+            row["domain"] = _domain(row["url"])
+        columns = list(row)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "submission_id")
+        self._db.execute(
+            f"INSERT INTO url_submission ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(submission_id) DO UPDATE SET {updates} "
+            f"WHERE excluded.updated_at IS NULL OR url_submission.updated_at IS NULL OR excluded.updated_at >= url_submission.updated_at",
+            [row[c] for c in columns],
+        )
+
+    def _apply(self, rows: List[dict], full: bool, started_at: datetime):
+        with self._lock, self._db:
+            for row in rows:
+                tombstone = self._deleted.get(row["submission_id"])
+                if row.get("deleted") or (tombstone and (_timestamp(row["updated_at"]) or "") <= tombstone):
+                    self._db.execute("DELETE FROM url_submission WHERE submission_id = ?", [row["submission_id"]])
+                    continue
+                self._upsert(row)
+            if full:
+                # deleted elsewhere; rows written here since the sync started stay
+                live = {row["submission_id"] for row in rows if not row.get("deleted")}
+                cutoff = _timestamp(started_at - self.overlap)
+                stale = [r["submission_id"] for r in self._db.execute("SELECT submission_id, updated_at FROM url_submission")
+                         if r["submission_id"] not in live and (r["updated_at"] or "") < cutoff]
+                self._db.executemany("DELETE FROM url_submission WHERE submission_id = ?", [[i] for i in stale])
+            self.watermark = started_at
+            expired = _timestamp(started_at - 2 * self.overlap)
+            self._deleted = {i: at for i, at in self._deleted.items() if at >= expired}
+            self.rows_applied += len(rows)
+            self.generation += 1
+
+    def sync(self, full: bool = False, if_stale: bool = False):
+        """Pull changes from the repository (everything when full or never synced)"""
+        with self._sync_lock:
+            if if_stale and self.is_fresh():
+                # someone else caught up while we waited
+                return
+            now = time.monotonic()
+            full = full or self.watermark is None or now - self.full_synced_at >= self.full_sync_interval
+            version = self.repo.version_token()
+            if not full and version is not None and version == self._version and now - self.fetched_at < self.max_staleness / 2:
+                # nothing was written; file counts are picked up by the regular syncs
+                self.synced_at = now
+                self.skipped_syncs += 1
+                return
+            started_at = datetime.now(timezone.utc)
+            since = None if full else self.watermark - self.overlap
+            with priority(BULK):
+                rows = self.repo.list_changed_url_submissions(since)
+            self._apply(rows, full, started_at)
+            self._version = version
+            self.synced_at = self.fetched_at = now
+            self.syncs += 1
+            if full:
+                self.full_synced_at = now
+                self.full_syncs += 1
+
+    def on_event(self, event: dict):
+        """Apply a created/updated/deleted event published by the URL submission service"""
+        data = event["data"]
+        with self._lock, self._db:
+            if event["type"] == "deleted":
+                self._db.execute("DELETE FROM url_submission WHERE submission_id = ?", [data["submission_id"]])
+                self._deleted[data["submission_id"]] = _timestamp(datetime.now(timezone.utc))
+            elif event["type"] in ("created", "updated"):
+                self._upsert(data)
+            else:
+                return
+            self.events_applied += 1
+            self.generation += 1
+
+    def is_fresh(self) -> bool:
+        return self.synced_at is not None and time.monotonic() - self.synced_at <= self.max_staleness
+
+    def ensure_fresh(self):
+        """Catch up before a read when the background sync fell behind"""
+        if self.is_fresh():
+            return
+        try:
+            self.sync(if_stale=True)
+            self.catch_ups += 1
+        except HTTPException:
+            raise
+        except Exception as e:
+            self.errors += 1
+            if self.synced_at is None:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail=f"URL submission replica is not loaded yet: {str(e)}", headers={"Retry-After": "5"})
+            # an older copy beats no answer
+            print(f"Serving stale URL submission replica, catch-up failed: {str(e)}")
+
+    def _loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                self.errors += 1
+                print(f"URL submission replica sync failed: {str(e)}")
+            time.sleep(self.sync_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="url-submission-replica", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _where(filters: dict) -> Tuple[str, list]:
+        clauses, params = [], []
+        for column in ("league_id", "match_id", "status", "type"):
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("domain"):
+            # the domain and its subdomains
+            domain = filters["domain"].lower()
+            clauses.append("(domain = ? OR domain LIKE ? ESCAPE '\\')")
+            params += [domain, "%." + domain.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")]
+        if filters.get("q"):
+            q = filters["q"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("url LIKE ? ESCAPE '\\'")
+            params.append(f"%{q}%")
+        if filters.get("created_from") is not None:
+            clauses.append("created_at >= ?")
+            params.append(_timestamp(filters["created_from"]))
+        if filters.get("created_to") is not None:
+            clauses.append("created_at < ?")
+            params.append(_timestamp(filters["created_to"]))
+        if filters.get("has_files") is not None:
+            clauses.append("file_count > 0" if filters["has_files"] else "file_count = 0")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, filters: dict, sort: str, limit: int, offset: int) -> Tuple[int, List[dict]]:
+        """Total matching submissions and one page of them"""
+        column = sort.lstrip("-")
+        if column not in self.SORTABLE:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"sort must be one of {', '.join(sorted(self.SORTABLE))} (prefix - for descending)")
+        direction = "DESC" if sort.startswith("-") else "ASC"
+        where, params = self._where(filters)
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM url_submission{where}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT * FROM url_submission{where} ORDER BY {column} {direction}, submission_id LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def aggregate(self, group_by: str, filters: dict) -> List[dict]:
+        """Submission and file counts per group, largest first"""
+        expression = self.GROUPABLE.get(group_by)
+        if expression is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"group_by must be one of {', '.join(sorted(self.GROUPABLE))}")
+        where, params = self._where(filters)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {expression} AS key, COUNT(*) AS count, SUM(file_count) AS file_count "
+                f"FROM url_submission{where} GROUP BY 1 ORDER BY 2 DESC, 1",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def version(self) -> str:
+        """Token for ETags, changes with every applied sync or event"""
+        return f"replica:{id(self)}:{self.generation}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT COUNT(*) FROM url_submission").fetchone()[0]
+        return {
+            "rows": rows,
+            "fresh": self.is_fresh(),
+            "age_seconds": round(time.monotonic() - self.synced_at, 1) if self.synced_at is not None else None,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "syncs": self.syncs,
+            "full_syncs": self.full_syncs,
+            "skipped_syncs": self.skipped_syncs,
+            "catch_ups": self.catch_ups,
+            "rows_applied": self.rows_applied,
+            "events_applied": self.events_applied,
+            "errors": self.errors,
+        }
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 class IUrlSubmissionRepository(ABC):
     @abstractmethod
@@ -9,11 +10,26 @@ class IUrlSubmissionRepository(ABC):
         pass
 
     @abstractmethod
-    def get_url_submission_by_id(self, submission_id: str) -> Optional[dict]:
+    def add_url_submissions(self, submissions: List[dict]) -> List[dict]:
+        """Add many submissions (dicts of the add_url_submission arguments) in one write"""
         pass
 
     @abstractmethod
-    def list_all_url_submissions(self) -> List[dict]:
+    def version_token(self) -> Optional[str]:
+        """Cheap token that changes whenever the listed data may have changed"""
+        pass
+
+    @abstractmethod
+    def get_url_submission_by_id(self, submission_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def get_url_submissions_by_ids(self, submission_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+        """submission_id -> submission for the ids that exist"""
+        pass
+
+    @abstractmethod
+    def list_all_url_submissions(self, fields: Optional[List[str]] = None) -> List[dict]:
         pass
 
     @abstractmethod
@@ -22,11 +38,34 @@ class IUrlSubmissionRepository(ABC):
                              status: Optional[str] = None, image_file_name: Optional[str] = None) -> Optional[dict]:
         pass
 
+    @abstractmethod
+    def update_url_submission_statuses(self, statuses: Dict[str, str]) -> set:
+        """Set the status (and updated_at) of many submissions in one batched write,
+        submission_id -> status; returns the ids that existed"""
+        pass
+
     @abstractmethod
     def check_url_exists_in_match(self, url: str, match_id: str) -> bool:
         """Check if a URL already exists for a given match_id"""
         pass
 
+    @abstractmethod
+    def find_existing_urls(self, pairs: List[tuple]) -> set:
+        """The given (url, match_id) pairs that already exist"""
+        pass
+
     @abstractmethod
     def delete_url_submission(self, submission_id: str) -> bool:
         pass
+
+    @abstractmethod
+    def list_changed_url_submissions(self, since: Optional[datetime] = None) -> List[dict]:
+        """Every column plus league_name, matches_name, file_count and deleted, for submissions
+        (or their league or files) changed at or after since; all live submissions when since is None"""
+        pass
+
+    @abstractmethod
+    def search_url_submissions(self, q: str, limit: int, offset: int) -> Tuple[int, List[str]]:
+        """Number of live submissions whose URL contains the lowercased q and one page of their
+        ids, ranked like url_search_index.rank_key; used while the local search index is not built"""
+        pass
@@ -0,0 +1,104 @@
+import asyncio
+from json import loads as json_loads
+from urllib.parse import urlsplit
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials
+from config import BATCH_MAX_REQUESTS, BATCH_MAX_CONCURRENCY
+from core.deadline import current_deadline
+from core.security import security, verify_token
+from model.batch import BatchRequest, BatchResponse, BatchSubRequest
+
+router = APIRouter(tags=['batch'])
+
+# not allowed inside a batch: recursion and never-ending streams
+EXCLUDED_PATHS = {"/batch", "/url_submission/events"}
+# response headers worth passing back to the client
+FORWARDED_HEADERS = {"content-type", "etag", "retry-after"}
+
+def is_ready():
+    return True
+
+async def _dispatch(request: Request, sub: BatchSubRequest, sub_id: str, token: str, payload: dict) -> dict:
+    """Run one sub-request through the app in-process and capture its response"""
+    parts = urlsplit(sub.path)
+    if parts.path in EXCLUDED_PATHS:
+        return {"id": sub_id, "status": 400, "body": {"detail": f"{parts.path} can't be batched"}}
+    if sub.method.upper() != "GET":
+        return {"id": sub_id, "status": 405, "body": {"detail": "Only GET sub-requests can be batched"}}
+
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in sub.headers.items()
+               if name.lower() not in ("authorization", "host")]
+    headers += [(b"host", request.headers.get("host", "").encode("latin-1")), (b"authorization", f"Bearer {token}".encode("latin-1"))]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": request.url.scheme,
+        "path": parts.path,
+        "raw_path": parts.path.encode("utf-8"),
+        "query_string": parts.query.encode("utf-8"),
+        "root_path": "",
+        "headers": headers,
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+        # authenticated once for the whole batch
+        "verified_token": (token, payload),
+        # the batch's timeout and cancellation apply to every sub-request
+        "parent_deadline": current_deadline.get(),
+    }
+    finished = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    status = 500
+    response_headers = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                name = name.decode("latin-1").lower()
+                if name in FORWARDED_HEADERS:
+                    response_headers[name] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    finally:
+        finished.set()
+    raw = b"".join(chunks)
+    body = raw.decode("utf-8", errors="replace") if raw else None
+    if raw and response_headers.get("content-type", "").startswith("application/json"):
+        body = json_loads(raw)
+    return {"id": sub_id, "status": status, "headers": response_headers, "body": body}
+
+@router.post("/batch", response_model=BatchResponse)
+async def batch(request: Request, batch_request: BatchRequest, payload: dict = Depends(verify_token),
+                credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Run several GET requests in one round trip, concurrently, and return every response
+    with its own status. Sub-requests share the caches and coalesced queries of the instance."""
+    if len(batch_request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run(index: int, sub: BatchSubRequest) -> dict:
+        sub_id = sub.id if sub.id is not None else str(index)
+        async with slots:
+            try:
+                return await _dispatch(request, sub, sub_id, credentials.credentials, payload)
+            except Exception as e:
+                return {"id": sub_id, "status": 500, "body": {"detail": f"Sub-request failed: {str(e)}"}}
+
+    responses = await asyncio.gather(*(run(index, sub) for index, sub in enumerate(batch_request.requests)))
+    return {"responses": responses}
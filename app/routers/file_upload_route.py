@@ -1,6 +1,8 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
-from model.file_upload import FileUploadResponse
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from config import SIMILAR_IMAGE_MAX_DISTANCE
+from model.file_upload import FileUploadResponse, SimilarFilesResponse
 from common import file_upload_svc
 from core.security import verify_token
 
@@ -10,7 +12,7 @@ def is_ready():
     if file_upload_svc:
         return True
     else:
-        print(__name__, "Error: league_svc is not set. Please check your configuration.")
+        print(__name__, "Error: file_upload_svc is not set. Please check your configuration.")
         return False
 
 # File Upload endpoints
@@ -23,14 +25,16 @@ async def upload_file(submission_id: str, file: UploadFile = File(...), payload:
         
         # Upload to GCS
         if file.filename and file.content_type:
-            result = file_upload_svc.upload_file(file_content=file_content, file_name=file.filename, content_type=file.content_type, submission_id=submission_id)
+            result = await run_in_threadpool(file_upload_svc.upload_file, file_content=file_content, file_name=file.filename, content_type=file.content_type, submission_id=submission_id)
             return result
         raise HTTPException(status_code=403, detail=f"Upload failed: no file uploaded")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @router.delete("/upload/{file_name}")
-async def delete_file(file_name: str, payload: dict = Depends(verify_token)):
+def delete_file(file_name: str, payload: dict = Depends(verify_token)):
     """Delete file from Google Cloud Storage"""
     success = file_upload_svc.delete_file(file_name)
     if not success:
@@ -38,10 +42,12 @@ async def delete_file(file_name: str, payload: dict = Depends(verify_token)):
     return {"message": "File deleted successfully"}
 
 @router.get("/upload/{file_name}")
-async def get_fileinfo(file_name: str, payload: dict = Depends(verify_token)) -> FileUploadResponse:
+def get_fileinfo(file_name: str, payload: dict = Depends(verify_token)) -> FileUploadResponse:
     """Get public URL of file"""
     try:
         file_info = file_upload_svc.get_fileinfo(file_name)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {e}")
     if file_info is None:
@@ -49,10 +55,18 @@ async def get_fileinfo(file_name: str, payload: dict = Depends(verify_token)) ->
     return file_info
 
 @router.get("/upload/list/{submission_id}")
-async def get_fileinfo_list(submission_id: str, payload: dict = Depends(verify_token))-> Optional[List[FileUploadResponse]]:
+def get_fileinfo_list(submission_id: str, payload: dict = Depends(verify_token))-> Optional[List[FileUploadResponse]]:
     """Get list of files for a submission"""
     try:
         files = file_upload_svc.get_fileinfo_by_submission_id(submission_id)
         return files
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"{e}")
+
+@router.get("/upload/{file_name}/similar", response_model=SimilarFilesResponse)
+def get_similar_files(file_name: str, max_distance: int = Query(SIMILAR_IMAGE_MAX_DISTANCE, ge=0, le=32),
+                      limit: int = Query(50, ge=1, le=500), payload: dict = Depends(verify_token)):
+    """Near-duplicate snapshots of an uploaded image and their submissions, closest first"""
+    return file_upload_svc.find_similar(file_name, max_distance, limit)
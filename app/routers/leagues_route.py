@@ -1,7 +1,12 @@
-from fastapi import APIRouter, Depends
-from model.league import LeagueRequest, LeagueResponse
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from config import BATCH_GET_MAX_IDS
+from model.league import LeagueBatchItem, LeagueRequest, LeagueResponse
 from common import league_svc
+from core.projection import encode, parse_fields, parse_ids
 from core.security import verify_token
+from core.versioning import etag_headers, etag_matches, make_etag
 
 router = APIRouter(tags=['leagues'])
 
@@ -13,27 +18,50 @@ def is_ready():
         return False
 
 @router.post("/leagues", response_model=LeagueResponse)
-async def add_league(league_request: LeagueRequest, payload: dict = Depends(verify_token)):
+def add_league(league_request: LeagueRequest, payload: dict = Depends(verify_token)):
     """Add a new league"""
     return league_svc.add_league_to_database(league_request)
 
 @router.get("/leagues", response_model=list[LeagueResponse])
-async def list_leagues(payload: dict = Depends(verify_token)):
-    """List all leagues"""
+def list_leagues(request: Request, response: Response, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """List all leagues, fields= limits the returned columns"""
+    projection = parse_fields(fields, LeagueResponse.model_fields)
+    etag = make_etag(league_svc.list_version(), fields)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if projection:
+        return JSONResponse(encode(league_svc.list_all_leagues(projection)), headers=etag_headers(etag))
+    response.headers.update(etag_headers(etag))
     return league_svc.list_all_leagues()
 
+# registered before /leagues/{league_id}, which would otherwise match it
+@router.get("/leagues/batch", response_model=list[LeagueBatchItem])
+def get_leagues(ids: Optional[str] = None, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """Get leagues by a comma separated ids= list with one query, in request order"""
+    league_ids = parse_ids(ids, BATCH_GET_MAX_IDS)
+    projection = parse_fields(fields, LeagueResponse.model_fields)
+    if projection:
+        return JSONResponse(encode(league_svc.get_leagues_by_ids(league_ids, projection)))
+    return league_svc.get_leagues_by_ids(league_ids)
+
 @router.get("/leagues/{league_id}", response_model=LeagueResponse)
-async def get_league(league_id: str, payload: dict = Depends(verify_token)):
-    """Get a league"""
+def get_league(league_id: str, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """Get a league, fields= limits the returned columns"""
+    projection = parse_fields(fields, LeagueResponse.model_fields)
+    if projection:
+        league = league_svc.get_league_by_id(league_id, projection)
+        if not league:
+            raise HTTPException(status_code=404, detail="League not found")
+        return JSONResponse(encode(league))
     return league_svc.get_league_by_id(league_id)
 
 @router.delete("/leagues/{league_id}")
-async def delete_league(league_id: str, payload: dict = Depends(verify_token)):
+def delete_league(league_id: str, payload: dict = Depends(verify_token)):
     """Delete a league by league_id"""
     return league_svc.delete_league_by_id(league_id)
 
 @router.put("/leagues/{league_id}", response_model=LeagueResponse)
-async def update_league(league_id: str, league_request: LeagueRequest, payload: dict = Depends(verify_token)):
+def update_league(league_id: str, league_request: LeagueRequest, payload: dict = Depends(verify_token)):
     """Update a league by league_id"""
     return league_svc.update_league_by_id(league_id, league_request)
 
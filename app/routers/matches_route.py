@@ -1,7 +1,12 @@
-from fastapi import APIRouter, Depends
-from model.match import MatchRequest, MatchResponse
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from config import BATCH_GET_MAX_IDS, BULK_MATCH_MAX_ITEMS
+from model.match import MatchBatchItem, MatchRequest, MatchResponse, MatchUpsertResponse
 from common import match_svc
+from core.projection import encode, parse_fields, parse_ids
 from core.security import verify_token
+from core.versioning import etag_headers, etag_matches, make_etag
 
 router = APIRouter(tags=['matches'])
 
@@ -9,31 +14,61 @@ def is_ready():
     if match_svc:
         return True
     else:
-        print(__name__, "Error: league_svc is not set. Please check your configuration.")
+        print(__name__, "Error: match_svc is not set. Please check your configuration.")
         return False
 
 #@router.post("/matches", response_model=MatchResponse)
 @router.post("/matches")
-async def add_match(match_request: MatchRequest, payload: dict = Depends(verify_token)):
+def add_match(match_request: MatchRequest, payload: dict = Depends(verify_token)):
     """Add a new match"""
     return match_svc.add_match(match_request)
 
+@router.post("/matches/bulk", response_model=MatchUpsertResponse)
+def upsert_matches(match_requests: List[MatchRequest], payload: dict = Depends(verify_token)):
+    """Insert or update a fixture list in one MERGE"""
+    if len(match_requests) > BULK_MATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MATCH_MAX_ITEMS} matches per request")
+    return match_svc.upsert_matches(match_requests)
+
 @router.get("/matches", response_model=list[MatchResponse])
-async def list_matches(payload: dict = Depends(verify_token)):
-    """List all matches"""
+def list_matches(request: Request, response: Response, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """List all matches, fields= limits the returned columns"""
+    projection = parse_fields(fields, MatchResponse.model_fields)
+    etag = make_etag(match_svc.list_version(), fields)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if projection:
+        return JSONResponse(encode(match_svc.list_all_matches(projection)), headers=etag_headers(etag))
+    response.headers.update(etag_headers(etag))
     return match_svc.list_all_matches()
 
+# registered before /matches/{match_id}, which would otherwise match it
+@router.get("/matches/batch", response_model=list[MatchBatchItem])
+def get_matches(ids: Optional[str] = None, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """Get matches by a comma separated ids= list with one query, in request order"""
+    try:
+        match_ids = [int(i) for i in parse_ids(ids, BATCH_GET_MAX_IDS)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Match ids must be integers")
+    projection = parse_fields(fields, MatchResponse.model_fields)
+    if projection:
+        return JSONResponse(encode(match_svc.get_matches(match_ids, projection)))
+    return match_svc.get_matches(match_ids)
+
 @router.get("/matches/{match_id}", response_model=MatchResponse)
-async def get_match(match_id: int, payload: dict = Depends(verify_token)):
-    """Get a match"""
+def get_match(match_id: int, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """Get a match, fields= limits the returned columns"""
+    projection = parse_fields(fields, MatchResponse.model_fields)
+    if projection:
+        return JSONResponse(encode(match_svc.get_match(match_id, projection)))
     return match_svc.get_match(match_id)
 
 @router.delete("/matches/{match_id}")
-async def delete_match(match_id: int, payload: dict = Depends(verify_token)):
+def delete_match(match_id: int, payload: dict = Depends(verify_token)):
     """Delete a match by match_id"""
     return match_svc.delete_match(match_id)
 
 @router.put("/matches/{match_id}")
-async def update_match(match_id: int, match_request: MatchRequest, payload: dict = Depends(verify_token)):
+def update_match(match_id: int, match_request: MatchRequest, payload: dict = Depends(verify_token)):
     """Update a match by match_id"""
     return match_svc.update_match(match_id, match_request)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from core import metrics
+from core.security import verify_token
+
+router = APIRouter(tags=['metrics'])
+
+def is_ready():
+    return True
+
+@router.get("/metrics")
+def get_metrics(payload: dict = Depends(verify_token)):
+    """Runtime counters (query coalescing, caches, ...)"""
+    return metrics.snapshot()
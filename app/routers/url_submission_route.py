@@ -1,7 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from model.url_submission import UrlSubmissionRequest, UrlSubmissionResponse
-from common import url_submission_svc
+import asyncio
+import csv
+from datetime import datetime
+from json import dumps as json_dumps, loads as json_loads
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from config import SSE_HEARTBEAT_SECONDS, BULK_SUBMISSION_MAX_ITEMS, BATCH_GET_MAX_IDS, REPLICA_MAX_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE
+from model.url_submission import UrlSubmissionRequest, UrlSubmissionResponse, UrlSubmissionBatchItem, BulkUrlSubmissionResponse
+from model.url_submission import UrlSubmissionFilterResponse, UrlSubmissionStatsItem, UrlSubmissionSearchResponse
+from common import url_submission_svc, file_upload_svc
+from core.events import format_sse
+from core.projection import encode, parse_expand, parse_fields, parse_ids
 from core.security import verify_token
+from core.versioning import etag_headers, etag_matches, make_etag
 
 router = APIRouter(tags=['url_sumbission'])
 
@@ -14,31 +26,222 @@ def is_ready():
 
 # URL Submission endpoints
 @router.post("/url_submission", response_model=UrlSubmissionResponse)
-async def add_url_submission(url_submission_request: UrlSubmissionRequest, payload: dict = Depends(verify_token)):
+def add_url_submission(url_submission_request: UrlSubmissionRequest, payload: dict = Depends(verify_token)):
     """Add a new URL submission"""
     try:
         return url_submission_svc.add_url_submission(url_submission_request)
+    except HTTPException:
+        raise
     except Exception as e:
         if "URL already exists for this match" in str(e):
             raise HTTPException(status_code=409, detail="URL already exists for this match")
         else:
             raise HTTPException(status_code=500, detail=f"Failed to add URL submission: {str(e)}")
 
+async def _body_lines(request: Request):
+    """Lines of the request body as it streams in"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+async def _bulk_items(request: Request) -> list:
+    """Items of a JSON array, NDJSON or CSV (header row first) body; entries that
+    don't parse become exceptions so they can be reported by position"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("", "application/json"):
+        try:
+            items = json_loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body is not valid JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of URL submissions")
+        if len(items) > BULK_SUBMISSION_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_SUBMISSION_MAX_ITEMS} items per request")
+        return items
+    if content_type not in ("application/x-ndjson", "application/jsonl", "text/csv"):
+        raise HTTPException(status_code=415, detail="Use application/json, application/x-ndjson or text/csv")
+
+    items = []
+    header = None
+    async for raw in _body_lines(request):
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line:
+            continue
+        if content_type == "text/csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                items.append(ValueError(f"Expected {len(header)} columns, got {len(values)}"))
+            else:
+                items.append({name: value or None for name, value in zip(header, values)})
+        else:
+            try:
+                items.append(json_loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {str(e)}"))
+        if len(items) > BULK_SUBMISSION_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_SUBMISSION_MAX_ITEMS} items per request")
+    return items
+
+@router.post("/url_submission/bulk", response_model=BulkUrlSubmissionResponse)
+async def bulk_add_url_submissions(request: Request, payload: dict = Depends(verify_token)):
+    """Add many URL submissions (JSON array, NDJSON or CSV) with one duplicate check and one write,
+    and report every item as accepted, duplicate or rejected"""
+    items = await _bulk_items(request)
+    try:
+        return await run_in_threadpool(url_submission_svc.bulk_add_url_submissions, items)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add URL submissions: {str(e)}")
+
+# related data that expand= can embed
+EXPANDABLE = {"files"}
+
+def _with_files(submissions: list, projection: Optional[list], all_submissions: bool = False) -> list:
+    """Nest each submission's uploaded files under "files", fetched with one query
+    (joined to the submissions table when they are all of them, instead of sending every id)"""
+    if not file_upload_svc:
+        raise HTTPException(status_code=503, detail="File service unavailable, retry without expand=files")
+    if all_submissions:
+        files = file_upload_svc.get_fileinfo_of_all_submissions()
+    else:
+        files = file_upload_svc.get_fileinfo_by_submission_ids([s["submission_id"] for s in submissions])
+    expanded = []
+    for submission in submissions:
+        entry = {**submission, "files": files.get(submission["submission_id"], [])}
+        if projection and "submission_id" not in projection:
+            # only selected to look up the files
+            del entry["submission_id"]
+        expanded.append(entry)
+    return expanded
+
+def _expand_projection(projection: Optional[list]) -> Optional[list]:
+    """Projection that also selects submission_id, needed to look up files"""
+    return list(dict.fromkeys(["submission_id", *projection])) if projection else None
+
 @router.get("/url_submission", response_model=list[UrlSubmissionResponse])
-async def list_url_submissions(payload: dict = Depends(verify_token)):
-    """List all URL submissions"""
+def list_url_submissions(request: Request, response: Response, fields: Optional[str] = None, expand: Optional[str] = None,
+                         payload: dict = Depends(verify_token)):
+    """List all URL submissions, fields= limits the returned columns, expand=files embeds uploaded files"""
+    projection = parse_fields(fields, UrlSubmissionResponse.model_fields)
+    expansions = parse_expand(expand, EXPANDABLE)
+    version = url_submission_svc.list_version()
+    if expansions and file_upload_svc and version is not None:
+        files_version = file_upload_svc.list_version()
+        version = f"{version}|{files_version}" if files_version is not None else None
+    etag = make_etag(version, fields, ",".join(expansions))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if expansions:
+        submissions = url_submission_svc.list_all_url_submissions(_expand_projection(projection))
+        return JSONResponse(encode(_with_files(submissions, projection, all_submissions=True)), headers=etag_headers(etag))
+    if projection:
+        return JSONResponse(encode(url_submission_svc.list_all_url_submissions(projection)), headers=etag_headers(etag))
+    response.headers.update(etag_headers(etag))
     return url_submission_svc.list_all_url_submissions()
 
+@router.get("/url_submission/events")
+async def stream_url_submission_events(request: Request, league_id: Optional[str] = None, match_id: Optional[str] = None,
+                                       last_event_id: Optional[str] = Header(default=None), payload: dict = Depends(verify_token)):
+    """Server-sent events feed of created/updated/deleted URL submissions"""
+    async def event_stream():
+        # subscribed only once the response streams, so a request that never starts leaves nothing behind
+        sub = url_submission_svc.events.subscribe(league_id=league_id, match_id=match_id, last_event_id=last_event_id)
+        try:
+            if sub.gap:
+                # Missed events are gone from history, client should refetch the list
+                yield "event: reset\ndata: {}\n\n"
+            while not await request.is_disconnected():
+                if sub.overflowed and sub.queue.empty():
+                    yield f"event: overflow\ndata: {json_dumps({'last_event_id': sub.last_event_id})}\n\n"
+                    break
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                sub.last_event_id = event["id"]
+                yield format_sse(event)
+        finally:
+            url_submission_svc.events.unsubscribe(sub)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# registered before /url_submission/{submission_id}, which would otherwise match it
+@router.get("/url_submission/batch", response_model=list[UrlSubmissionBatchItem])
+def get_url_submissions(ids: Optional[str] = None, fields: Optional[str] = None, payload: dict = Depends(verify_token)):
+    """Get URL submissions by a comma separated ids= list with one query, in request order"""
+    submission_ids = parse_ids(ids, BATCH_GET_MAX_IDS)
+    projection = parse_fields(fields, UrlSubmissionResponse.model_fields)
+    submissions = url_submission_svc.get_url_submissions(submission_ids, projection)
+    if projection:
+        return JSONResponse(encode(submissions))
+    return submissions
+
+def _replica_filters(league_id: Optional[str] = None, match_id: Optional[str] = None, status: Optional[str] = None,
+                     type: Optional[str] = None, domain: Optional[str] = None, q: Optional[str] = None,
+                     created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                     has_files: Optional[bool] = None) -> dict:
+    """Filters shared by /url_submission/filter and /url_submission/stats (q: substring of the URL,
+    domain: host and its subdomains, created_to: exclusive)"""
+    return {"league_id": league_id, "match_id": match_id, "status": status, "type": type, "domain": domain, "q": q,
+            "created_from": created_from, "created_to": created_to, "has_files": has_files}
+
+@router.get("/url_submission/filter", response_model=UrlSubmissionFilterResponse)
+def filter_url_submissions(request: Request, response: Response, filters: dict = Depends(_replica_filters),
+                           sort: str = "-created_at", limit: int = Query(100, ge=1, le=REPLICA_MAX_PAGE_SIZE),
+                           offset: int = Query(0, ge=0), payload: dict = Depends(verify_token)):
+    """Filter, sort and page URL submissions, served from the local replica"""
+    etag = make_etag(url_submission_svc.replica_version(), str(request.query_params))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    response.headers.update(etag_headers(etag))
+    return url_submission_svc.filter_url_submissions(filters, sort, limit, offset)
+
+@router.get("/url_submission/stats", response_model=list[UrlSubmissionStatsItem])
+def url_submission_stats(request: Request, response: Response, group_by: str = "status",
+                         filters: dict = Depends(_replica_filters), payload: dict = Depends(verify_token)):
+    """Submission and file counts per status, type, league, match, domain or day, from the local replica"""
+    etag = make_etag(url_submission_svc.replica_version(), str(request.query_params))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    response.headers.update(etag_headers(etag))
+    return url_submission_svc.aggregate_url_submissions(group_by, filters)
+
+@router.get("/url_submission/search", response_model=UrlSubmissionSearchResponse)
+def search_url_submissions(q: str = Query(..., min_length=2), limit: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+                           offset: int = Query(0, ge=0), payload: dict = Depends(verify_token)):
+    """URL submissions whose URL contains q (a domain, path segment, stream id...), best matches first"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be blank")
+    return url_submission_svc.search_url_submissions(q, limit, offset)
+
 @router.get("/url_submission/{submission_id}", response_model=UrlSubmissionResponse)
-async def get_url_submission(submission_id: str, payload: dict = Depends(verify_token)):
-    """Get a URL submission by ID"""
-    submission = url_submission_svc.get_url_submission(submission_id)
+def get_url_submission(submission_id: str, fields: Optional[str] = None, expand: Optional[str] = None,
+                       payload: dict = Depends(verify_token)):
+    """Get a URL submission by ID, fields= limits the returned columns, expand=files embeds uploaded files"""
+    projection = parse_fields(fields, UrlSubmissionResponse.model_fields)
+    expansions = parse_expand(expand, EXPANDABLE)
+    submission = url_submission_svc.get_url_submission(submission_id, _expand_projection(projection) if expansions else projection)
     if not submission:
         raise HTTPException(status_code=404, detail="URL submission not found")
+    if expansions:
+        return JSONResponse(encode(_with_files([submission], projection)[0]))
+    if projection:
+        return JSONResponse(encode(submission))
     return submission
 
 @router.put("/url_submission/{submission_id}", response_model=UrlSubmissionResponse)
-async def update_url_submission(submission_id: str, url_submission_request: UrlSubmissionRequest, payload: dict = Depends(verify_token)):
+def update_url_submission(submission_id: str, url_submission_request: UrlSubmissionRequest, payload: dict = Depends(verify_token)):
     """Update a URL submission by ID"""
     submission = url_submission_svc.update_url_submission(submission_id, url_submission_request)
     if not submission:
@@ -46,7 +249,7 @@ async def update_url_submission(submission_id: str, url_submission_request: UrlS
     return submission
 
 @router.delete("/url_submission/{submission_id}")
-async def delete_url_submission(submission_id: str, payload: dict = Depends(verify_token)):
+def delete_url_submission(submission_id: str, payload: dict = Depends(verify_token)):
     """Delete a URL submission by ID"""
     success = url_submission_svc.delete_url_submission(submission_id)
     if not success:
@@ -11,17 +11,17 @@ def is_ready():
     if user_svc:
         return True
     else:
-        print(__name__, "Error: league_svc is not set. Please check your configuration.")
+        print(__name__, "Error: user_svc is not set. Please check your configuration.")
         return False
 
 @router.post("/login", response_model=LoginResponse)
-async def login(login_request: LoginRequest):
+def login(login_request: LoginRequest):
     """User login endpoint"""
     ret = login_svc.do_login(login_request.username, login_request.password, JWT_EXPIRATION_HOURS)
     return ret
 
 @router.get("/me", response_model=User)
-async def get_current_user(payload: dict = Depends(verify_token)):
+def get_current_user(payload: dict = Depends(verify_token)):
     """Get current user information"""
     ret = user_svc.get_user_info(payload["username"])
     return ret
@@ -1,16 +1,22 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from os import path as os_path
 from uuid import uuid4 as uuid_uuid4
+from fastapi import HTTPException, status
+from core.image_hash import perceptual_hash
 from repository.file_repo_interface import IGCSFileRepository
 from repository.fileinfo_repo_interface import IDbFileInfoRepository
+from repository.image_hash_index import ImageHashIndex
 from model.file_upload import FileUploadResponse, FileUploadInternal
 
 class FileUploadSvc:
     bucket_prefix="Snapshot/"
 
-    def __init__(self, gcs_file_repo: IGCSFileRepository, db_fileinfo_repo: IDbFileInfoRepository):
+    def __init__(self, gcs_file_repo: IGCSFileRepository, db_fileinfo_repo: IDbFileInfoRepository,
+                 image_hash_index: Optional[ImageHashIndex] = None):
         self.gcs_file_repo = gcs_file_repo
         self.db_fileinfo_repo = db_fileinfo_repo
+        # near-duplicate lookups, kept current by our uploads and deletes
+        self.image_hash_index = image_hash_index
 
     def upload_file(self, file_content: bytes, file_name: str, content_type: str, submission_id: str) -> FileUploadResponse:
         """Upload file to Google Cloud Storage"""
@@ -18,9 +24,13 @@ class FileUploadSvc:
         #file_extension = os_path.splitext(file_name)[1]
         #unique_file_name = f"{uuid_uuid4()}{file_extension}"
         unique_file_name = f"{uuid_uuid4()}"
+        # None for anything that isn't a decodable image
+        phash = perceptual_hash(file_content) if content_type.lower().startswith("image/") else None
 
         try:
             result = self.gcs_file_repo.upload_file(file_content=file_content, unique_file_name=unique_file_name, content_type=content_type, prefix=self.bucket_prefix)
+        except HTTPException:
+            raise
         except:
             raise Exception("Upload failed")
 
@@ -34,12 +44,18 @@ class FileUploadSvc:
                 content_type=content_type,
                 uploaded_at=result["uploaded_at"],
                 submission_id=submission_id,
-                bucket_path=result["bucket_path"])
+                bucket_path=result["bucket_path"],
+                phash=phash)
             self.db_fileinfo_repo.save_fileinfo(file_info)
+        except HTTPException:
+            self.gcs_file_repo.delete_file(file_name=unique_file_name, prefix=self.bucket_prefix)
+            raise
         except:
             self.gcs_file_repo.delete_file(file_name=unique_file_name, prefix=self.bucket_prefix)
             raise Exception("Save file info failed")
 
+        if phash and self.image_hash_index:
+            self.image_hash_index.add(unique_file_name, submission_id, phash)
         return FileUploadResponse(**file_info.model_dump())
 
     def delete_file(self, file_name: str) -> bool:
@@ -47,6 +63,8 @@ class FileUploadSvc:
         deleted = self.gcs_file_repo.delete_file(file_name=file_name, prefix=self.bucket_prefix)
         if deleted:
             self.db_fileinfo_repo.delete_fileinfo(file_name)
+            if self.image_hash_index:
+                self.image_hash_index.remove(file_name)
         return deleted
 
     def get_file_url(self, file_name: str) -> str:
@@ -78,4 +96,51 @@ class FileUploadSvc:
             return ret
         for file_info in files:
             ret.append(FileUploadResponse(**file_info.model_dump()))
-        return ret
\ No newline at end of file
+        return ret
+
+    def get_fileinfo_by_submission_ids(self, submission_ids: List[str]) -> Dict[str, List[FileUploadResponse]]:
+        """Files of many submissions with one query, submission_id -> files (missing when none)"""
+        files = self.db_fileinfo_repo.get_fileinfo_by_submission_ids(submission_ids)
+        return {submission_id: [FileUploadResponse(**file_info.model_dump()) for file_info in infos]
+                for submission_id, infos in files.items()}
+
+    def get_fileinfo_of_all_submissions(self) -> Dict[str, List[FileUploadResponse]]:
+        """Files of every submission, submission_id -> files (missing when none)"""
+        files = self.db_fileinfo_repo.get_fileinfo_of_all_submissions()
+        return {submission_id: [FileUploadResponse(**file_info.model_dump()) for file_info in infos]
+                for submission_id, infos in files.items()}
+
+    def list_version(self) -> Optional[str]:
+        """Version token of the stored file info"""
+        return self.db_fileinfo_repo.version_token()
+
+    def find_similar(self, file_name: str, max_distance: int, limit: int) -> dict:
+        """Images whose perceptual hash is within max_distance bits of the file's, closest first,
+        and the submissions they belong to"""
+        index = self.image_hash_index
+        if not index:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Image hash index is disabled")
+        if not index.ready:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Image hash index is not built yet",
+                                headers={"Retry-After": "5"})
+        phash = index.get(file_name)
+        if phash is None:
+            file_info = self.db_fileinfo_repo.get_fileinfo(file_name=file_name)
+            if file_info is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+            if not file_info.phash:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail="File has no perceptual hash (not an image, or uploaded before hashing)")
+            phash = file_info.phash
+        matches = [m for m in index.similar(phash, max_distance) if m[1] != file_name]
+        submissions = {}
+        for distance, _, submission_id in matches:
+            entry = submissions.setdefault(submission_id, {"submission_id": submission_id, "distance": distance, "file_count": 0})
+            entry["file_count"] += 1
+        return {
+            "file_name": file_name,
+            "phash": phash,
+            "files": [{"file_name": name, "submission_id": submission_id, "distance": distance}
+                      for distance, name, submission_id in matches[:limit]],
+            "submissions": list(submissions.values())[:limit],
+        }
@@ -1,5 +1,6 @@
 from typing import List, Optional
 from fastapi import HTTPException, status
+from core.projection import in_request_order
 from model.league import LeagueRequest, LeagueResponse
 from repository.league_repo_interface import ILeagueRepository
 
@@ -10,11 +11,17 @@ class LeagueSvc():
     def add_league_to_database(self, league_data: LeagueRequest) -> LeagueResponse:
         return self.league_repo.add(league_data)
     
-    def list_all_leagues(self) -> List[LeagueResponse]:
-        return self.league_repo.list()
+    def list_version(self) -> Optional[str]:
+        return self.league_repo.version_token()
+
+    def list_all_leagues(self, fields: Optional[List[str]] = None) -> List[LeagueResponse]:
+        return self.league_repo.list(fields)
     
-    def get_league_by_id(self, league_id: str) -> Optional[LeagueResponse]:
-        return self.league_repo.get(league_id)
+    def get_league_by_id(self, league_id: str, fields: Optional[List[str]] = None) -> Optional[LeagueResponse]:
+        return self.league_repo.get(league_id, fields)
+
+    def get_leagues_by_ids(self, league_ids: List[str], fields: Optional[List[str]] = None) -> List[dict]:
+        return in_request_order(league_ids, self.league_repo.get_many(league_ids, fields))
 
     def delete_league_by_id(self, league_id: str) -> Optional[dict]:
         league_info=self.league_repo.get(league_id)
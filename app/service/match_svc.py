@@ -1,5 +1,7 @@
 from typing import List, Optional
 from fastapi import HTTPException, status
+from core.limiter import BULK, priority
+from core.projection import in_request_order
 from model.match import MatchRequest, MatchResponse
 from repository.match_repo_interface import IMatchRepository
 
@@ -24,15 +26,30 @@ class MatchSvc():
                 "match_id": match_data.match_id
             }
 
-    def list_all_matches(self) -> List[MatchResponse]:
-        return self.match_repo.list_all()
+    def upsert_matches(self, matches: List[MatchRequest]) -> dict:
+        # one MERGE source row per match, the last entry of a repeated id wins
+        latest = {match.match_id: match for match in matches}
+        if not latest:
+            return {"received": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+        with priority(BULK):
+            counts = self.match_repo.upsert_many(list(latest.values()))
+        return {"received": len(latest), **counts}
+
+    def list_version(self) -> Optional[str]:
+        return self.match_repo.version_token()
+
+    def list_all_matches(self, fields: Optional[List[str]] = None) -> List[MatchResponse]:
+        return self.match_repo.list_all(fields)
     
-    def get_match(self, match_id: int) -> Optional[MatchResponse]:
-        match_info = self.match_repo.get(match_id)
+    def get_match(self, match_id: int, fields: Optional[List[str]] = None) -> Optional[MatchResponse]:
+        match_info = self.match_repo.get(match_id, fields)
         if not match_info:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Match not found")
         return match_info
 
+    def get_matches(self, match_ids: List[int], fields: Optional[List[str]] = None) -> List[dict]:
+        return in_request_order(match_ids, self.match_repo.get_many(match_ids, fields))
+
     def delete_match(self, match_id: int) -> Optional[dict]:
         match_info = self.match_repo.get(match_id)
         #print(match_info)
@@ -0,0 +1,255 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+from uuid import uuid4
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+from core.cache_backend import ICacheBackend
+from core.limiter import BULK, priority
+from service.url_submission_svc import UrlSubmissionSvc
+
+# answers meaning the content is gone (451: taken down for legal reasons)
+DEAD_STATUS_CODES = {404, 410, 451}
+# answers to HEAD that say nothing about the page, retried with GET
+RETRY_WITH_GET = {403, 405, 501}
+REDIRECT_STATUS_CODES = {301, 302, 303, 307, 308}
+
+class BlockedAddress(OSError):
+    """The host only resolves to addresses the checker must not reach"""
+
+def is_public_address(address: str) -> bool:
+    """False for private, loopback, link-local (cloud metadata), multicast and reserved addresses"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+class PublicResolver(AbstractResolver):
+    """Resolver that drops non-public addresses, so submitted URLs (and every redirect
+    they lead to) can't make the checker reach internal services or the metadata server.
+    The connector connects to what this returns, so DNS rebinding doesn't get around it."""
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        addresses = [a for a in await self._resolver.resolve(host, port, family) if is_public_address(a["host"])]
+        if not addresses:
+            raise BlockedAddress(f"{host} has no public address")
+        return addresses
+
+    async def close(self):
+        await self._resolver.close()
+
+def is_public_target(url: str) -> bool:
+    """http(s) URL whose host is a name (checked when resolved) or a public IP literal,
+    which aiohttp connects to without asking the resolver"""
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return False
+    try:
+        return is_public_address(parts.hostname)
+    except ValueError:
+        return True
+
+class UrlLivenessSvc:
+    """Re-checks whether submitted URLs are still up and records it in their status.
+
+    Each run takes the submissions whose status isn't final and probes their
+    URLs from one aiohttp session: at most `concurrency` requests in flight,
+    at most `per_host` per host over pooled keep-alive connections, and
+    requests to one host started at least `host_delay` seconds apart.
+
+    - A URL that answers gets live_status.
+    - A URL that is definitely gone (404, 410, 451, or a host that no longer
+      resolves) gets dead_status.
+    - Timeouts, 5xx and 429 leave the status alone until a later run.
+
+    Only changed statuses are written, batch_size at a time, each batch as one
+    batched repository update.
+
+    Redirects are followed by hand, at most max_redirects of them, and no hop
+    may reach a non-public address. With a shared cache backend only the
+    instance holding the lease runs the checks."""
+    def __init__(self, url_submission_svc: UrlSubmissionSvc, final_statuses: List[str], live_status: str, dead_status: str,
+                 interval: float, concurrency: int, per_host: int, host_delay: float, timeout: float, batch_size: int,
+                 user_agent: str, max_redirects: int = 5, lease_backend: Optional[ICacheBackend] = None,
+                 allow_private: bool = False):
+        self.url_submission_svc = url_submission_svc
+        self.final_statuses = set(final_statuses)
+        self.live_status = live_status
+        self.dead_status = dead_status
+        self.interval = interval
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.user_agent = user_agent
+        self.max_redirects = max_redirects
+        # only for local runs against liveness_test_server.py
+        self.allow_private = allow_private
+        self.lease_backend = lease_backend
+        self.lease_owner = uuid4().hex
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.skipped_runs = 0
+        self.blocked = 0
+        self.errors = 0
+        self.last_run: Optional[dict] = None
+
+    def candidates(self) -> List[Tuple[str, str, Optional[str]]]:
+        """(submission_id, url, status) of the submissions to check"""
+        with priority(BULK):
+            rows = self.url_submission_svc.list_all_url_submissions(["submission_id", "url", "status"])
+        return [
+            (row["submission_id"], row["url"], row["status"]) for row in rows
+            if row["status"] not in self.final_statuses and (row["url"] or "").lower().startswith(("http://", "https://"))
+        ]
+
+    async def _request(self, session: aiohttp.ClientSession, method: str, url: str) -> Tuple[int, Optional[str]]:
+        # the body is never read, leaving the block drops the connection
+        async with session.request(method, url, allow_redirects=False) as response:
+            return response.status, response.headers.get("Location")
+
+    async def _probe(self, session: aiohttp.ClientSession, url: str) -> Optional[bool]:
+        """True if the URL answers, False if it is gone, None when it can't be told"""
+        try:
+            for _ in range(self.max_redirects + 1):
+                if not self.allow_private and not is_public_target(url):
+                    raise BlockedAddress(f"{url} is not a public http(s) URL")
+                code, location = await self._request(session, "HEAD", url)
+                if code in RETRY_WITH_GET:
+                    code, location = await self._request(session, "GET", url)
+                if code not in REDIRECT_STATUS_CODES or not location:
+                    break
+                url = urljoin(url, location)
+            else:
+                # redirect loop, or a chain too long to be worth following
+                return None
+        except BlockedAddress:
+            with self._lock:
+                self.blocked += 1
+            return None
+        except aiohttp.ClientConnectorError as e:
+            if isinstance(e.os_error, BlockedAddress):
+                with self._lock:
+                    self.blocked += 1
+                return None
+            # NXDOMAIN is final, anything else about the connection may pass
+            return False if isinstance(e.os_error, socket.gaierror) and e.os_error.errno == socket.EAI_NONAME else None
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError):
+            return None
+        if code < 400:
+            return True
+        if code in DEAD_STATUS_CODES:
+            return False
+        return None
+
+    async def _check(self, session: aiohttp.ClientSession, slots: asyncio.Semaphore, hosts: Dict[str, list],
+                     submission: Tuple[str, str, Optional[str]]) -> Tuple[Tuple[str, str, Optional[str]], Optional[bool]]:
+        url = submission[1]
+        try:
+            host = (urlsplit(url).hostname or "").lower()
+        except ValueError:
+            return submission, None
+        # politeness first, so waiting on a busy host doesn't hold a global slot: one of
+        # the host's per_host connections is ours before we take a slot, so the request
+        # timeout never runs while we wait for the connection pool
+        gate = hosts.setdefault(host, [asyncio.Lock(), 0.0, asyncio.Semaphore(self.per_host)])
+        loop = asyncio.get_running_loop()
+        async with gate[2]:
+            async with gate[0]:
+                wait = gate[1] - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                gate[1] = loop.time() + self.host_delay
+            async with slots:
+                return submission, await self._probe(session, url)
+
+    def _write(self, statuses: Dict[str, str]) -> int:
+        try:
+            return self.url_submission_svc.set_statuses(statuses)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Failed to update {len(statuses)} URL submission statuses: {str(e)}")
+            return 0
+
+    async def check(self, submissions: List[Tuple[str, str, Optional[str]]]) -> dict:
+        """Probe the submissions and write the changed statuses, returns the counts"""
+        counts = {"checked": len(submissions), "live": 0, "dead": 0, "inconclusive": 0, "updated": 0}
+        # per-host limits are enforced before a slot is taken, the pool never makes anyone wait
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=0, ttl_dns_cache=300,
+                                         resolver=None if self.allow_private else PublicResolver())
+        # per request, so every redirect hop gets its own budget
+        timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.timeout, sock_read=self.timeout)
+        slots = asyncio.Semaphore(self.concurrency)
+        hosts: Dict[str, list] = {}
+        changes: Dict[str, str] = {}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": self.user_agent}) as session:
+            tasks = [asyncio.ensure_future(self._check(session, slots, hosts, submission)) for submission in submissions]
+            for done in asyncio.as_completed(tasks):
+                (submission_id, _, current), alive = await done
+                if alive is None:
+                    counts["inconclusive"] += 1
+                    continue
+                counts["live" if alive else "dead"] += 1
+                status = self.live_status if alive else self.dead_status
+                if status != current:
+                    changes[submission_id] = status
+                if len(changes) >= self.batch_size:
+                    # written from a worker thread, probes keep going meanwhile
+                    counts["updated"] += await asyncio.to_thread(self._write, changes)
+                    changes = {}
+        if changes:
+            counts["updated"] += await asyncio.to_thread(self._write, changes)
+        return counts
+
+    def holds_lease(self) -> bool:
+        """Take or renew the lease on the checks, good for two intervals (always held without a backend)"""
+        if self.lease_backend is None:
+            return True
+        return self.lease_backend.acquire_lease("url_liveness", self.lease_owner, 2 * self.interval)
+
+    def run_once(self) -> dict:
+        started = time.monotonic()
+        submissions = self.candidates()
+        counts = asyncio.run(self.check(submissions))
+        counts["seconds"] = round(time.monotonic() - started, 1)
+        counts["finished_at"] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self.runs += 1
+            self.last_run = counts
+        return counts
+
+    def _loop(self):
+        while True:
+            try:
+                if self.holds_lease():
+                    self.run_once()
+                else:
+                    with self._lock:
+                        self.skipped_runs += 1
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"URL liveness check failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="url-liveness", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"runs": self.runs, "skipped_runs": self.skipped_runs, "last_run": self.last_run,
+                    "blocked": self.blocked, "errors": self.errors}
@@ -1,12 +1,30 @@
 from json import loads as json_loads
-from fastapi import Form
+from fastapi import Form, HTTPException, status
+from pydantic import ValidationError
+from core.events import EventBroker
+from core.limiter import BULK, priority
+from core.projection import in_request_order
 from repository.url_submission_repo_interface import IUrlSubmissionRepository
-from model.url_submission import UrlSubmissionRequest
-from typing import List, Optional
+from repository.url_submission_replica import UrlSubmissionReplica
+from repository.url_search_index import UrlSearchIndex
+from model.url_submission import UrlSubmissionRequest, is_http_url
+from typing import Dict, List, Optional
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
 class UrlSubmissionSvc:
-    def __init__(self, url_submission_repo: IUrlSubmissionRepository):
+    def __init__(self, url_submission_repo: IUrlSubmissionRepository, event_broker: Optional[EventBroker] = None,
+                 replica: Optional[UrlSubmissionReplica] = None, search_index: Optional[UrlSearchIndex] = None):
         self.url_submission_repo = url_submission_repo
+        self.events = event_broker if event_broker else EventBroker()
+        # local copy for filters and aggregates, kept current by our own events
+        self.replica = replica
+        if replica:
+            self.events.add_listener(replica.on_event)
+        # URL substring search, kept current the same way
+        self.search_index = search_index
+        if search_index:
+            self.events.add_listener(search_index.on_event)
 
     def url_submission_request_form_text(self, url_submission_request_txt: str) -> UrlSubmissionRequest:
         """Get URL submission from json form"""
@@ -20,7 +38,7 @@ class UrlSubmissionSvc:
         """Add a new URL submission"""
         # Check file extension
         if url_submission_request.image_file_name:
-            if not url_submission_request.image_file_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+            if not url_submission_request.image_file_name.lower().endswith(IMAGE_EXTENSIONS):
                 raise Exception("Invalid file type. Only .png, .jpg, and .jpeg files are allowed.")
         # Check if URL already exists for this match_id
         if url_submission_request.match_id:
@@ -31,7 +49,7 @@ class UrlSubmissionSvc:
             if url_exists:
                 raise Exception("URL already exists for this match")
         
-        return self.url_submission_repo.add_url_submission(
+        submission = self.url_submission_repo.add_url_submission(
             url=url_submission_request.url,
             type=url_submission_request.type,
             league_id=url_submission_request.league_id,
@@ -39,18 +57,116 @@ class UrlSubmissionSvc:
             status=url_submission_request.status,
             image_file_name=url_submission_request.image_file_name
         )
+        self.events.publish("created", submission)
+        return submission
+
+    def bulk_add_url_submissions(self, items: list) -> dict:
+        """Add many URL submissions: validate all, check duplicates in one query, write once.
+        items are dicts, or exceptions for entries that could not be parsed; the report
+        has one entry per item, in order"""
+        report = [None] * len(items)
+        candidates = []
+        seen = set()
+        for index, item in enumerate(items):
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                if not isinstance(item, dict):
+                    raise ValueError("Expected an object")
+                request = UrlSubmissionRequest(**item)
+                if not is_http_url(request.url):
+                    raise ValueError("URL must be an absolute http(s) URL")
+                if request.image_file_name and not request.image_file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    raise ValueError("Invalid file type. Only .png, .jpg, and .jpeg files are allowed.")
+            except ValidationError as e:
+                report[index] = {"index": index, "status": "rejected", "detail": "; ".join(err["msg"] for err in e.errors())}
+                continue
+            except Exception as e:
+                report[index] = {"index": index, "status": "rejected", "detail": str(e)}
+                continue
+            # like single submissions, a URL is a duplicate only within its match
+            if request.match_id:
+                pair = (request.url, request.match_id)
+                if pair in seen:
+                    report[index] = {"index": index, "status": "duplicate", "url": request.url, "detail": "Duplicate URL in this request"}
+                    continue
+                seen.add(pair)
+            candidates.append((index, request))
+
+        # bulk work waits behind interactive requests for BigQuery capacity
+        with priority(BULK):
+            existing = self.url_submission_repo.find_existing_urls(list(seen))
+            new = []
+            for index, request in candidates:
+                if (request.url, request.match_id) in existing:
+                    report[index] = {"index": index, "status": "duplicate", "url": request.url, "detail": "URL already exists for this match"}
+                else:
+                    new.append((index, request))
+            added = self.url_submission_repo.add_url_submissions([request.model_dump() for _, request in new])
 
-    def get_url_submission(self, submission_id: str) -> Optional[dict]:
+        for (index, _), submission in zip(new, added):
+            report[index] = {"index": index, "status": "accepted", "url": submission["url"], "submission_id": submission["submission_id"]}
+            self.events.publish("created", submission)
+        statuses = [entry["status"] for entry in report]
+        return {
+            "accepted": statuses.count("accepted"),
+            "duplicates": statuses.count("duplicate"),
+            "rejected": statuses.count("rejected"),
+            "items": report,
+        }
+
+    def get_url_submission(self, submission_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
         """Get URL submission by ID"""
-        return self.url_submission_repo.get_url_submission_by_id(submission_id)
+        return self.url_submission_repo.get_url_submission_by_id(submission_id, fields)
+
+    def get_url_submissions(self, submission_ids: List[str], fields: Optional[List[str]] = None) -> List[dict]:
+        """Get URL submissions by ID, in request order with not-found entries"""
+        return in_request_order(submission_ids, self.url_submission_repo.get_url_submissions_by_ids(submission_ids, fields))
+
+    def list_version(self) -> Optional[str]:
+        """Version token of the submission list"""
+        return self.url_submission_repo.version_token()
 
-    def list_all_url_submissions(self) -> List[dict]:
+    def list_all_url_submissions(self, fields: Optional[List[str]] = None) -> List[dict]:
         """List all URL submissions"""
-        return self.url_submission_repo.list_all_url_submissions()
+        return self.url_submission_repo.list_all_url_submissions(fields)
+
+    def _fresh_replica(self) -> UrlSubmissionReplica:
+        if not self.replica:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="URL submission replica is disabled")
+        self.replica.ensure_fresh()
+        return self.replica
+
+    def replica_version(self) -> str:
+        """Version token of the replica, after catching up if it is stale"""
+        return self._fresh_replica().version()
+
+    def filter_url_submissions(self, filters: dict, sort: str, limit: int, offset: int) -> dict:
+        """Filtered, sorted page of URL submissions from the local replica, with the total"""
+        total, items = self._fresh_replica().query(filters, sort, limit, offset)
+        return {"total": total, "items": items}
+
+    def aggregate_url_submissions(self, group_by: str, filters: dict) -> List[dict]:
+        """Submission and file counts per group, from the local replica"""
+        return self._fresh_replica().aggregate(group_by, filters)
+
+    def search_url_submissions(self, q: str, limit: int, offset: int) -> dict:
+        """URL submissions whose URL contains q, best matches first, from the local index
+        once it is built and from the repository until then"""
+        q = q.strip().lower()
+        if self.search_index and self.search_index.ready:
+            source = "index"
+            total, submission_ids = self.search_index.search(q, limit, offset)
+        else:
+            source = "repository"
+            total, submission_ids = self.url_submission_repo.search_url_submissions(q, limit, offset)
+        found = self.url_submission_repo.get_url_submissions_by_ids(submission_ids) if submission_ids else {}
+        # submissions deleted since they were indexed drop out of the page
+        return {"total": total, "source": source, "items": [found[i] for i in submission_ids if i in found]}
 
     def update_url_submission(self, submission_id: str, url_submission_request: UrlSubmissionRequest) -> Optional[dict]:
         """Update URL submission"""
-        return self.url_submission_repo.update_url_submission(
+        submission = self.url_submission_repo.update_url_submission(
             submission_id=submission_id,
             url=url_submission_request.url,
             type=url_submission_request.type,
@@ -59,7 +175,23 @@ class UrlSubmissionSvc:
             status=url_submission_request.status,
             image_file_name=url_submission_request.image_file_name
         )
+        if submission:
+            self.events.publish("updated", submission)
+        return submission
+
+    def set_statuses(self, statuses: Dict[str, str]) -> int:
+        """Set the status of many submissions with one batched write, submission_id -> status;
+        returns how many existed"""
+        with priority(BULK):
+            updated = self.url_submission_repo.update_url_submission_statuses(statuses)
+            submissions = self.url_submission_repo.get_url_submissions_by_ids(list(updated)) if updated else {}
+        for submission in submissions.values():
+            self.events.publish("updated", submission)
+        return len(updated)
 
     def delete_url_submission(self, submission_id: str) -> bool:
         """Delete URL submission"""
-        return self.url_submission_repo.delete_url_submission(submission_id) 
\ No newline at end of file
+        deleted = self.url_submission_repo.delete_url_submission(submission_id)
+        if deleted:
+            self.events.publish("deleted", {"submission_id": submission_id})
+        return deleted
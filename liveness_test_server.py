@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the sites probed by the URL liveness checker.
+
+The path picks the answer, so submissions pointing here cover every case:
+  /live/...           200
+  /missing/...        404
+  /gone/...           410
+  /error/...          500
+  /slow/<seconds>/... 200 after a delay
+  /redirect/...       302 to /live/...
+  /nohead/...         405 to HEAD, 200 to GET
+It also reports the most requests it saw in flight per host and the shortest
+gap between two requests to one host, to check the politeness limits.
+127.0.0.1 and localhost count as different hosts.
+
+Usage:
+  python liveness_test_server.py --port 8081
+  python liveness_test_server.py --port 8081 --seed 2000 --api http://localhost:8080 --token <jwt>
+then run the API with LIVENESS_ENABLED=true and watch GET /metrics (url_liveness) and GET /stats here.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KINDS = ["live", "missing", "gone", "error", "slow/2", "redirect", "nohead"]
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        # host -> [in flight, max in flight, last start, shortest gap]
+        self.hosts = {}
+
+    def start(self, host):
+        with self.lock:
+            self.requests += 1
+            entry = self.hosts.setdefault(host, [0, 0, None, None])
+            now = time.monotonic()
+            if entry[2] is not None:
+                gap = now - entry[2]
+                entry[3] = gap if entry[3] is None else min(entry[3], gap)
+            entry[0] += 1
+            entry[1] = max(entry[1], entry[0])
+            entry[2] = now
+
+    def end(self, host):
+        with self.lock:
+            self.hosts[host][0] -= 1
+
+    def report(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hosts": {host: {"max_in_flight": e[1], "min_gap_seconds": round(e[3], 3) if e[3] is not None else None}
+                          for host, e in self.hosts.items()},
+            }
+
+stats = Stats()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self, code, body=b"", headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle(self):
+        if self.path == "/stats":
+            return self._answer(200, json.dumps(stats.report()).encode(), {"Content-Type": "application/json"})
+        host = self.headers.get("Host", "").split(":")[0]
+        stats.start(host)
+        try:
+            parts = self.path.strip("/").split("/")
+            kind = parts[0]
+            if kind == "live":
+                self._answer(200, b"ok")
+            elif kind == "missing":
+                self._answer(404)
+            elif kind == "gone":
+                self._answer(410)
+            elif kind == "slow":
+                time.sleep(float(parts[1]))
+                self._answer(200, b"ok")
+            elif kind == "redirect":
+                self._answer(302, headers={"Location": "/live/" + "/".join(parts[1:])})
+            elif kind == "nohead":
+                self._answer(405 if self.command == "HEAD" else 200, b"ok")
+            else:
+                self._answer(500)
+        finally:
+            stats.end(host)
+
+    do_GET = _handle
+    do_HEAD = _handle
+
+def seed(api, token, port, count):
+    """Submit count URLs pointing at this server"""
+    items = []
+    for i in range(count):
+        host = random.choice(["127.0.0.1", "localhost"])
+        items.append({"url": f"http://{host}:{port}/{random.choice(KINDS)}/{i}", "status": "reported"})
+    for i in range(0, len(items), 500):
+        request = urllib.request.Request(
+            f"{api}/url_submission/bulk", data=json.dumps(items[i:i + 500]).encode(), method="POST",
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        )
+        with urllib.request.urlopen(request) as response:
+            print(f"Seeded: {json.loads(response.read())['accepted']} accepted")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=0, help="submit this many URLs pointing here before serving")
+    parser.add_argument("--api", default="http://localhost:8080")
+    parser.add_argument("--token", help="JWT for --seed")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), Handler)
+    server.daemon_threads = True
+    if args.seed:
+        seed(args.api, args.token, args.port, args.seed)
+    print(f"Serving on port {args.port}, Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stats.report(), indent=2))
+
+if __name__ == "__main__":
+    main()